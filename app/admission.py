@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import TypedDict
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionMetrics(TypedDict):
+    limit: int
+    in_flight: int
+    queue_size: int
+    queued: int
+    admitted: int
+    shed: int
+
+
+class AdmissionRejectedError(Exception):
+    """Raised if a request is shed as the wait queue of its upstream dependency is full."""
+
+    def __init__(self, dependency: str, retry_after: int) -> None:
+        super().__init__(f"Too many requests waiting for {dependency}, retry in {retry_after}s")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Limits the requests to an upstream dependency (e.g. the ViCare API) to `limit` concurrent ones.
+
+    Further requests wait in a queue of at most `queue_size` requests, any request beyond that is shed immediately with
+    an `AdmissionRejectedError`. Requests waiting in the queue don't occupy a thread of the threadpool, so they cannot
+    starve requests not depending on the upstream (e.g. `/health`).
+
+    Must only be used from the event loop, which is why no additional locking is needed.
+    """
+
+    def __init__(self, dependency: str, limit: int, queue_size: int, retry_after: int) -> None:
+        self._dependency = dependency
+        self._limit = limit
+        self._queue_size = queue_size
+        self._retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(limit)
+        self._in_flight = 0
+        self._queued = 0
+        self._admitted = 0
+        self._shed = 0
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._semaphore.locked():
+            if self._queued >= self._queue_size:
+                self._shed += 1
+                logger.warning("Shedding request as %d requests are waiting for %s", self._queued, self._dependency)
+                raise AdmissionRejectedError(self._dependency, self._retry_after)
+
+            self._queued += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self._in_flight += 1
+        self._admitted += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def get_metrics(self) -> AdmissionMetrics:
+        return AdmissionMetrics(
+            limit=self._limit,
+            in_flight=self._in_flight,
+            queue_size=self._queue_size,
+            queued=self._queued,
+            admitted=self._admitted,
+            shed=self._shed,
+        )
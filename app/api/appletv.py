@@ -2,32 +2,42 @@ import logging
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException
-from pyatv.const import PowerState
 from starlette import status
 
-from app.dependencies import (
-    AppleTvConnection,
-    get_appletv_connection,
-)
+from app import dependencies
+from app.appletv import AppleTvState
+from app.dependencies import get_appletv_name, get_appletv_state
 
 logger = logging.getLogger(__name__)
 
 ROUTE_PREFIX_APPLETV = "/appletv"
 
-router = APIRouter(prefix=ROUTE_PREFIX_APPLETV)
+router = APIRouter(
+    prefix=ROUTE_PREFIX_APPLETV,
+    dependencies=[Depends(dependencies.require_appletv_enabled), Depends(dependencies.admit_appletv)],
+)
 
 
 @router.get("")
-def get_state(atv_connection: Annotated[AppleTvConnection | None, Depends(get_appletv_connection)]) -> dict:
-    if atv_connection is None:
-        logger.warning("Apple TV connection not available")
-        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "AppleTV connection not available")
+@router.get("/{name}")
+def get_state(
+    name: Annotated[str, Depends(get_appletv_name)],
+    atv_state: Annotated[AppleTvState, Depends(get_appletv_state)],
+) -> dict:
+    if atv_state.power_state is None:
+        logger.warning("Apple TV %s not connected yet", name)
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, f"AppleTV {name} connection not available yet")
+
+    # already imported by connecting to the Apple TV
+    from pyatv.const import PowerState
 
     return {
         "atv": {
-            "host": str(atv_connection.host),
-            "port": atv_connection.port,
-            "status": "connected",
+            "name": name,
+            "host": str(atv_state.host),
+            "port": atv_state.port,
+            # "reconnecting" if the connection died, i.e. the state is the last known one
+            "status": atv_state.connection,
         },
-        "active": 1 if atv_connection.atv.power.power_state == PowerState.On else 0,
+        "active": 1 if atv_state.power_state == PowerState.On else 0,
     }
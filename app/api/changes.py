@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Query
+
+from app import dependencies
+from app.changes import Change, ChangeLog
+
+ROUTE_PREFIX_CHANGES = "/changes"
+router = APIRouter(prefix=ROUTE_PREFIX_CHANGES)
+
+
+@router.get("")
+def get_changes(
+    change_log: Annotated[ChangeLog, Depends(dependencies.get_change_log)],
+    since: Annotated[datetime | None, Query(description="Only changes detected after this point in time.")] = None,
+    device: Annotated[str | None, Query(description="Only changes of this device (key).")] = None,
+) -> list[dict]:
+    return [_to_dict(change) for change in change_log.since(since.timestamp() if since else None, device)]
+
+
+def _to_dict(change: Change) -> dict:
+    return {
+        "device": change.device,
+        "featureTimestamp": change.feature_timestamp,
+        "new": change.new,
+        "old": change.old,
+        "path": change.path,
+        "timestamp": datetime.fromtimestamp(change.timestamp).isoformat(),
+    }
@@ -1,17 +1,44 @@
 import enum
+from collections.abc import Callable
+from functools import partial
 from typing import Annotated
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Path
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query
 from PyViCare import PyViCareHeatPump
+from PyViCare.PyViCareHeatCurveCalculation import (
+    heat_curve_formular_variant1,
+    heat_curve_formular_variant2,
+)
 from PyViCare.PyViCareHeatingDevice import HeatingCircuit
+from PyViCare.PyViCareService import hasRoles
+from PyViCare.PyViCareUtils import PyViCareNotSupportedFeatureError
 from starlette import status
 
+from app import dependencies
+from app.api.commands import (
+    ForceCommand,
+    WaitForCommand,
+    check_command,
+    is_unchanged,
+    skip_command,
+    submit_command,
+    unchanged_since,
+)
 from app.api.heating import ROUTE_PREFIX_HEATING
 from app.api.heatpump import get_single_heatpump
 from app.api.types import HeatingCommand
+from app.commands import Action, CommandQueue
+from app.features import (
+    DeviceSnapshot,
+    get_cached_snapshot,
+    get_snapshot,
+    properties,
+    value,
+)
+from app.heating_curve import MAX_POINTS, evaluate, outside_temperatures
 
 ROUTE_PREFIX_HEATING_CIRCUIT = f"{ROUTE_PREFIX_HEATING}/circuit"
-router = APIRouter(prefix=ROUTE_PREFIX_HEATING_CIRCUIT)
+router = APIRouter(prefix=ROUTE_PREFIX_HEATING_CIRCUIT, dependencies=[Depends(dependencies.admit_vicare)])
 
 
 class HeatingCircuitMode(enum.Enum):
@@ -50,74 +77,211 @@ class HeatingCircuitProgram(enum.Enum):
         }.get(value, -1)
 
 
-def get_single_circuit(heatpump: PyViCareHeatPump = Depends(get_single_heatpump)) -> HeatingCircuit:
+def get_single_circuit(
+    heatpump: PyViCareHeatPump = Depends(get_single_heatpump),
+    circuit_no: int | None = None,
+) -> HeatingCircuit:
     result = [c for c in heatpump.circuits]
+    if circuit_no is not None:
+        result = [c for c in result if str(c.circuit) == str(circuit_no)]
+        if len(result) <= 0:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, f"No circuit {circuit_no} found.")
     if len(result) <= 0:
         raise HTTPException(422, "No circuit device found.")
     if len(result) > 1:
-        raise HTTPException(422, "Multiple circuits found, currently unsupported.")
+        raise HTTPException(
+            422, f"Multiple circuits found, address one of them via `{ROUTE_PREFIX_HEATING_CIRCUIT}/{{no}}`."
+        )
     return result[0]
 
 
+MAX_CURVES = 100
+
+
+# registered before `/{circuit_no}`, which would match `/curve` otherwise
+@router.get("/{circuit_no}/curve")
+@router.get("/curve")
+def get_curve(
+    circuit: HeatingCircuit = Depends(get_single_circuit),
+    shift: Annotated[list[float] | None, Query(description="What-if shift(s), defaults to the current one")] = None,
+    slope: Annotated[list[float] | None, Query(description="What-if slope(s), defaults to the current one")] = None,
+    inside: Annotated[float | None, Query(description="Defaults to the temperature of the active program")] = None,
+    start: Annotated[float, Query(description="Lowest outside temperature")] = -20.0,
+    end: Annotated[float, Query(description="Highest outside temperature")] = 20.0,
+    step: Annotated[float, Query(gt=0)] = 1.0,
+) -> dict:
+    """Evaluate the heating curve (or candidate curves) of a circuit for a range of outside temperatures.
+
+    Multiple candidates are given as pairs of `shift` and `slope`, e.g. `?shift=0&slope=1.2&shift=2&slope=1.0`, a single
+    one of either is combined with all of the other, e.g. `?slope=1.0&slope=1.2&slope=1.4`.
+    """
+    no = circuit.circuit
+    snapshot = get_snapshot(circuit.device)
+    features = snapshot.below(f"heating.circuits.{no}.")
+    shifts = shift or [value(features, "heating.curve", "shift")]
+    slopes = slope or [value(features, "heating.curve", "slope")]
+    if len(shifts) != len(slopes) and 1 not in (len(shifts), len(slopes)):
+        raise HTTPException(422, "Provide as many shifts as slopes, or a single one of either.")
+    # a single shift or slope is combined with all of the other
+    if len(shifts) == 1:
+        shifts *= len(slopes)
+    if len(slopes) == 1:
+        slopes *= len(shifts)
+    curves = list(zip(shifts, slopes, strict=True))
+    if len(curves) > MAX_CURVES:
+        raise HTTPException(422, f"At most {MAX_CURVES} curves can be evaluated at once.")
+    if end < start or (end - start) / step + 1 > MAX_POINTS:
+        raise HTTPException(422, f"Provide at most {MAX_POINTS} outside temperatures from start to end.")
+
+    if inside is None:
+        try:
+            program = value(features, "operating.programs.active")
+            inside = value(features, f"operating.programs.{program}", "temperature")
+        except PyViCareNotSupportedFeatureError:
+            raise HTTPException(422, "Active program has no temperature, provide an inside temperature.") from None
+    levels = properties(features, "temperature.levels")
+    minimum, maximum = levels["min"], levels["max"]
+    formular = get_heat_curve_formular(
+        circuit.device.roles, len(value(snapshot.features, "heating.circuits", "enabled"))
+    )
+    return {
+        "circuitNo": no,
+        "curves": [
+            {
+                "shift": curve_shift,
+                "slope": curve_slope,
+                "supply": evaluate(formular, inside, start, end, step, curve_shift, curve_slope, minimum, maximum),
+            }
+            for curve_shift, curve_slope in curves
+        ],
+        "inside": inside,
+        "levels": {"min": minimum, "max": maximum},
+        "outside": outside_temperatures(start, end, step),
+    }
+
+
+@router.get("/{circuit_no}")
 @router.get("")
 def get_circuit(circuit: HeatingCircuit = Depends(get_single_circuit)) -> dict:
     no = circuit.circuit
-    program = circuit.getActiveProgram()
+    snapshot = get_snapshot(circuit.device)
+    # single pass over the features of this circuit only, keyed relative to the circuit, e.g. `heating.curve`
+    features = snapshot.below(f"heating.circuits.{no}.")
+
+    program = value(features, "operating.programs.active")
     programs = {
-        program: circuit.getProperty(f"heating.circuits.{no}.operating.programs.{program}")["properties"]
-        for program in circuit.getPrograms()
+        name.removeprefix("operating.programs."): feature.properties
+        for name, feature in features.items()
+        if name.startswith("operating.programs.")
+        and name.count(".") == 2
+        and name != "operating.programs.active"
+        and "active" in feature.properties
     }
 
-    mode = circuit.getActiveMode()
+    mode = value(features, "operating.modes.active")
+    shift = value(features, "heating.curve", "shift")
+    slope = value(features, "heating.curve", "slope")
+    levels = properties(features, "temperature.levels")
     return {
-        "active": 1 if circuit.getActive() else 0,
+        "active": 1 if value(snapshot.features, f"heating.circuits.{no}", "active") else 0,
         "circuitNo": no,
-        "frostProtectionActive": 1 if circuit.getFrostProtectionActive() else 0,
+        "frostProtectionActive": 1 if value(features, "frostprotection", "status") == "on" else 0,
         "heatingCurve": {
-            "shift": circuit.getHeatingCurveShift(),
-            "slope": circuit.getHeatingCurveSlope(),
+            "shift": shift,
+            "slope": slope,
         },
         "mode": mode,
         "modeNo": HeatingCircuitMode.no_of(mode),
-        "name": circuit.getName(),
-        "pumpActive": 1 if circuit.getCirculationPumpActive() else 0,
+        "name": value(snapshot.features, f"heating.circuits.{no}", "name"),
+        "pumpActive": 1 if value(features, "circulation.pump", "status") == "on" else 0,
         "programs": {
             "active": program,
             "activeNo": HeatingCircuitProgram.no_of(program),
         }
         | {
             program: {
-                "active": 1 if v["active"]["value"] else 0,
-                "demand": v["demand"]["value"] if "demand" in v else "n/a",
-                "temperature": v["temperature"]["value"] if "temperature" in v else "n/a",
+                "active": 1 if v["active"] else 0,
+                "demand": v.get("demand", "n/a"),
+                "temperature": v.get("temperature", "n/a"),
             }
             for program, v in programs.items()
         },
         "temperature": {
             "levels": {
-                "min": circuit.getTemperatureLevelsMin(),
-                "max": circuit.getTemperatureLevelsMax(),
+                "min": levels["min"],
+                "max": levels["max"],
             },
-            "supply": circuit.getSupplyTemperature(),
-            "target": circuit.getProperty(f"heating.circuits.{no}.temperature")["properties"]["value"]["value"],
-            "targetCalc": circuit.getTargetSupplyTemperature(),
+            "supply": value(features, "sensors.temperature.supply"),
+            "target": value(features, "temperature"),
+            "targetCalc": _get_target_supply_temperature(
+                circuit, snapshot, programs.get(program), shift, slope, levels
+            ),
         },
     }
 
 
-@router.put("/mode/{mode}", status_code=status.HTTP_204_NO_CONTENT)
+def _get_target_supply_temperature(
+    circuit: HeatingCircuit,
+    snapshot: DeviceSnapshot,
+    active_program: dict | None,
+    shift: float,
+    slope: float,
+    levels: dict,
+) -> float | None:
+    """Calculate target supply temperature like `HeatingCircuit.getTargetSupplyTemperature` but on the snapshot."""
+    try:
+        inside = active_program["temperature"]
+        outside = value(snapshot.features, "heating.sensors.temperature.outside")
+        no_of_circuits = len(value(snapshot.features, "heating.circuits", "enabled"))
+    except (KeyError, TypeError, PyViCareNotSupportedFeatureError):
+        return None
+
+    formular = get_heat_curve_formular(circuit.device.roles, no_of_circuits)
+    target_supply = formular(outside - inside, inside, shift, slope)
+    return float(round(max(levels["min"], min(target_supply, levels["max"])), 1))
+
+
+def get_heat_curve_formular(roles: list[str], no_of_circuits: int) -> Callable[[float, float, float, float], float]:
+    """Select the heat curve formular like `HeatingDevice.get_heat_curve_formular` without re-reading circuits."""
+    if hasRoles(["type:heatpump", "type:E3"], roles):
+        return heat_curve_formular_variant1
+    if hasRoles(["type:heatpump"], roles) and no_of_circuits == 1:
+        return heat_curve_formular_variant2
+    return heat_curve_formular_variant1
+
+
+@router.put("/{circuit_no}/mode/{mode}", status_code=status.HTTP_202_ACCEPTED)
+@router.put("/mode/{mode}", status_code=status.HTTP_202_ACCEPTED)
 def set_mode(
     mode: Annotated[HeatingCircuitMode, Path(title="The heating circuit mode")],
+    command_queue: Annotated[CommandQueue, Depends(dependencies.get_command_queue)],
+    wait: WaitForCommand = False,
+    force: ForceCommand = False,
     circuit: HeatingCircuit = Depends(get_single_circuit),
 ):
-    circuit.setMode(mode.value)
+    feature = f"heating.circuits.{circuit.circuit}.operating.modes.active"
+    snapshot = get_cached_snapshot(circuit.device)
+    check_command(snapshot, feature, "setMode", {"mode": mode.value})
+    return submit_command(
+        command_queue,
+        circuit.device.accessor,
+        f"circuit.{circuit.circuit}.mode",
+        mode.value,
+        lambda: circuit.setMode(mode.value),
+        wait,
+        unchanged_since(snapshot, force, lambda features: value(features, feature) == mode.value),
+    )
 
 
-@router.put("/program/{program}", status_code=status.HTTP_204_NO_CONTENT)
+@router.put("/{circuit_no}/program/{program}", status_code=status.HTTP_202_ACCEPTED)
+@router.put("/program/{program}", status_code=status.HTTP_202_ACCEPTED)
 def set_program(
     command: Annotated[HeatingCommand, Body()],
     program: Annotated[HeatingCircuitProgram, Path(title="The heating circuit program")],
     # program: Annotated[HeatingCircuitProgram, Path(title="The heating circuit program"), PlainSerializer(lambda x: parse_program(x), HeatingCircuitProgram)],
+    command_queue: Annotated[CommandQueue, Depends(dependencies.get_command_queue)],
+    wait: WaitForCommand = False,
+    force: ForceCommand = False,
     circuit: HeatingCircuit = Depends(get_single_circuit),
 ):
     if not program.manually_settable:
@@ -126,27 +290,71 @@ def set_program(
             detail=f"Can only activate {[p for p in HeatingCircuitProgram if p.manually_settable]} manually.",
         )
 
-    if command == HeatingCommand.Deactivate:
-        if program == HeatingCircuitProgram.Default:
-            raise HTTPException(
-                status.HTTP_405_METHOD_NOT_ALLOWED,
-                detail="Can only activate Dummy value 'Default', but not deactivate.",
+    if command == HeatingCommand.Deactivate and program == HeatingCircuitProgram.Default:
+        raise HTTPException(
+            status.HTTP_405_METHOD_NOT_ALLOWED,
+            detail="Can only activate Dummy value 'Default', but not deactivate.",
+        )
+
+    programs = f"heating.circuits.{circuit.circuit}.operating.programs"
+    snapshot = get_cached_snapshot(circuit.device)
+
+    def unchanged(p: HeatingCircuitProgram, active: bool) -> float | None:
+        return unchanged_since(
+            snapshot, force, lambda features: value(features, f"{programs}.{p.value}", "active") == active
+        )
+
+    action: Action
+    name = f"circuit.{circuit.circuit}.program.{program.value}"
+    if program == HeatingCircuitProgram.Default:
+        others = [p for p in HeatingCircuitProgram if p.manually_settable and p != program]
+        # only the programs known to be inactive, also regarding their own pending and recently executed commands
+        deactivations = [
+            p
+            for p in others
+            if not is_unchanged(
+                command_queue,
+                circuit.device.accessor,
+                f"circuit.{circuit.circuit}.program.{p.value}",
+                unchanged(p, active=False),
             )
-        else:
-            circuit.deactivateProgram(program.value)
-    elif command == HeatingCommand.Activate:
-        if program == HeatingCircuitProgram.Default:
-            for p in HeatingCircuitProgram:
-                if p.manually_settable and p != program:
-                    circuit.deactivateProgram(p.value)
-        else:
-            circuit.activateProgram(program.value)
-
-
-@router.put("/program/{program}/{temperature}", status_code=status.HTTP_204_NO_CONTENT)
+        ]
+        if not deactivations and snapshot is not None:
+            skipped = skip_command(command_queue, circuit.device.accessor, name, command.value, snapshot.created_at)
+            if skipped is not None:
+                return skipped
+        # never an empty command, i.e. all if the known state is outdated regarding the default program itself
+        deactivations = deactivations or others
+        for p in deactivations:
+            check_command(snapshot, f"{programs}.{p.value}", "deactivate", {})
+        # executed concurrently
+        action = [partial(circuit.deactivateProgram, p.value) for p in deactivations]
+        since = None
+    else:
+        check_command(snapshot, f"{programs}.{program.value}", command.value, {})
+        activate = command == HeatingCommand.Activate
+        action = partial(circuit.activateProgram if activate else circuit.deactivateProgram, program.value)
+        since = unchanged(program, active=activate)
+
+    return submit_command(
+        command_queue,
+        circuit.device.accessor,
+        name,
+        command.value,
+        action,
+        wait,
+        since,
+    )
+
+
+@router.put("/{circuit_no}/program/{program}/{temperature}", status_code=status.HTTP_202_ACCEPTED)
+@router.put("/program/{program}/{temperature}", status_code=status.HTTP_202_ACCEPTED)
 def set_program_temperature(
     program: Annotated[HeatingCircuitProgram, Path(title="The heating circuit program")],
     temperature: Annotated[int, Path(title="The temperature of the provided heating circuit program", ge=10, le=30)],
+    command_queue: Annotated[CommandQueue, Depends(dependencies.get_command_queue)],
+    wait: WaitForCommand = False,
+    force: ForceCommand = False,
     circuit: HeatingCircuit = Depends(get_single_circuit),
 ):
     if not program.temperature_settable:
@@ -154,4 +362,15 @@ def set_program_temperature(
             status.HTTP_405_METHOD_NOT_ALLOWED,
             detail=f"Can only set temperature of {[p for p in HeatingCircuitProgram if p.temperature_settable]} manually.",
         )
-    circuit.setProgramTemperature(program.value, temperature)
+    feature = f"heating.circuits.{circuit.circuit}.operating.programs.{program.value}"
+    snapshot = get_cached_snapshot(circuit.device)
+    check_command(snapshot, feature, "setTemperature", {"targetTemperature": temperature})
+    return submit_command(
+        command_queue,
+        circuit.device.accessor,
+        f"circuit.{circuit.circuit}.program.{program.value}.temperature",
+        temperature,
+        lambda: circuit.setProgramTemperature(program.value, temperature),
+        wait,
+        unchanged_since(snapshot, force, lambda features: value(features, feature, "temperature") == temperature),
+    )
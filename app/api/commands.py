@@ -0,0 +1,125 @@
+from collections.abc import Callable
+from datetime import datetime
+from typing import Annotated, Any
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from PyViCare.PyViCareService import ViCareDeviceAccessor
+from PyViCare.PyViCareUtils import PyViCareNotSupportedFeatureError
+from starlette import status
+
+from app import dependencies
+from app.commands import Action, Command, CommandQueue
+from app.features import DeviceSnapshot, Feature, validate_command
+from app.structured_logging import get_request_context
+
+ROUTE_PREFIX_COMMANDS = "/commands"
+router = APIRouter(prefix=ROUTE_PREFIX_COMMANDS)
+
+WaitForCommand = Annotated[
+    bool,
+    Query(description="Execute the command synchronously (responding 204) instead of debounced in the background."),
+]
+ForceCommand = Annotated[
+    bool,
+    Query(description="Send the command even if the device is already in the requested state."),
+]
+
+
+def check_command(snapshot: DeviceSnapshot | None, feature: str, command: str, params: dict[str, Any]) -> None:
+    """Reject a command locally (with 405, like the ViCare API would) if the command metadata of `snapshot`, the last
+    fetched features of the device, rules it out, see `validate_command`. Not checked if they were never fetched.
+    """
+    if snapshot is not None:
+        validate_command(snapshot, feature, command, params)
+
+
+def unchanged_since(
+    snapshot: DeviceSnapshot | None, force: bool, unchanged: Callable[[dict[str, Feature]], bool]
+) -> float | None:
+    """The time the device was known to be in the state requested by a command, i.e. if the features of `snapshot`
+    are `unchanged` by it. None if not known (e.g. missing features) or if the command is to be sent anyway (`force`).
+    """
+    if force or snapshot is None:
+        return None
+    try:
+        return snapshot.created_at if unchanged(snapshot.features) else None
+    except PyViCareNotSupportedFeatureError:
+        return None
+
+
+def submit_command(
+    command_queue: CommandQueue,
+    accessor: ViCareDeviceAccessor,
+    name: str,
+    value: Any,
+    action: Action,
+    wait: bool,
+    unchanged_since: float | None = None,
+) -> Response | dict:
+    """Submit a command for the device of `accessor`, responding 204 if `wait`ed for or 202 and the command otherwise.
+    Its upstream calls are charged to the client of the request once it is sent, see `RateLimiter`.
+
+    If the device was known to be in the requested state `unchanged_since`, the command is skipped if possible (see
+    `CommandQueue.skip`), responding 200 and the skipped command.
+    """
+    if unchanged_since is not None:
+        skipped = skip_command(command_queue, accessor, name, value, unchanged_since)
+        if skipped is not None:
+            return skipped
+
+    context = get_request_context()
+    command = command_queue.submit(
+        _device(accessor), name, value, action, wait, context.charge_upstream if context is not None else None
+    )
+    if wait:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return _to_dict(command)
+
+
+def skip_command(
+    command_queue: CommandQueue, accessor: ViCareDeviceAccessor, name: str, value: Any, unchanged_since: float
+) -> JSONResponse | None:
+    """Skip a command for the device of `accessor` if possible (see `CommandQueue.skip`), responding 200 and the
+    skipped command, else None.
+    """
+    skipped = command_queue.skip(_device(accessor), name, value, unchanged_since)
+    return JSONResponse(_to_dict(skipped)) if skipped is not None else None
+
+
+def is_unchanged(
+    command_queue: CommandQueue, accessor: ViCareDeviceAccessor, name: str, unchanged_since: float | None
+) -> bool:
+    """Whether the device of `accessor` is known to be in the state requested by command `name` (see
+    `CommandQueue.is_unchanged`), False if not known `unchanged_since`.
+    """
+    return unchanged_since is not None and command_queue.is_unchanged(_device(accessor), name, unchanged_since)
+
+
+@router.get("/{command_id}")
+def get_command(
+    command_id: str,
+    command_queue: Annotated[CommandQueue, Depends(dependencies.get_command_queue)],
+) -> dict:
+    command = command_queue.get(command_id)
+    if command is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"Unknown command '{command_id}'.")
+    return _to_dict(command)
+
+
+def _device(accessor: ViCareDeviceAccessor) -> str:
+    return f"{accessor.serial}.{accessor.device_id}"
+
+
+def _to_dict(command: Command) -> dict:
+    return {
+        "commandId": command.id,
+        "coalesced": command.coalesced,
+        "command": command.name,
+        "device": command.device,
+        "error": command.error,
+        "executedAt": datetime.fromtimestamp(command.executed_at).isoformat() if command.executed_at else None,
+        "status": command.status,
+        "submittedAt": datetime.fromtimestamp(command.submitted_at).isoformat(),
+        "value": command.value,
+    }
@@ -0,0 +1,57 @@
+from collections.abc import Callable
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from PyViCare import PyViCareDeviceConfig
+from PyViCare.PyViCare import PyViCare
+from starlette import status
+
+from app import dependencies
+
+ROUTE_PREFIX_DEVICES = "/devices"
+# device-addressed routes are the regular routes mounted below this prefix (see `app.main`)
+ROUTE_PREFIX_DEVICE = f"{ROUTE_PREFIX_DEVICES}/{{device_id}}"
+
+router = APIRouter(prefix=ROUTE_PREFIX_DEVICES, dependencies=[Depends(dependencies.admit_vicare)])
+
+
+def get_device_key(device: PyViCareDeviceConfig) -> str:
+    """Unique key of a device over all installations, as device ids are only unique per gateway."""
+    return f"{device.accessor.serial}.{device.device_id}"
+
+
+def select_single_device(
+    devices: list[PyViCareDeviceConfig],
+    device_id: str | None,
+    kind: str,
+    matches: Callable[[PyViCareDeviceConfig], bool],
+) -> PyViCareDeviceConfig:
+    """Select the only device of `kind` or, if given, the one addressed by `device_id` (plain id or device key)."""
+    result = [d for d in devices if matches(d)]
+    if device_id is not None:
+        result = [d for d in result if device_id in (str(d.device_id), get_device_key(d))]
+        if len(result) <= 0:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, f"No {kind} device '{device_id}' found.")
+    if len(result) <= 0:
+        raise HTTPException(422, f"No {kind} device found.")
+    if len(result) > 1:
+        raise HTTPException(
+            422, f"Multiple {kind} devices found, address one of them via `{ROUTE_PREFIX_DEVICE}` routes."
+        )
+    return result[0]
+
+
+@router.get("")
+def get_devices(vicare: Annotated[PyViCare, Depends(dependencies.get_vicare)]) -> list[dict]:
+    return [
+        {
+            "deviceId": device.device_id,
+            "deviceKey": get_device_key(device),
+            "installationId": device.accessor.id,
+            "gatewaySerial": device.accessor.serial,
+            "model": device.device_model,
+            "roles": device.roles,
+            "status": device.status,
+        }
+        for device in vicare.devices
+    ]
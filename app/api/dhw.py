@@ -2,16 +2,39 @@ import enum
 from typing import Annotated
 
 from fastapi import APIRouter, Body, Depends, Path
-from PyViCare import PyViCare
+from PyViCare import PyViCareDeviceConfig
 from PyViCare.PyViCareHeatingDevice import HeatingDevice
+from PyViCare.PyViCareUtils import (
+    VICARE_DAYS,
+    PyViCareNotSupportedFeatureError,
+    ViCareTimer,
+    parse_time_as_delta,
+    time_as_delta,
+)
 from starlette import status
 
 from app import dependencies
+from app.api.commands import (
+    ForceCommand,
+    WaitForCommand,
+    check_command,
+    submit_command,
+    unchanged_since,
+)
 from app.api.heating import ROUTE_PREFIX_HEATING, get_single_heating_device
 from app.api.types import HeatingCommand
+from app.commands import CommandQueue
+from app.features import (
+    DeviceSnapshot,
+    constraint,
+    get_cached_snapshot,
+    get_snapshot,
+    properties,
+    value,
+)
 
 ROUTE_PREFIX_HEATING_DHW = f"{ROUTE_PREFIX_HEATING}/dhw"
-router = APIRouter(prefix=ROUTE_PREFIX_HEATING_DHW)
+router = APIRouter(prefix=ROUTE_PREFIX_HEATING_DHW, dependencies=[Depends(dependencies.admit_vicare)])
 
 
 class HeatingDomesticHotWaterLevel(enum.Enum):
@@ -19,48 +42,113 @@ class HeatingDomesticHotWaterLevel(enum.Enum):
     Temp2 = "temp2"
 
 
-def get_single_heating(vicare: PyViCare = Depends(dependencies.get_vicare)) -> HeatingDevice:
-    return get_single_heating_device(vicare).asGeneric()
+def get_single_heating(device: PyViCareDeviceConfig = Depends(get_single_heating_device)) -> HeatingDevice:
+    return device.asGeneric()
 
 
 @router.get("")
 def get_dhw(heating: HeatingDevice = Depends(get_single_heating)) -> dict:
+    snapshot = get_snapshot(heating)
+    features = snapshot.below("heating.dhw.")
     return {
-        "active": 1 if heating.getDomesticHotWaterActive() else 0,
-        "chargingActive": 1 if heating.getDomesticHotWaterChargingActive() else 0,
+        "active": 1 if value(snapshot.features, "heating.dhw", "status") == "on" else 0,
+        "chargingActive": 1 if value(features, "charging", "active") else 0,
         "levels": {
-            "main": heating.getDomesticHotWaterConfiguredTemperature(),
-            "max": heating.getDomesticHotWaterMaxTemperature(),
-            "min": heating.getDomesticHotWaterMinTemperature(),
-            "temp2": heating.getDomesticHotWaterConfiguredTemperature2(),
+            "main": value(features, "temperature.main"),
+            "max": constraint(snapshot, "heating.dhw.temperature.main", "setTargetTemperature", "temperature", "max"),
+            "min": constraint(snapshot, "heating.dhw.temperature.main", "setTargetTemperature", "temperature", "min"),
+            "temp2": value(features, "temperature.temp2"),
         },
-        "oneTimeCharge": 1 if heating.getOneTimeCharge() else 0,
+        "oneTimeCharge": 1 if value(features, "oneTimeCharge", "active") else 0,
         "pumps": {
-            "circulationActive": 1 if heating.getDomesticHotWaterCirculationPumpActive() else 0,
-            "mode": heating.getDomesticHotWaterCirculationMode(),
+            "circulationActive": 1 if value(features, "pumps.circulation", "status") == "on" else 0,
+            "mode": _get_circulation_mode(snapshot),
         },
-        "storageTemperature": heating.getDomesticHotWaterStorageTemperature(),
+        "storageTemperature": value(features, "sensors.temperature.dhwCylinder"),
     }
 
 
-@router.put("/onetimecharge", status_code=status.HTTP_204_NO_CONTENT)
+def _get_circulation_mode(snapshot: DeviceSnapshot) -> str | None:
+    """Get the current mode of the circulation pump like `HeatingDevice.getDomesticHotWaterCirculationMode` but on the
+    snapshot, i.e. of the schedule entry of now if the schedule is active, else its default mode.
+    """
+    name = "heating.dhw.pumps.circulation.schedule"
+    schedule = properties(snapshot.features, name)
+    default_mode = constraint(snapshot, name, "setSchedule", "newSchedule", "defaultMode")
+    try:
+        entries = {day: schedule["entries"][day] for day in VICARE_DAYS}
+        active = schedule["active"]
+    except (KeyError, TypeError) as e:
+        raise PyViCareNotSupportedFeatureError(name) from e
+    if active is not True:
+        return None
+
+    now = ViCareTimer().now()
+    current_time = time_as_delta(now)
+    for entry in entries[VICARE_DAYS[now.weekday()]]:
+        if parse_time_as_delta(entry["start"]) <= current_time <= parse_time_as_delta(entry["end"]):
+            return entry["mode"]
+    return default_mode
+
+
+@router.put("/onetimecharge", status_code=status.HTTP_202_ACCEPTED)
 def set_one_time_charge(
     command: Annotated[HeatingCommand, Body()],
+    command_queue: Annotated[CommandQueue, Depends(dependencies.get_command_queue)],
+    wait: WaitForCommand = False,
+    force: ForceCommand = False,
     heating: HeatingDevice = Depends(get_single_heating),
 ):
-    if command == HeatingCommand.Activate:
-        heating.activateOneTimeCharge()
-    elif command == HeatingCommand.Deactivate:
-        heating.deactivateOneTimeCharge()
+    snapshot = get_cached_snapshot(heating)
+    check_command(snapshot, "heating.dhw.oneTimeCharge", command.value, {})
+
+    def execute():
+        if command == HeatingCommand.Activate:
+            heating.activateOneTimeCharge()
+        elif command == HeatingCommand.Deactivate:
+            heating.deactivateOneTimeCharge()
 
+    return submit_command(
+        command_queue,
+        heating.accessor,
+        "dhw.onetimecharge",
+        command.value,
+        execute,
+        wait,
+        unchanged_since(
+            snapshot,
+            force,
+            lambda features: value(features, "heating.dhw.oneTimeCharge", "active")
+            == (command == HeatingCommand.Activate),
+        ),
+    )
 
-@router.put("/level/{level}/{temperature}", status_code=status.HTTP_204_NO_CONTENT)
+
+@router.put("/level/{level}/{temperature}", status_code=status.HTTP_202_ACCEPTED)
 def set_level_temperature(
     level: Annotated[HeatingDomesticHotWaterLevel, Path(title="The heating circuit program")],
     temperature: Annotated[int, Path(title="The temperature of the provided heating circuit program", ge=10, le=60)],
+    command_queue: Annotated[CommandQueue, Depends(dependencies.get_command_queue)],
+    wait: WaitForCommand = False,
+    force: ForceCommand = False,
     heating: HeatingDevice = Depends(get_single_heating),
 ):
-    if level == HeatingDomesticHotWaterLevel.Main:
-        heating.setDomesticHotWaterTemperature(temperature)
-    elif level == HeatingDomesticHotWaterLevel.Temp2:
-        heating.setDomesticHotWaterTemperature2(temperature)
+    feature = f"heating.dhw.temperature.{level.value}"
+    snapshot = get_cached_snapshot(heating)
+    check_command(snapshot, feature, "setTargetTemperature", {"temperature": temperature})
+
+    def execute():
+        if level == HeatingDomesticHotWaterLevel.Main:
+            heating.setDomesticHotWaterTemperature(temperature)
+        elif level == HeatingDomesticHotWaterLevel.Temp2:
+            heating.setDomesticHotWaterTemperature2(temperature)
+
+    return submit_command(
+        command_queue,
+        heating.accessor,
+        f"dhw.level.{level.value}.temperature",
+        temperature,
+        execute,
+        wait,
+        unchanged_since(snapshot, force, lambda features: value(features, feature) == temperature),
+    )
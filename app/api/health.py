@@ -4,12 +4,24 @@ from datetime import datetime, timedelta
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, Response
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from PyViCare.PyViCare import PyViCare
 from starlette import status
 
 from app import dependencies
-from app.request_tracking import LastFailureMessage, LastSuccessMessage, RequestTracker
+from app.admission import AdmissionController
+from app.loop_monitor import LoopMonitor
+from app.rate_limiting import RateLimiter
+from app.request_tracking import (
+    LastFailureMessage,
+    LastSuccessMessage,
+    RequestTracker,
+    WindowStatistics,
+)
+from app.settings import Settings
+from app.upstream import BreakerState, CircuitBreaker, UpstreamPoolMetrics
+from app.upstream_executor import UpstreamExecutor
 
 # TODO maybe use basic auth? configured?
 start_time = time.time()
@@ -19,10 +31,18 @@ ROUTE_PREFIX_HEALTH = "/health"
 
 # Failure expiration time: 30 minutes in seconds
 FAILURE_EXPIRATION_SECONDS = 30 * 60
+# requests within the window below which its error rate is not considered conclusive, i.e. doesn't affect the status
+ERROR_RATE_MIN_REQUESTS = 10
 
 
 router = APIRouter(prefix=ROUTE_PREFIX_HEALTH)
 
+# of the probes, prebuilt as they are requested every few seconds
+_UP = b'{"status":"UP"}'
+
+# the last detailed report and the (monotonic) time it was computed at
+_cached_report: "tuple[float, HealthModel] | None" = None
+
 
 AuthTokenStatus = t.Literal["invalid", "expired", "valid"]
 
@@ -44,12 +64,96 @@ class LastFailureModel(LastSuccessModel):
     message: str | None
 
 
+class WindowStatisticsModel(BaseModel):
+    requests: int
+    failures: int
+    error_rate: float
+
+
+class RollingStatisticsModel(BaseModel):
+    overall: WindowStatisticsModel
+    by_endpoint: dict[str, WindowStatisticsModel]
+
+
 class RequestsModel(BaseModel):
     request_stats: dict[str, t.Any]
+    # by window, e.g. `5m`
+    rolling_stats: dict[str, RollingStatisticsModel]
     last_success_message: LastSuccessModel | None
     last_failure_message: LastFailureModel | None
 
 
+class PoolModel(BaseModel):
+    size: int
+    in_use: int
+    waiting: int
+    new_connections: int
+    requests: int
+
+
+class BreakerModel(BaseModel):
+    state: BreakerState
+    error_rate: float
+    slow_call_rate: float
+    calls: int
+    rejected: int
+    retry_after: float
+
+
+class UpstreamQueueModel(BaseModel):
+    queue_size: int
+    queued: int
+    executed: int
+    rejected: int
+    cancelled: int
+    wait_avg_ms: float
+    wait_p95_ms: float
+    wait_max_ms: float
+
+
+class UpstreamModel(BaseModel):
+    pool: PoolModel
+    breaker: BreakerModel
+    # by priority class
+    queues: dict[str, UpstreamQueueModel]
+
+
+class AdmissionModel(BaseModel):
+    limit: int
+    in_flight: int
+    queue_size: int
+    queued: int
+    admitted: int
+    shed: int
+
+
+class ClientUsageModel(BaseModel):
+    client: str
+    requests: int
+    upstream_calls: int
+    limited: int
+    tokens: float
+    upstream_tokens: float
+
+
+class RateLimitsModel(BaseModel):
+    clients: int
+    max_clients: int
+    evicted: int
+    limited: int
+    top_clients: list[ClientUsageModel]
+
+
+class LoopModel(BaseModel):
+    lag_avg_ms: float
+    lag_max_ms: float
+    blocked: int
+    tasks: int
+    threadpool_size: int
+    threadpool_active: int
+    threadpool_waiting: int
+
+
 class HealthModel(BaseModel):
     status: t.Literal["UP"]
     """
@@ -65,16 +169,95 @@ class HealthModel(BaseModel):
     uptime: str
     checks: ChecksModel
     requests: RequestsModel
+    upstream: UpstreamModel
+    admission: dict[str, AdmissionModel]
+    rate_limits: RateLimitsModel
+    loop: LoopModel
+
+
+class ProbeModel(BaseModel):
+    status: t.Literal["UP", "DOWN"]
+    # why the server is not ready, if not
+    reasons: list[str] = []
+
+
+@router.get("/live", response_model=ProbeModel)
+async def live() -> Response:
+    """Liveness probe: the process and its event loop respond, without depending on anything else."""
+    return Response(_UP, media_type="application/json")
+
+
+@router.get("/ready", response_model=ProbeModel, responses={503: {"model": ProbeModel}})
+async def ready(
+    vicare: Annotated[PyViCare | None, Depends(dependencies.get_logged_in_vicare)],
+    breaker: Annotated[CircuitBreaker, Depends(dependencies.get_upstream_circuit_breaker)],
+) -> Response:
+    """Readiness probe: logged in to the ViCare API with a token and its circuit breaker not open.
+
+    Only reads state kept anyway, i.e. never logs in or calls the ViCare API. An expired token is ready, as it is
+    refreshed on the next call. While shutting down, all requests are rejected with `503` anyway.
+    """
+    reasons = []
+    if vicare is None:
+        reasons.append("not logged in to ViCare API yet")
+    elif vicare.oauth_manager.oauth_session.token is None:
+        reasons.append("invalid auth token")
+    if breaker.is_open():
+        reasons.append("circuit breaker of ViCare API open")
+    if not reasons:
+        return Response(_UP, media_type="application/json")
+    return JSONResponse({"status": "DOWN", "reasons": reasons}, status.HTTP_503_SERVICE_UNAVAILABLE)
 
 
 @router.get("")
 def health(
     response: Response,
+    settings: Annotated[Settings, Depends(dependencies.get_settings)],
     vicare: Annotated[PyViCare, Depends(dependencies.get_vicare)],
     request_tracker: Annotated[RequestTracker, Depends(dependencies.get_request_tracker)],
+    pool_metrics: Annotated[UpstreamPoolMetrics, Depends(dependencies.get_upstream_pool_metrics)],
+    breaker: Annotated[CircuitBreaker, Depends(dependencies.get_upstream_circuit_breaker)],
+    vicare_admission: Annotated[AdmissionController, Depends(dependencies.get_vicare_admission)],
+    appletv_admissions: Annotated[dict[str, AdmissionController], Depends(dependencies.get_appletv_admissions)],
+    rate_limiter: Annotated[RateLimiter, Depends(dependencies.get_rate_limiter)],
+    upstream_executor: Annotated[UpstreamExecutor, Depends(dependencies.get_upstream_executor)],
+    loop_monitor: Annotated[LoopMonitor, Depends(dependencies.get_loop_monitor)],
 ) -> HealthModel:
+    """Detailed report, computed on request and then served from cache for `settings.health_cache_ttl` seconds."""
+    global _cached_report
     response.headers["Cache-Control"] = "no-cache"
 
+    now = time.monotonic()
+    if _cached_report is not None and now - _cached_report[0] < settings.health_cache_ttl:
+        return _cached_report[1]
+    report = _create_report(
+        settings,
+        vicare,
+        request_tracker,
+        pool_metrics,
+        breaker,
+        vicare_admission,
+        appletv_admissions,
+        rate_limiter,
+        upstream_executor,
+        loop_monitor,
+    )
+    _cached_report = (now, report)
+    return report
+
+
+def _create_report(
+    settings: Settings,
+    vicare: PyViCare,
+    request_tracker: RequestTracker,
+    pool_metrics: UpstreamPoolMetrics,
+    breaker: CircuitBreaker,
+    vicare_admission: AdmissionController,
+    appletv_admissions: dict[str, AdmissionController],
+    rate_limiter: RateLimiter,
+    upstream_executor: UpstreamExecutor,
+    loop_monitor: LoopMonitor,
+) -> HealthModel:
     auth_token_status: AuthTokenStatus = (
         "invalid"
         if vicare.oauth_manager.oauth_session.token is None
@@ -106,9 +289,20 @@ def health(
         )
     )
 
+    breaker_metrics = breaker.get_metrics()
+    rolling_stats = request_tracker.get_rolling_statistics()
+    error_rate_window = rolling_stats[settings.health_error_rate_window]["overall"]
+
     return HealthModel(
         status="UP",
-        status_code=_get_error_status_code(auth_token_status, last_success, last_failure),
+        status_code=_get_error_status_code(
+            auth_token_status,
+            last_success,
+            last_failure,
+            breaker_metrics["state"],
+            error_rate_window,
+            settings.health_error_rate_threshold,
+        ),
         uptime=uptime,
         checks=ChecksModel(
             auth_token=auth_token_status,
@@ -118,9 +312,26 @@ def health(
         ),
         requests=RequestsModel(
             request_stats=request_tracker.get_statistics(),
+            rolling_stats={
+                window: RollingStatisticsModel(**statistics) for window, statistics in rolling_stats.items()
+            },
             last_success_message=last_success_model,
             last_failure_message=last_failure_model,
         ),
+        upstream=UpstreamModel(
+            pool=PoolModel(**pool_metrics.get_metrics()),
+            breaker=BreakerModel(**breaker_metrics),
+            queues={name: UpstreamQueueModel(**metrics) for name, metrics in upstream_executor.get_metrics().items()},
+        ),
+        admission={
+            "vicare": AdmissionModel(**vicare_admission.get_metrics()),
+            **{
+                f"appletv/{name}": AdmissionModel(**admission.get_metrics())
+                for name, admission in appletv_admissions.items()
+            },
+        },
+        rate_limits=RateLimitsModel(**rate_limiter.get_metrics()),
+        loop=LoopModel(**loop_monitor.get_metrics()),
     )
 
 
@@ -128,12 +339,19 @@ def _get_error_status_code(
     auth_token_status: str,
     last_success_message: LastSuccessMessage | None,
     last_failure_message: LastFailureMessage | None,
+    breaker_state: BreakerState = "closed",
+    error_rate_window: WindowStatistics | None = None,
+    error_rate_threshold: float | None = None,
 ) -> int:
     """
     Determine numeric status code (1-10) based on last failure.
 
     Failures newer than `FAILURE_EXPIRATION_SECONDS` are ignored for status code calculation (give ViCare time to recover).
-    Only persistent failures older than that affect the status code.
+    Only persistent failures older than that affect the status code. An open circuit breaker of the ViCare API, though,
+    is reported immediately as requests are failing fast anyway.
+
+    If an `error_rate_threshold` is given, the last failure affects the status code instead if the error rate of the
+    rolling `error_rate_window` reaches it, given at least `ERROR_RATE_MIN_REQUESTS` requests within the window.
 
     Status codes:
     - 1: Online (no failures or failures newer than `FAILURE_EXPIRATION_SECONDS` minutes)
@@ -144,21 +362,31 @@ def _get_error_status_code(
     - 6: Not Supported/Invalid Data/Command Error (405)
     - 7: Internal Server Error (500)
     - 8: Uncategorized Error
-    - 9: Service Unavailable Error (503)
+    - 9: Service Unavailable Error (503) or open circuit breaker
     - 10: Reserved for future error types
     """
     if auth_token_status == "invalid":
         return 2
+    if breaker_state == "open":
+        return 9
     if not last_success_message:
         return 8
     if not last_failure_message:
         return 1
 
-    success_age = time.time() - last_success_message["timestamp"]
-    failure_age = time.time() - last_failure_message["timestamp"]
+    if error_rate_threshold is not None:
+        if (
+            error_rate_window is None
+            or error_rate_window["requests"] < ERROR_RATE_MIN_REQUESTS
+            or error_rate_window["error_rate"] < error_rate_threshold
+        ):
+            return 1
+    else:
+        success_age = time.time() - last_success_message["timestamp"]
+        failure_age = time.time() - last_failure_message["timestamp"]
 
-    if success_age < failure_age or failure_age < FAILURE_EXPIRATION_SECONDS:
-        return 1
+        if success_age < failure_age or failure_age < FAILURE_EXPIRATION_SECONDS:
+            return 1
 
     failure_status_code = last_failure_message["status_code"]
     if failure_status_code == status.HTTP_401_UNAUTHORIZED:
@@ -1,52 +1,96 @@
 from fastapi import APIRouter, Depends, HTTPException
 from PyViCare import PyViCareDeviceConfig, PyViCareHeatPump
 from PyViCare.PyViCareHeatPump import Compressor
+from starlette import status
 
+from app import dependencies
 from app.api.heating import ROUTE_PREFIX_HEATING, get_single_heating_device
+from app.features import get_snapshot, value
+from app.heatpump_stats import HeatPumpStats, WindowStats
 
 ROUTE_PREFIX_HEATING_HEATPUMP = f"{ROUTE_PREFIX_HEATING}/heatpump"
-router = APIRouter(prefix=ROUTE_PREFIX_HEATING_HEATPUMP)
+router = APIRouter(prefix=ROUTE_PREFIX_HEATING_HEATPUMP, dependencies=[Depends(dependencies.admit_vicare)])
 
 
 def get_single_heatpump(device: PyViCareDeviceConfig = Depends(get_single_heating_device)) -> PyViCareHeatPump:
     return device.asHeatPump()
 
 
-def get_single_compressor(heatpump: PyViCareHeatPump = Depends(get_single_heatpump)) -> Compressor:
-    if len(heatpump.compressors) <= 0:
+def get_single_compressor(
+    heatpump: PyViCareHeatPump = Depends(get_single_heatpump),
+    compressor_no: int | None = None,
+) -> Compressor:
+    result = heatpump.compressors
+    if compressor_no is not None:
+        result = [c for c in result if str(c.component) == str(compressor_no)]
+        if len(result) <= 0:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, f"No compressor {compressor_no} found for heatpump.")
+    if len(result) <= 0:
         raise HTTPException(422, "No compressor found for heatpump.")
-    if len(heatpump.compressors) > 1:
-        raise HTTPException(422, "Multiple compressors found, currently unsupported.")
-    return heatpump.compressors[0]
+    if len(result) > 1:
+        raise HTTPException(
+            422,
+            f"Multiple compressors found, address one of them via `{ROUTE_PREFIX_HEATING_HEATPUMP}/compressors/{{no}}`.",
+        )
+    return result[0]
 
 
+@router.get("/compressors/{compressor_no}")
 @router.get("")
 def get_heatpump(
     device: PyViCareDeviceConfig = Depends(get_single_heating_device),
     heatpump: PyViCareHeatPump = Depends(get_single_heatpump),
     compressor: Compressor = Depends(get_single_compressor),
 ) -> dict:
+    features = get_snapshot(heatpump).below("heating.")
+    compressor_prefix = f"compressors.{compressor.component}"
     return {
         "active": 1 if device.status.lower() == "online" else 0,
         "device": {
-            "boilerSerial": heatpump.getBoilerSerial(),
-            "controllerSerial": heatpump.getControllerSerial(),
+            "boilerSerial": value(features, "boiler.serial"),
+            "controllerSerial": value(features, "controller.serial"),
             "deviceId": device.device_id,
             "model": device.device_model,
             "serial": device.accessor.serial,
         },
         "compressor": {
-            "active": 1 if compressor.getActive() else 0,
-            "hours": compressor.getHours(),
-            "phase": compressor.getPhase(),
-            "starts": compressor.getStarts(),
+            "active": 1 if value(features, compressor_prefix, "active") else 0,
+            "hours": value(features, f"{compressor_prefix}.statistics", "hours"),
+            "phase": value(features, compressor_prefix, "phase"),
+            "starts": value(features, f"{compressor_prefix}.statistics", "starts"),
         },
         "temperature": {
-            "buffer": heatpump.getBufferTopTemperature(),
-            "outside": heatpump.getOutsideTemperature(),
-            "primaryCircuitSupply": heatpump.getSupplyTemperaturePrimaryCircuit(),
-            "return": heatpump.getReturnTemperature(),
-            "secondaryCircuitSupply": heatpump.getSupplyTemperatureSecondaryCircuit(),
+            "buffer": value(features, "bufferCylinder.sensors.temperature.top"),
+            "outside": value(features, "sensors.temperature.outside"),
+            "primaryCircuitSupply": value(features, "primaryCircuit.sensors.temperature.supply"),
+            "return": value(features, "sensors.temperature.return"),
+            "secondaryCircuitSupply": value(features, "secondaryCircuit.sensors.temperature.supply"),
         },
         "status": device.status,
     }
+
+
+@router.get("/compressors/{compressor_no}/stats")
+@router.get("/stats")
+def get_heatpump_stats(
+    device: PyViCareDeviceConfig = Depends(get_single_heating_device),
+    compressor: Compressor = Depends(get_single_compressor),
+    heatpump_stats: HeatPumpStats = Depends(dependencies.get_heatpump_stats),
+) -> dict:
+    stats = heatpump_stats.get_stats(f"{device.accessor.serial}.{device.device_id}", str(compressor.component))
+    return {
+        "compressor": str(compressor.component),
+        "windows": {window: _to_dict(window_stats) for window, window_stats in stats.items()},
+    }
+
+
+def _to_dict(stats: WindowStats) -> dict:
+    return {
+        "averageRuntime": stats["average_runtime"],
+        "dutyCycle": stats["duty_cycle"],
+        "observed": stats["observed"],
+        "shortCycling": stats["short_cycling"],
+        "starts": stats["starts"],
+        "startsPerHour": stats["starts_per_hour"],
+        "supplyReturnSpread": stats["supply_return_spread"],
+    }
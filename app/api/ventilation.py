@@ -1,27 +1,45 @@
-from typing import Annotated
+from typing import Annotated, Any
 
 from fastapi import APIRouter, Depends, HTTPException, Path
 from PyViCare import PyViCareDeviceConfig, PyViCareVentilationDevice
-from PyViCare.PyViCare import PyViCare
 from starlette import status
 
 from app import dependencies
+from app.api.commands import (
+    ForceCommand,
+    WaitForCommand,
+    check_command,
+    submit_command,
+    unchanged_since,
+)
+from app.api.devices import select_single_device
+from app.commands import CommandQueue
+from app.features import (
+    Feature,
+    constraint,
+    get_cached_snapshot,
+    get_snapshot,
+    unit,
+    value,
+)
 
 ROUTE_PREFIX_VENTILATION = "/ventilation"
-router = APIRouter(prefix=ROUTE_PREFIX_VENTILATION)
+router = APIRouter(prefix=ROUTE_PREFIX_VENTILATION, dependencies=[Depends(dependencies.admit_vicare)])
 
 
-def get_single_ventilation_device(vicare: PyViCare = Depends(dependencies.get_vicare)) -> PyViCareDeviceConfig:
-    result = [d for d in vicare.devices for role in d.service.roles if "type:ventilation" in role]
-    if len(result) <= 0:
-        raise HTTPException(422, "No ventilation device found.")
-    if len(result) > 1:
-        raise HTTPException(422, "Multiple ventilation devices found, currently unsupported.")
-    return result[0]
+def get_single_ventilation_device(
+    devices: list[PyViCareDeviceConfig] = Depends(dependencies.get_devices),
+    device_id: str | None = None,
+) -> PyViCareDeviceConfig:
+    return select_single_device(
+        devices, device_id, "ventilation", lambda d: any("type:ventilation" in role for role in d.service.roles)
+    )
 
 
-def get_single_ventilation(vicare: PyViCare = Depends(dependencies.get_vicare)) -> PyViCareVentilationDevice:
-    return get_single_ventilation_device(vicare).asVentilation()
+def get_single_ventilation(
+    device: PyViCareDeviceConfig = Depends(get_single_ventilation_device),
+) -> PyViCareVentilationDevice:
+    return device.asVentilation()
 
 
 @router.get("")
@@ -29,109 +47,129 @@ def get_ventilation(
     device: PyViCareDeviceConfig = Depends(get_single_ventilation_device),
     ventilation: PyViCareVentilationDevice = Depends(get_single_ventilation),
 ) -> dict:
-    def prop(name: str) -> dict:
-        return ventilation.getProperty(name)["properties"]
+    snapshot = get_snapshot(ventilation)
+    features = snapshot.features
 
-    level_strings = ventilation.getVentilationLevels()
-    levels = {level: prop(f"ventilation.levels.{level}") for level in level_strings}
+    def v(name: str, prop: str = "value") -> Any:
+        return value(features, f"ventilation.{name}", prop)
 
-    active_level = ventilation.getVentilationLevel()
+    def volume_flow_unit(level: str) -> str:
+        return unit(features, f"ventilation.levels.{level}", "volumeFlow")
 
-    filter_change = prop("ventilation.operating.modes.filterChange")["active"]["value"]
-    filter_runtime = prop("ventilation.filter.runtime")
+    level_strings = constraint(snapshot, "ventilation.operating.modes.permanent", "setLevel", "level", "enum")
+    active_level = str(v("operating.state", "level"))
 
     return {
         "active": 1 if device.status.lower() == "online" else 0,
         "bypass": {
-            "active": 1 if prop("ventilation.bypass")["active"]["value"] else 0,
-            "positionPercent": prop("ventilation.bypass.position")["value"]["value"],
+            "active": 1 if v("bypass", "active") else 0,
+            "positionPercent": v("bypass.position"),
         },
         "device": {
             "deviceId": device.device_id,
             "model": device.device_model,
-            "productIdentification": prop("device.productIdentification")["product"]["value"],
+            "productIdentification": value(features, "device.productIdentification", "product"),
             "serial": device.accessor.serial,
         },
         "fans": {
             "supply": {
-                "currentRpm": prop("ventilation.fan.supply")["current"]["value"],
-                "targetRpm": prop("ventilation.fan.supply")["target"]["value"],
+                "currentRpm": v("fan.supply", "current"),
+                "targetRpm": v("fan.supply", "target"),
             },
             "exhaust": {
-                "currentRpm": prop("ventilation.fan.exhaust")["current"]["value"],
-                "targetRpm": prop("ventilation.fan.exhaust")["target"]["value"],
+                "currentRpm": v("fan.exhaust", "current"),
+                "targetRpm": v("fan.exhaust", "target"),
             },
         },
         "filter": {
-            "changeModeActive": 1 if filter_change else 0,
-            "operatingDays": round(filter_runtime["operatingHours"]["value"] / 24),
-            "pollutionPercent": prop("ventilation.filter.pollution.blocked")["value"]["value"],
-            "overdueHours": filter_runtime["overdueHours"]["value"],
-            "remainingDays": round(filter_runtime["remainingHours"]["value"] / 24),
+            "changeModeActive": 1 if v("operating.modes.filterChange", "active") else 0,
+            "operatingDays": round(v("filter.runtime", "operatingHours") / 24),
+            "pollutionPercent": v("filter.pollution.blocked"),
+            "overdueHours": v("filter.runtime", "overdueHours"),
+            "remainingDays": round(v("filter.runtime", "remainingHours") / 24),
         },
         "heatExchanger": {
-            "frostProtectionActive": (
-                0 if prop("ventilation.heatExchanger.frostprotection")["status"]["value"] == "off" else 1
-            ),
-            "recoveryPercent": prop("ventilation.heating.recovery")["value"]["value"],
+            "frostProtectionActive": 0 if v("heatExchanger.frostprotection", "status") == "off" else 1,
+            "recoveryPercent": v("heating.recovery"),
         },
         "levels": {"active": active_level[5:].lower(), "activeNo": level_strings.index(active_level) + 1}
         | {
             # strip off `level` from levels
             level[5:].lower(): {
                 "active": 1 if level == active_level else 0,
-                "volumeFlow": f"{v['volumeFlow']['value']} {v['volumeFlow']['unit']}",
+                "volumeFlow": f"{v(f'levels.{level}', 'volumeFlow')} {volume_flow_unit(level)}",
             }
-            for level, v in levels.items()
+            for level in level_strings
         },
         "modes": {
-            mode: {"active": 1 if ventilation.getVentilationMode(mode) else 0}
-            for mode in ventilation.getVentilationModes()
+            mode: {"active": 1 if v(f"operating.modes.{mode}", "active") else 0}
+            for mode in constraint(snapshot, "ventilation.operating.modes.active", "setMode", "mode", "enum")
         },
         "sensors": {
             "temperature": {
-                "outsideCelsius": prop("ventilation.sensors.temperature.outside")["value"]["value"],
-                "supplyCelsius": prop("ventilation.sensors.temperature.supply")["value"]["value"],
-                "exhaustCelsius": prop("ventilation.sensors.temperature.exhaust")["value"]["value"],
-                "extractCelsius": prop("ventilation.sensors.temperature.extract")["value"]["value"],
+                "outsideCelsius": v("sensors.temperature.outside"),
+                "supplyCelsius": v("sensors.temperature.supply"),
+                "exhaustCelsius": v("sensors.temperature.exhaust"),
+                "extractCelsius": v("sensors.temperature.extract"),
             },
             "humidity": {
-                "outdoorPercent": prop("ventilation.sensors.humidity.outdoor")["value"]["value"],
-                "supplyPercent": prop("ventilation.sensors.humidity.supply")["value"]["value"],
-                "exhaustPercent": prop("ventilation.sensors.humidity.exhaust")["value"]["value"],
-                "extractPercent": prop("ventilation.sensors.humidity.extract")["value"]["value"],
+                "outdoorPercent": v("sensors.humidity.outdoor"),
+                "supplyPercent": v("sensors.humidity.supply"),
+                "exhaustPercent": v("sensors.humidity.exhaust"),
+                "extractPercent": v("sensors.humidity.extract"),
             },
         },
         "status": device.status,
         "volumeFlow": {
-            "inputCubicMetersPerHour": prop("ventilation.volumeFlow.current.input")["value"]["value"],
-            "outputCubicMetersPerHour": prop("ventilation.volumeFlow.current.output")["value"]["value"],
+            "inputCubicMetersPerHour": v("volumeFlow.current.input"),
+            "outputCubicMetersPerHour": v("volumeFlow.current.output"),
         },
     }
 
 
 @router.get("/mode")
 def get_mode(ventilation: PyViCareVentilationDevice = Depends(get_single_ventilation)) -> str:
-    return ventilation.getActiveMode()
+    return str(value(get_snapshot(ventilation).features, "ventilation.operating.modes.active"))
 
 
-@router.put("/mode/permanent/{level}", status_code=status.HTTP_204_NO_CONTENT)
+@router.put("/mode/permanent/{level}", status_code=status.HTTP_202_ACCEPTED)
 def set_mode_permanent(
     level: Annotated[int, Path(title="The ventilation level in percent", ge=0, le=100)],
+    command_queue: Annotated[CommandQueue, Depends(dependencies.get_command_queue)],
+    wait: WaitForCommand = False,
+    force: ForceCommand = False,
     ventilation: PyViCareVentilationDevice = Depends(get_single_ventilation),
 ):
     if 0 <= level <= 25:
-        ventilation.setPermanentLevel("levelOne")
+        permanent_level = "levelOne"
     elif 25 < level <= 50:
-        ventilation.setPermanentLevel("levelTwo")
+        permanent_level = "levelTwo"
     elif 50 < level <= 75:
-        ventilation.setPermanentLevel("levelThree")
+        permanent_level = "levelThree"
     elif 75 < level <= 100:
-        ventilation.setPermanentLevel("levelFour")
+        permanent_level = "levelFour"
     else:
         raise HTTPException(status_code=404, detail="Unknown level")
+    snapshot = get_cached_snapshot(ventilation)
+    check_command(snapshot, "ventilation.operating.modes.permanent", "setLevel", {"level": permanent_level})
+
+    def unchanged(features: dict[str, Feature]) -> bool:
+        return (
+            value(features, "ventilation.operating.modes.active") == "permanent"
+            and value(features, "ventilation.operating.state", "level") == permanent_level
+        )
+
+    return submit_command(
+        command_queue,
+        ventilation.accessor,
+        "ventilation.mode.permanent",
+        permanent_level,
+        lambda: ventilation.setPermanentLevel(permanent_level),
+        wait,
+        unchanged_since(snapshot, force, unchanged),
+    )
 
 
 @router.get("/program")
 def get_program(ventilation: PyViCareVentilationDevice = Depends(get_single_ventilation)) -> str:
-    return ventilation.getActiveProgram()
+    return value(get_snapshot(ventilation).features, "ventilation.operating.programs.active")
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from ipaddress import IPv4Address
+from typing import TYPE_CHECKING, Any, Literal
+
+from app.settings import AppleTvDevice
+
+if TYPE_CHECKING:
+    # pyatv is imported lazily, i.e. not at all if the Apple TV integration is disabled
+    from pyatv.const import PowerState
+    from pyatv.interface import AppleTV
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_TRYING_TIMEOUT = 2.0
+PORT_START = 49152
+PORT_END = PORT_START + 49
+# seconds after which a successful connection on a port counts half when ranking the ports to scan
+PORT_HISTORY_HALF_LIFE = 7 * 24 * 3600.0
+
+# "connecting" until connected for the first time, "reconnecting" after the connection died
+ConnectionStatus = Literal["connected", "connecting", "reconnecting"]
+
+
+@dataclass
+class AppleTvConnection:
+    atv: "AppleTV"
+    host: IPv4Address
+    port: int
+
+
+@dataclass
+class AppleTvState:
+    host: IPv4Address
+    # of the current connection, else of the last one
+    port: int | None
+    connection: ConnectionStatus
+    # as last read, None if never connected
+    power_state: "PowerState | None"
+
+
+class PortHistory:
+    """Successful connections per port of an Apple TV, to scan the ports most likely to work first.
+
+    The Companion port changes on restarts of the Apple TV, but usually to one of a few recurring ports. Each port has
+    a score counting its successful connections, decaying by half every `PORT_HISTORY_HALF_LIFE` seconds, so ports are
+    ranked by frequency as well as recency.
+    """
+
+    def __init__(self, ports: dict[int, tuple[float, float]] | None = None) -> None:
+        # score and (wall clock) time of its last update by port, as persisted across restarts
+        self.ports: dict[int, tuple[float, float]] = dict(ports or {})
+
+    def _score(self, port: int, now: float) -> float:
+        score, updated_at = self.ports.get(port, (0.0, now))
+        return score * 0.5 ** (max(now - updated_at, 0.0) / PORT_HISTORY_HALF_LIFE)
+
+    def record(self, port: int, now: float) -> None:
+        self.ports[port] = (self._score(port, now) + 1, now)
+
+    def ranked(self, now: float) -> list[int]:
+        """The ports connected to before, the most likely one first."""
+        return sorted(self.ports, key=lambda port: self._score(port, now), reverse=True)
+
+
+@dataclass
+class _DeviceState:
+    device: AppleTvDevice
+    port_history: PortHistory = field(default_factory=PortHistory)
+    connection: AppleTvConnection | None = None
+    # of the last connection, kept after it died to be tried first
+    last_port: int | None = None
+    last_scan_failed_at: float | None = None
+    power_state: "PowerState | None" = None
+    reconnect_task: asyncio.Task | None = None
+
+
+async def connect(config: Any, loop: asyncio.AbstractEventLoop) -> "AppleTV":
+    """`pyatv.connect`, importing pyatv on first use only."""
+    import pyatv
+
+    return await pyatv.connect(config, loop)
+
+
+class AppleTvConnectionManager:
+    """Connections to several Apple TVs by name, (re)connected in the background so requests never wait for a scan.
+
+    Requests get the state of a device immediately: as read from its connection if alive, else as last known while a
+    background task per device reconnects. The Companion port of an Apple TV changes on restarts, so reconnecting tries
+    the port of the last connection first and falls back to scanning the port range, most likely ports first (see
+    `PortHistory`) and skipped for `scan_cooldown` seconds after a failed scan. Attempts are repeated until connected,
+    backing off exponentially with full jitter from `backoff` up to `max_backoff` seconds. Devices are independent of
+    each other, so connects and scans of different devices run concurrently, and a slow or unreachable device never
+    blocks the others.
+
+    Must only be used from the event loop, which is why no additional locking is needed.
+    """
+
+    def __init__(
+        self,
+        devices: dict[str, AppleTvDevice],
+        scan_cooldown: float,
+        backoff: float,
+        max_backoff: float,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._scan_cooldown = scan_cooldown
+        self._clock = clock
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._devices = {name: _DeviceState(device) for name, device in devices.items()}
+        # referenced until done, as the event loop only keeps weak references to tasks
+        self._closing: set[asyncio.Task] = set()
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._devices)
+
+    def get_state(self, name: str) -> AppleTvState:
+        """Get the state of the Apple TV `name`, (re)connecting in the background if not connected."""
+        state = self._devices[name]
+        if state.connection is not None:
+            try:
+                state.power_state = state.connection.atv.power.power_state
+                return AppleTvState(state.device.host, state.connection.port, "connected", state.power_state)
+            except Exception:  # noqa: BLE001 - pyatv raises various errors on dead connections, all handled alike
+                logger.info("Connection to Apple TV %s dead, reconnecting in the background", name)
+                dead, state.connection = state.connection, None
+                self._close_later(name, dead)
+
+        if state.reconnect_task is None or state.reconnect_task.done():
+            state.reconnect_task = asyncio.get_running_loop().create_task(
+                self._reconnect(name), name=f"appletv-reconnect-{name}"
+            )
+        return AppleTvState(
+            state.device.host,
+            state.last_port,
+            "connecting" if state.power_state is None else "reconnecting",
+            state.power_state,
+        )
+
+    async def _reconnect(self, name: str) -> None:
+        attempt = 0
+        # doubled up to the maximum only, so it neither exceeds it nor overflows however long the device stays offline
+        ceiling = self._backoff
+        while True:
+            try:
+                if await self.try_connect(name):
+                    return
+            except Exception:
+                # supervised, i.e. retried like a failed attempt
+                logger.exception("Reconnecting to Apple TV %s failed unexpectedly", name)
+            delay = random.uniform(0, min(self._max_backoff, ceiling))
+            ceiling = min(self._max_backoff, ceiling * 2)
+            attempt += 1
+            logger.debug("Reconnecting to Apple TV %s in %.1fs (attempt %d)", name, delay, attempt + 1)
+            await asyncio.sleep(delay)
+
+    async def try_connect(self, name: str) -> bool:
+        """Try to connect to the Apple TV `name` once, on the port of the last connection, else by scanning the range.
+
+        Called by the background task reconnecting to the device, i.e. not meant to be called concurrently for a device.
+        """
+        state = self._devices[name]
+        last_port = state.last_port
+        if last_port is not None:
+            logger.debug("Trying cached port %d of Apple TV %s", last_port, name)
+            if await self._connect(state, last_port):
+                logger.info("Reconnected to Apple TV %s using cached port %d", name, last_port)
+                return True
+            logger.info("Last port %d of Apple TV %s no longer works", last_port, name)
+
+        if state.last_scan_failed_at is not None:
+            since = time.monotonic() - state.last_scan_failed_at
+            if since < self._scan_cooldown:
+                logger.debug(
+                    "Skipping scan for Apple TV %s, last full scan failed %.1fs ago (cooldown %ss)",
+                    name,
+                    since,
+                    self._scan_cooldown,
+                )
+                return False
+
+        logger.info(
+            "Scanning for port of Apple TV %s (range %d-%d%s)",
+            name,
+            PORT_START,
+            PORT_END,
+            f" without cached port {last_port}" if last_port else "",
+        )
+        for port in self._scan_order(state):
+            logger.debug("Trying port %d", port)
+            if await self._connect(state, port):
+                logger.info("Found service of Apple TV %s on port %d and connected to it", name, port)
+                return True
+
+        logger.warning("No working connection to Apple TV %s found on %s", name, state.device.host)
+        state.last_scan_failed_at = time.monotonic()
+        return False
+
+    def _scan_order(self, state: _DeviceState) -> list[int]:
+        """The ports of the range to scan, the ones connected to before first, without the one already tried."""
+        ranked = [port for port in state.port_history.ranked(self._clock()) if PORT_START <= port <= PORT_END]
+        ports = dict.fromkeys(ranked + list(range(PORT_START, PORT_END + 1)))
+        ports.pop(state.last_port, None)
+        return list(ports)
+
+    async def _connect(self, state: _DeviceState, port: int) -> bool:
+        atv = await _try_to_connect_to_appletv_on_port(state.device, port)
+        if not atv:
+            return False
+        state.connection = AppleTvConnection(atv, state.device.host, port)
+        state.last_port = port
+        state.last_scan_failed_at = None
+        state.port_history.record(port, self._clock())
+        return True
+
+    def get_port_histories(self) -> dict[str, dict[int, tuple[float, float]]]:
+        """Export the port history of each device by name, e.g. to persist it on shutdown."""
+        return {name: dict(state.port_history.ports) for name, state in self._devices.items()}
+
+    def restore_port_histories(self, histories: dict[str, dict[int, tuple[float, float]]]) -> None:
+        """Restore the port histories exported by `get_port_histories`, ignoring devices no longer configured."""
+        for name, ports in histories.items():
+            if name in self._devices:
+                self._devices[name].port_history = PortHistory(ports)
+
+    def _close_later(self, name: str, connection: AppleTvConnection) -> None:
+        task = asyncio.get_running_loop().create_task(self._close(name, connection), name=f"appletv-close-{name}")
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def close(self) -> None:
+        """Stop reconnecting and close the connections to all Apple TVs concurrently, e.g. on shutdown."""
+        tasks = [state.reconnect_task for state in self._devices.values() if state.reconnect_task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        closing = list(self._closing)
+        for name, state in self._devices.items():
+            if state.connection is not None:
+                closing.append(self._close(name, state.connection))
+                state.connection = None
+        await asyncio.gather(*closing)
+
+    @staticmethod
+    async def _close(name: str, connection: AppleTvConnection) -> None:
+        try:
+            await asyncio.gather(*connection.atv.close())
+            logger.info("Connection to Apple TV %s closed", name)
+        except Exception:
+            logger.info("Closing connection to Apple TV %s failed", name, exc_info=True)
+
+
+async def _try_to_connect_to_appletv_on_port(device: AppleTvDevice, port: int) -> "AppleTV | None":
+    from pyatv import conf
+    from pyatv.const import Protocol
+
+    logger.debug("Attempting connection to %s:%d", device.host, port)
+
+    config = conf.AppleTV(device.host, "Auto")
+    config.add_service(
+        conf.ManualService(
+            device.companion_identifier,
+            Protocol.Companion,
+            port,
+            {},
+            credentials=device.companion_credentials,
+        )
+    )
+
+    try:
+        return await asyncio.wait_for(connect(config, asyncio.get_running_loop()), timeout=CONNECTION_TRYING_TIMEOUT)
+    except TimeoutError:
+        logger.debug("Connection to port %d timed out after %ss.", port, CONNECTION_TRYING_TIMEOUT)
+        return None
+    except Exception as e:  # noqa: BLE001 - any failure just means the device is not reachable on this port
+        logger.debug("Connection to port %d failed: %s: %s", port, type(e).__name__, e)
+        return None
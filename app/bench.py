@@ -0,0 +1,311 @@
+"""Load generator driving a running server, or one started in-process, with a weighted mix of routes.
+
+Concurrency is increased step by step until the p99 latency of a step crosses a threshold, i.e. the server saturates.
+Each concurrent client is a thread issuing requests back to back on its own keep-alive connection.
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from random import Random
+
+import requests
+
+DEFAULT_MIX = {
+    "/heating/heatpump": 1.0,
+    "/heating/circuit": 1.0,
+    "/heating/dhw": 1.0,
+    "/ventilation": 1.0,
+    "/appletv": 1.0,
+    "/health": 1.0,
+}
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16, 32, 64]
+
+
+def default_mix(appletv_enabled: bool = True) -> dict[str, float]:
+    """Get the default mix of all routes, without `/appletv` if the Apple TV integration is disabled (e.g. `--fake`)."""
+    return {route: weight for route, weight in DEFAULT_MIX.items() if appletv_enabled or route != "/appletv"}
+
+
+@dataclass
+class RouteStats:
+    # of all requests, including failed ones, in seconds
+    latencies: list[float] = field(default_factory=list)
+    status_codes: Counter[str] = field(default_factory=Counter)
+    errors: int = 0
+
+    def record(self, latency: float, status: str, failed: bool) -> None:
+        self.latencies.append(latency)
+        self.status_codes[status] += 1
+        self.errors += failed
+
+    def merge(self, other: "RouteStats") -> None:
+        self.latencies.extend(other.latencies)
+        self.status_codes.update(other.status_codes)
+        self.errors += other.errors
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Get the `q` percentile (0-100) of the latencies by nearest rank, 0 if there are none."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+@dataclass
+class StepResult:
+    concurrency: int
+    duration: float
+    routes: dict[str, RouteStats]
+
+    @property
+    def total(self) -> RouteStats:
+        total = RouteStats()
+        for stats in self.routes.values():
+            total.merge(stats)
+        return total
+
+    def throughput(self, stats: RouteStats) -> float:
+        return stats.requests / self.duration if self.duration else 0.0
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parse a mix of routes like `/heating/circuit=3,/health=1` (weight defaults to 1)."""
+    mix = {}
+    for entry in value.split(","):
+        route, _, weight = entry.strip().partition("=")
+        mix[route] = float(weight) if weight else 1.0
+    if not mix or any(weight < 0 for weight in mix.values()) or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError(f"invalid mix of routes: {value}")
+    return mix
+
+
+def _client(
+    base_url: str, mix: dict[str, float], deadline: float, timeout: float, random: Random
+) -> dict[str, RouteStats]:
+    routes, weights = list(mix), list(mix.values())
+    results = {route: RouteStats() for route in routes}
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            route = random.choices(routes, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = session.get(f"{base_url}{route}", timeout=timeout)
+                status, failed = str(response.status_code), response.status_code >= 400
+            except requests.RequestException as e:
+                status, failed = type(e).__name__, True
+            results[route].record(time.perf_counter() - started, status, failed)
+    return results
+
+
+def run_step(
+    base_url: str, mix: dict[str, float], concurrency: int, duration: float, timeout: float = 30.0, seed: int = 0
+) -> StepResult:
+    """Issue requests of `mix` with `concurrency` clients for `duration` seconds."""
+    deadline = time.monotonic() + duration
+    results: list[dict[str, RouteStats]] = []
+    lock = threading.Lock()
+
+    def client(no: int) -> None:
+        stats = _client(base_url, mix, deadline, timeout, Random(seed * 1000 + no))
+        with lock:
+            results.append(stats)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(no,), name=f"bench-{no}") for no in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    routes = {route: RouteStats() for route in mix}
+    for client_stats in results:
+        for route, stats in client_stats.items():
+            routes[route].merge(stats)
+    # requests in flight at the deadline are completed, so measure until the last one finished
+    return StepResult(concurrency, time.monotonic() - started, routes)
+
+
+def run(
+    base_url: str,
+    mix: dict[str, float],
+    concurrencies: list[int],
+    duration: float,
+    p99_threshold: float,
+    timeout: float = 30.0,
+) -> tuple[list[StepResult], int | None]:
+    """Run steps of increasing concurrency until the p99 latency crosses `p99_threshold` (in seconds).
+
+    Returns the results of all steps run and the concurrency the server saturated at, if any.
+    """
+    # warm up, e.g. logging in to ViCare and filling caches, without measuring it
+    with requests.Session() as session:
+        for route in mix:
+            try:
+                session.get(f"{base_url}{route}", timeout=timeout)
+            except requests.RequestException:
+                pass
+
+    results = []
+    for seed, concurrency in enumerate(concurrencies):
+        result = run_step(base_url, mix, concurrency, duration, timeout, seed)
+        results.append(result)
+        if result.total.percentile(99) > p99_threshold:
+            return results, concurrency
+    return results, None
+
+
+def _format_stats(name: str, result: StepResult, stats: RouteStats) -> str:
+    return (
+        f"{name:24} {stats.requests:7d} {result.throughput(stats):9.1f}/s "
+        f"{stats.percentile(50) * 1000:8.1f} {stats.percentile(90) * 1000:8.1f} {stats.percentile(99) * 1000:8.1f} ms "
+        f"{stats.error_rate:7.1%}"
+    )
+
+
+def format_report(results: list[StepResult], saturation: int | None, p99_threshold: float) -> str:
+    lines = []
+    for result in results:
+        lines.append(f"concurrency {result.concurrency} ({result.duration:.1f} s):")
+        lines.append(
+            f"  {'route':24} {'requests':>7} {'throughput':>11} {'p50':>8} {'p90':>8} {'p99':>8}    {'errors':>7}"
+        )
+        for route, stats in result.routes.items():
+            lines.append(f"  {_format_stats(route, result, stats)}")
+        lines.append(f"  {_format_stats('total', result, result.total)}")
+
+    below = [r for r in results if r.concurrency != saturation]
+    best = max(below, key=lambda r: r.throughput(r.total), default=None)
+    if saturation is None:
+        lines.append(f"p99 stayed below {p99_threshold * 1000:.0f} ms up to concurrency {results[-1].concurrency}")
+    else:
+        lines.append(f"saturated at concurrency {saturation}: p99 crossed {p99_threshold * 1000:.0f} ms")
+    if best is not None:
+        lines.append(f"highest throughput below: {best.throughput(best.total):.1f}/s at concurrency {best.concurrency}")
+    return "\n".join(lines)
+
+
+def to_json(results: list[StepResult], saturation: int | None) -> dict:
+    def stats_to_dict(result: StepResult, stats: RouteStats) -> dict:
+        return {
+            "errorRate": stats.error_rate,
+            "p50": stats.percentile(50),
+            "p90": stats.percentile(90),
+            "p99": stats.percentile(99),
+            "requests": stats.requests,
+            "statusCodes": dict(stats.status_codes),
+            "throughput": result.throughput(stats),
+        }
+
+    return {
+        "saturation": saturation,
+        "steps": [
+            {
+                "concurrency": result.concurrency,
+                "duration": result.duration,
+                "routes": {route: stats_to_dict(result, stats) for route, stats in result.routes.items()},
+                "total": stats_to_dict(result, result.total),
+            }
+            for result in results
+        ],
+    }
+
+
+@contextmanager
+def _in_process_server(app_path: str, fake_features: list[Path], fake_latency: float) -> Iterator[str]:
+    """Run the ASGI app `app_path` (`module:attribute`) in-process, optionally against a fake ViCare API."""
+    # imported lazily, as only needed in-process
+    from app.fake_vicare import (
+        FakeDevice,
+        FakeViCare,
+        FakeViCareConfig,
+        create_app,
+        running,
+    )
+
+    with ExitStack() as stack:
+        if fake_features:
+            devices = [FakeDevice.from_features(json.loads(path.read_text())) for path in fake_features]
+            fake = FakeViCare(devices, FakeViCareConfig(latency=fake_latency, latency_sigma=0.5 if fake_latency else 0))
+            # read by the settings of the app on startup, i.e. once it is running
+            os.environ["VICARE_BASE_URL"] = stack.enter_context(running(create_app(fake)))
+            # there is no fake Apple TV, and the quota of the fake needs no protection from the (single) bench client
+            for name, value in (
+                ("CLIENT_ID", "bench"),
+                ("EMAIL", "bench"),
+                ("PASSWORD", "bench"),
+                ("APPLETV_ENABLED", "false"),
+                ("RATE_LIMIT_ENABLED", "false"),
+            ):
+                os.environ.setdefault(name, value)
+        module, _, attribute = app_path.partition(":")
+        yield stack.enter_context(running(getattr(importlib.import_module(module), attribute)))
+
+
+def _appletv_enabled() -> bool:
+    # imported lazily, as only needed in-process
+    from app.dependencies import get_settings
+
+    return get_settings().appletv_enabled
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--url", help="base URL of a running server, else the app is started in-process")
+    parser.add_argument("--app", default="app.main:app", help="ASGI app started in-process (default: %(default)s)")
+    parser.add_argument(
+        "--fake",
+        nargs="+",
+        type=Path,
+        default=[],
+        metavar="FEATURES",
+        help="run the in-process app against a fake ViCare API serving these recorded features payloads",
+    )
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="median latency of the fake in seconds")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        help="weighted routes, e.g. `/heating/circuit=3,/health=1` (default: all enabled routes equally)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(c) for c in value.split(",")],
+        default=DEFAULT_CONCURRENCY,
+        help="concurrency per step (default: %(default)s)",
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per step (default: %(default)s)")
+    parser.add_argument("--p99-threshold", type=float, default=1000, help="saturation p99 in ms (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="request timeout in seconds (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+
+
+def main(args: argparse.Namespace) -> None:
+    with ExitStack() as stack:
+        base_url = args.url or stack.enter_context(_in_process_server(args.app, args.fake, args.fake_latency))
+        mix = args.mix
+        if mix is None:
+            # the settings of a running server are unknown, those of the in-process one are read from the environment
+            mix = default_mix(args.url is not None or _appletv_enabled())
+        results, saturation = run(
+            base_url.rstrip("/"), mix, args.concurrency, args.duration, args.p99_threshold / 1000, args.timeout
+        )
+    if args.json:
+        print(json.dumps(to_json(results, saturation), indent=2))
+    else:
+        print(format_report(results, saturation, args.p99_threshold / 1000))
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from app.features import DeviceSnapshot
+
+
+@dataclass(frozen=True, slots=True)
+class Change:
+    timestamp: float
+    device: str
+    path: str
+    old: Any
+    new: Any
+    # as reported by the ViCare API for the changed feature, if any
+    feature_timestamp: str | None
+
+
+def _diff(path: str, old: Any, new: Any) -> Iterator[tuple[str, Any, Any]]:
+    """Yield the changed leaves of `old` and `new`, descending into changed dicts only."""
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old.keys() | new.keys():
+            yield from _diff(f"{path}.{key}", old.get(key), new.get(key))
+    else:
+        yield path, old, new
+
+
+class ChangeLog:
+    """Thread-safe, bounded log of the changes of the feature values of all devices between refreshes.
+
+    Each snapshot is diffed structurally against the previous one of the same device: property values of features are
+    compared as a whole first (which `dict.__eq__` short-circuits on the first difference), and only changed ones are
+    descended into to find the changed values. The first snapshot of a device only serves as baseline.
+    """
+
+    def __init__(self, max_changes: int) -> None:
+        self._lock = threading.Lock()
+        self._changes: deque[Change] = deque(maxlen=max_changes)
+        # last snapshot per device, the same one is skipped as it is still cached
+        self._snapshots: dict[str, DeviceSnapshot] = {}
+
+    def record(self, device: str, snapshot: DeviceSnapshot) -> list[Change]:
+        """Record the changes of the features `snapshot` of `device` compared to its previous one."""
+        with self._lock:
+            previous = self._snapshots.get(device)
+            if previous is snapshot:
+                return []
+
+            now = time.time()
+            self._snapshots[device] = snapshot
+            if previous is None:
+                return []
+
+            old_features, new_features = previous.features, snapshot.features
+            changes = []
+            for name in old_features.keys() | new_features.keys():
+                old, new = old_features.get(name), new_features.get(name)
+                for path, old_value, new_value in _diff(
+                    name, old.properties if old else None, new.properties if new else None
+                ):
+                    changes.append(Change(now, device, path, old_value, new_value, new.timestamp if new else None))
+            changes.sort(key=lambda change: change.path)
+            self._changes.extend(changes)
+            return changes
+
+    def get_state(self) -> dict[str, Any]:
+        """Get the changes and the last snapshot per device, e.g. to persist them across restarts."""
+        with self._lock:
+            return {"changes": list(self._changes), "snapshots": dict(self._snapshots)}
+
+    def restore(self, state: dict[str, Any]) -> None:
+        """Restore a state of `get_state`, so changes made while the server was down are recorded on the next refresh."""
+        with self._lock:
+            self._changes.extend(state["changes"])
+            self._snapshots.update(state["snapshots"])
+
+    def since(self, timestamp: float | None = None, device: str | None = None) -> list[Change]:
+        """Get all changes recorded after `timestamp` (if given, else all) of `device` (if given, else all), oldest first."""
+        with self._lock:
+            changes = []
+            for change in reversed(self._changes):
+                if timestamp is not None and change.timestamp <= timestamp:
+                    break
+                if device is None or change.device == device:
+                    changes.append(change)
+        changes.reverse()
+        return changes
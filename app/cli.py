@@ -0,0 +1,20 @@
+import argparse
+
+from app import bench
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Entry point of the `vicare-automation-server` command."""
+    parser = argparse.ArgumentParser(prog="vicare-automation-server")
+    subparsers = parser.add_subparsers(required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="load test the server", description=bench.__doc__)
+    bench.add_arguments(bench_parser)
+    bench_parser.set_defaults(run=bench.main)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Literal
+
+from app.upstream_executor import Priority, UpstreamExecutor
+
+logger = logging.getLogger(__name__)
+
+# "skipped" if not executed at all, as the device was already in the requested state
+CommandStatus = Literal["pending", "running", "succeeded", "failed", "superseded", "skipped"]
+# a single action, or independent actions executed concurrently (e.g. deactivating several programs)
+Action = Callable[[], Any] | Sequence[Callable[[], Any]]
+
+
+@dataclass
+class Command:
+    id: str
+    device: str
+    name: str
+    value: Any
+    action: Action = field(repr=False)
+    status: CommandStatus = "pending"
+    # number of further submissions collapsed into this command, i.e. only its latest value is executed
+    coalesced: int = 0
+    submitted_at: float = field(default_factory=time.time)
+    executed_at: float | None = None
+    error: str | None = None
+    exception: Exception | None = field(default=None, repr=False)
+    # called with the number of upstream calls once sent, e.g. to charge them to the client submitting the latest value
+    charge: Callable[[int], Any] | None = field(default=None, repr=False)
+
+
+class CommandQueue:
+    """Thread-safe queue debouncing and executing device commands (e.g. PUT requests) in the background.
+
+    Submissions of the same command to the same device are collapsed into a single command executing the latest value
+    only, dispatched once no further submission followed within `debounce_window` seconds (trailing-edge debounce).
+    Commands of a device are executed one after another in order of dispatch, so concurrent writes to a device cannot
+    interleave. If given an `upstream` executor, the actions are executed by it
+    with the highest priority, i.e. before any reads, and the independent actions of a command concurrently.
+
+    Commands that wouldn't change the state of the device, as known for at most `skip_max_age` seconds, can be
+    recorded as skipped instead of being executed, see `skip`.
+    """
+
+    def __init__(
+        self,
+        debounce_window: float,
+        upstream: UpstreamExecutor | None = None,
+        history_size: int = 256,
+        skip_max_age: float = 0.0,
+    ) -> None:
+        self._debounce_window = debounce_window
+        self._upstream = upstream
+        self._history_size = history_size
+        self._skip_max_age = skip_max_age
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, str], Command] = {}
+        # monotonic time to dispatch each pending command at, postponed by every further submission
+        self._dispatch_at: dict[tuple[str, str], float] = {}
+        # bounded history of all commands by id, see `get`
+        self._commands: OrderedDict[str, Command] = OrderedDict()
+        # unfinished (pending or running) commands and the last execution per device and name, never evicted unlike
+        # the history, as they decide whether a command may be skipped
+        self._unfinished: Counter[tuple[str, str]] = Counter()
+        self._executed_at: dict[tuple[str, str], float] = {}
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        # of dispatched commands not executed yet, to await them on shutdown
+        self._futures: set[Future] = set()
+
+    def submit(
+        self,
+        device: str,
+        name: str,
+        value: Any,
+        action: Action,
+        wait: bool = False,
+        charge: Callable[[int], Any] | None = None,
+    ) -> Command:
+        """Submit command `name` with `value` to `device`, to be executed by calling `action`, and `charge` (if given)
+        to be called with the number of its actions once sent.
+
+        If `wait` is set, the command is executed without debouncing and this call blocks until it finished, re-raising
+        its exception (if any). A pending command with the same name is superseded by it, the other pending commands of
+        the device are dispatched right before it, so it is not executed ahead of commands submitted earlier.
+        """
+        key = (device, name)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None and not wait:
+                pending.value = value
+                pending.action = action
+                pending.charge = charge
+                pending.coalesced += 1
+                self._dispatch_at[key] = time.monotonic() + self._debounce_window
+                return pending
+            if pending is not None:
+                pending.status = "superseded"
+                del self._pending[key]
+                del self._dispatch_at[key]
+                self._finish(key)
+
+            command = Command(id=uuid.uuid4().hex, device=device, name=name, value=value, action=action, charge=charge)
+            self._remember(command)
+            self._unfinished[key] += 1
+            future: Future | None = None
+            if wait:
+                # in order of submission, as pending commands are kept in insertion order
+                for pending_key in [k for k in self._pending if k[0] == device]:
+                    self._submit_pending(pending_key)
+                future = self._submit(command)
+            else:
+                self._pending[key] = command
+                self._dispatch_at[key] = time.monotonic() + self._debounce_window
+                self._start_timer(key, command, self._debounce_window)
+
+        if future is not None:
+            future.result()
+            if command.exception is not None:
+                raise command.exception
+        return command
+
+    def skip(self, device: str, name: str, value: Any, unchanged_since: float) -> Command | None:
+        """Record command `name` with `value` to `device` as skipped, as the device was known to be in the requested
+        state at `unchanged_since` (wall clock time).
+
+        The command is not skipped, returning None, if that is longer than `skip_max_age` seconds ago, or if a command
+        with the same name is unfinished or finished since then, as the known state may be outdated.
+        """
+        now = time.time()
+        with self._lock:
+            if not self._is_unchanged(device, name, unchanged_since, now):
+                return None
+            command = Command(
+                id=uuid.uuid4().hex,
+                device=device,
+                name=name,
+                value=value,
+                action=(),
+                status="skipped",
+                submitted_at=now,
+                executed_at=now,
+            )
+            self._remember(command)
+        logger.info("Skipped command %s of device %s, as it is already %r", name, device, value)
+        return command
+
+    def is_unchanged(self, device: str, name: str, unchanged_since: float) -> bool:
+        """Whether the state of `device` known at `unchanged_since` can still be trusted for command `name`, i.e. the
+        command could be skipped (see `skip`) without recording it, e.g. as part of another command.
+        """
+        with self._lock:
+            return self._is_unchanged(device, name, unchanged_since, time.time())
+
+    def _is_unchanged(self, device: str, name: str, unchanged_since: float, now: float) -> bool:
+        key = (device, name)
+        if now - unchanged_since > self._skip_max_age or self._unfinished[key]:
+            return False
+        executed_at = self._executed_at.get(key)
+        return executed_at is None or executed_at < unchanged_since
+
+    def _finish(self, key: tuple[str, str]) -> None:
+        self._unfinished[key] -= 1
+        if self._unfinished[key] <= 0:
+            del self._unfinished[key]
+
+    def get(self, command_id: str) -> Command | None:
+        with self._lock:
+            return self._commands.get(command_id)
+
+    def _remember(self, command: Command) -> None:
+        self._commands[command.id] = command
+        while len(self._commands) > self._history_size:
+            self._commands.popitem(last=False)
+
+    def _executor(self, device: str) -> ThreadPoolExecutor:
+        executor = self._executors.get(device)
+        if executor is None:
+            # a single worker per device executes its commands strictly in order
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"commands-{device}")
+            self._executors[device] = executor
+        return executor
+
+    def _submit(self, command: Command) -> Future:
+        future = self._executor(command.device).submit(self._execute, command)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def _start_timer(self, key: tuple[str, str], command: Command, delay: float) -> None:
+        timer = threading.Timer(delay, self._dispatch, (key, command))
+        timer.daemon = True
+        timer.start()
+
+    def _dispatch(self, key: tuple[str, str], command: Command, postpone: bool = True) -> None:
+        with self._lock:
+            # superseded by a command waited for, or already dispatched by `flush` or before a command waited for
+            if self._pending.get(key) is not command:
+                return
+            remaining = self._dispatch_at[key] - time.monotonic()
+            if postpone and remaining > 0:
+                # submitted again meanwhile, i.e. restarted the debounce window
+                self._start_timer(key, command, remaining)
+                return
+            self._submit_pending(key)
+
+    def _submit_pending(self, key: tuple[str, str]) -> None:
+        command = self._pending.pop(key)
+        del self._dispatch_at[key]
+        self._submit(command)
+
+    def flush(self, timeout: float) -> tuple[int, int]:
+        """Dispatch all pending commands without waiting for their debounce window, e.g. on shutdown.
+
+        Waits up to `timeout` seconds for all dispatched commands to finish. Returns the number of flushed commands and
+        the number of commands still unfinished.
+        """
+        with self._lock:
+            pending = list(self._pending.items())
+        for key, command in pending:
+            self._dispatch(key, command, postpone=False)
+        # copied atomically, as futures are discarded by the executing threads
+        _, unfinished = wait(self._futures.copy(), timeout=max(timeout, 0))
+        return len(pending), len(unfinished)
+
+    def _execute(self, command: Command) -> None:
+        command.status = "running"
+        try:
+            actions = command.action if isinstance(command.action, Sequence) else [command.action]
+            if command.charge is not None:
+                command.charge(len(actions))
+            if self._upstream is None:
+                for action in actions:
+                    action()
+            else:
+                futures = [self._upstream.submit(Priority.COMMAND, action) for action in actions]
+                # all finished before failing, so no action of the command is still running once it failed
+                wait(futures)
+                for future in futures:
+                    future.result()
+            command.status = "succeeded"
+        except Exception as e:  # noqa: BLE001 - any failure is recorded on the command instead of ending the worker
+            logger.warning("Command %s of device %s failed: %s", command.name, command.device, e)
+            command.status = "failed"
+            command.error = str(e)
+            command.exception = e
+        finally:
+            command.executed_at = time.time()
+            key = (command.device, command.name)
+            with self._lock:
+                self._finish(key)
+                self._executed_at[key] = command.executed_at
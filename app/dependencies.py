@@ -1,25 +1,44 @@
 import asyncio
 import logging
 import time
-from dataclasses import dataclass
-from functools import lru_cache
-from ipaddress import IPv4Address
-from typing import Annotated
-
-from fastapi import Depends
-from pyatv import conf, connect
-from pyatv.const import Protocol
-from pyatv.interface import AppleTV
+import weakref
+from collections.abc import AsyncIterator, Sequence
+from contextvars import copy_context
+from functools import lru_cache, partial
+from typing import Annotated, Any, Protocol
+
+from anyio import to_thread
+from fastapi import Depends, HTTPException, Request
 from PyViCare.PyViCare import PyViCare
+from PyViCare.PyViCareDeviceConfig import PyViCareDeviceConfig
 
+from app.admission import AdmissionController
+from app.appletv import AppleTvConnectionManager, AppleTvState
+from app.changes import ChangeLog
+from app.commands import CommandQueue
+from app.features import DeviceSnapshot, get_snapshot
+from app.heatpump_stats import HeatPumpStats
+from app.loop_monitor import LoopMonitor
+from app.rate_limiting import RateLimiter, get_client_key
 from app.request_tracking import RequestTracker
-from app.settings import Settings
+from app.settings import Settings, get_appletv_devices
+from app.shutdown import load_state, save_state
+from app.structured_logging import get_request_context
+from app.upstream import (
+    CircuitBreaker,
+    PooledHTTPAdapter,
+    PooledViCareOAuthManager,
+    UpstreamPoolMetrics,
+    redirect_vicare,
+)
+from app.upstream_executor import Priority, UpstreamExecutor
 
 logger = logging.getLogger(__name__)
 
-_cached_appletv_connection: "AppleTvConnection | None" = None
-_last_scan_failed_at: float | None = None
-_connection_lock = asyncio.Lock()
+# of all ViCare clients created, i.e. logged in, to persist their tokens on shutdown
+_oauth_managers: "weakref.WeakSet[PooledViCareOAuthManager]" = weakref.WeakSet()
+# ViCare clients by settings once logged in by `get_vicare`, to check readiness without logging in
+_logged_in: dict[Settings, PyViCare] = {}
 
 
 @lru_cache
@@ -32,119 +51,343 @@ def get_request_tracker() -> RequestTracker:
     return RequestTracker()
 
 
+@lru_cache
+def get_upstream_pool_metrics() -> UpstreamPoolMetrics:
+    return UpstreamPoolMetrics()
+
+
 @lru_cache
 def get_settings() -> Settings:
     return Settings()
 
 
+@lru_cache
+def get_upstream_circuit_breaker(settings: Annotated[Settings, Depends(get_settings)]) -> CircuitBreaker:
+    return CircuitBreaker(
+        window_size=settings.vicare_breaker_window,
+        failure_rate_threshold=settings.vicare_breaker_failure_rate,
+        slow_call_duration=settings.vicare_breaker_slow_call_duration,
+        open_duration=settings.vicare_breaker_open_duration,
+    )
+
+
 @lru_cache
 def get_vicare(settings: Annotated[Settings, Depends(get_settings)]) -> PyViCare:
+    if settings.vicare_base_url is not None:
+        redirect_vicare(settings.vicare_base_url)
     vicare = PyViCare()
     vicare.setCacheDuration(120)
-    vicare.initWithCredentials(settings.email, settings.password, settings.client_id, "vicare.token")
+    adapter = PooledHTTPAdapter(
+        get_upstream_pool_metrics(),
+        # called like FastAPI resolves dependencies, i.e. by keyword, to share the same cached instance
+        get_upstream_circuit_breaker(settings=settings),
+        pool_size=settings.vicare_pool_size,
+        connect_timeout=settings.vicare_connect_timeout,
+        read_timeout=settings.vicare_read_timeout,
+        keep_alive_idle=settings.vicare_keep_alive_idle,
+        retries=settings.vicare_retries,
+        retry_backoff=settings.vicare_retry_backoff,
+    )
+    oauth_manager = PooledViCareOAuthManager(
+        settings.email,
+        settings.password,
+        settings.client_id,
+        # tokens of a fake ViCare API must not be reused for the real one
+        "vicare.token" if settings.vicare_base_url is None else None,
+        adapter,
+    )
+    _oauth_managers.add(oauth_manager)
+    vicare.initWithExternalOAuth(oauth_manager)
+    _logged_in[settings] = vicare
     return vicare
 
 
-@dataclass
-class AppleTvConnection:
-    atv: AppleTV
-    host: IPv4Address
-    port: int
-
-
-CONNECTION_TRYING_TIMEOUT = 2.0
-PORT_START = 49152
-PORT_END = PORT_START + 49
-# ponytail: fixed cooldown window; make configurable if poll cadence or device recovery time demands it
-SCAN_COOLDOWN = 60.0
-
-
-async def get_appletv_connection(settings: Annotated[Settings, Depends(get_settings)]) -> AppleTvConnection | None:
-    global _cached_appletv_connection
-    global _last_scan_failed_at
-
-    async with _connection_lock:
-        last_port = None
-        if _cached_appletv_connection is not None:
-            try:
-                _ = _cached_appletv_connection.atv.power.power_state
-                logger.debug("Using cached connection")
-                return _cached_appletv_connection
-            except Exception:
-                logger.info("Cached connection dead, will reconnect")
-                last_port = _cached_appletv_connection.port
-                await teardown_cached_appletv_connection()
-
-        if last_port is not None:
-            logger.debug(f"Trying cached port {last_port}")
-            atv = await _try_to_connect_to_appletv_on_port(last_port, settings)
-            if atv:
-                logger.info(f"Reconnected using cached port {last_port}")
-                _last_scan_failed_at = None
-                _cached_appletv_connection = AppleTvConnection(atv, settings.appletv_host, last_port)
-                return _cached_appletv_connection
-            logger.info(f"Last port {last_port} no longer works")
-
-        if _last_scan_failed_at is not None and (time.monotonic() - _last_scan_failed_at) < SCAN_COOLDOWN:
-            logger.info(
-                f"Skipping scan, last full scan failed {time.monotonic() - _last_scan_failed_at:.1f}s ago "
-                f"(cooldown {SCAN_COOLDOWN}s)"
-            )
-            return None
-
-        logger.info(
-            f"Scanning for Apple TV port (range {PORT_START}-{PORT_END}"
-            + (f" without cached port {last_port})" if last_port else ")")
+def get_logged_in_vicare(settings: Annotated[Settings, Depends(get_settings)]) -> PyViCare | None:
+    """FastAPI dependency to get the ViCare client if logged in already, i.e. without logging in (e.g. for probes)."""
+    return _logged_in.get(settings)
+
+
+async def warm_up(settings: Settings) -> None:
+    """Log in to the ViCare API in the background on startup, so the server is ready without waiting for a request.
+
+    Failures are only logged, as the next request depending on the ViCare API logs in again.
+    """
+    try:
+        # called like FastAPI resolves dependencies, i.e. by keyword, to share the same cached instance
+        await asyncio.to_thread(get_vicare, settings=settings)
+        logger.info("Logged in to ViCare API, ready")
+    except Exception:
+        logger.warning("Logging in to ViCare API on startup failed", exc_info=True)
+
+
+def require_appletv_enabled(settings: Annotated[Settings, Depends(get_settings)]) -> None:
+    """FastAPI router dependency rejecting requests to the Apple TV if its integration is disabled."""
+    if not settings.appletv_enabled:
+        raise HTTPException(404, "Apple TV integration is disabled.")
+
+
+@lru_cache
+def get_appletv_manager(settings: Annotated[Settings, Depends(get_settings)]) -> AppleTvConnectionManager:
+    return AppleTvConnectionManager(
+        get_appletv_devices(settings),
+        settings.appletv_scan_cooldown,
+        settings.appletv_reconnect_backoff,
+        settings.appletv_reconnect_max_backoff,
+    )
+
+
+def get_appletv_name(
+    manager: Annotated[AppleTvConnectionManager, Depends(get_appletv_manager)],
+    name: str | None = None,
+) -> str:
+    """FastAPI dependency to get the name of the addressed Apple TV, i.e. of the only one if none is addressed."""
+    if name is None:
+        if len(manager.names) > 1:
+            raise HTTPException(422, "Multiple Apple TVs configured, address one of them via `/appletv/{name}`.")
+        return manager.names[0]
+    if name not in manager.names:
+        raise HTTPException(404, f"No Apple TV {name} configured.")
+    return name
+
+
+async def get_appletv_state(
+    name: Annotated[str, Depends(get_appletv_name)],
+    manager: Annotated[AppleTvConnectionManager, Depends(get_appletv_manager)],
+) -> AppleTvState:
+    """FastAPI dependency to get the state of the addressed Apple TV, without waiting for it to be (re)connected."""
+    return manager.get_state(name)
+
+
+@lru_cache
+def get_vicare_admission(settings: Annotated[Settings, Depends(get_settings)]) -> AdmissionController:
+    return AdmissionController(
+        "ViCare API", settings.vicare_max_concurrency, settings.vicare_max_queue, settings.admission_retry_after
+    )
+
+
+@lru_cache
+def get_appletv_admissions(settings: Annotated[Settings, Depends(get_settings)]) -> dict[str, AdmissionController]:
+    """Admission per Apple TV by name, so requests waiting for an unreachable one don't hold up the others."""
+    return {
+        name: AdmissionController(
+            f"Apple TV {name}",
+            settings.appletv_max_concurrency,
+            settings.appletv_max_queue,
+            settings.admission_retry_after,
         )
-        for port in range(PORT_START, PORT_END + 1):
-            if last_port and port == last_port:
-                logger.debug(f"Skipping port {port} as already tried above because cached")
-                continue
+        for name in get_appletv_devices(settings)
+    }
+
+
+async def admit_vicare(
+    admission: Annotated[AdmissionController, Depends(get_vicare_admission)],
+) -> AsyncIterator[None]:
+    """FastAPI router dependency admitting requests to the ViCare API, see `AdmissionController`."""
+    async with admission.admit():
+        yield
+
+
+async def admit_appletv(
+    name: Annotated[str, Depends(get_appletv_name)],
+    admissions: Annotated[dict[str, AdmissionController], Depends(get_appletv_admissions)],
+) -> AsyncIterator[None]:
+    """FastAPI router dependency admitting requests to the addressed Apple TV, see `AdmissionController`."""
+    async with admissions[name].admit():
+        yield
+
+
+@lru_cache
+def get_rate_limiter(settings: Annotated[Settings, Depends(get_settings)]) -> RateLimiter:
+    return RateLimiter(
+        settings.rate_limit_rate,
+        settings.rate_limit_burst,
+        settings.rate_limit_upstream_rate,
+        settings.rate_limit_upstream_burst,
+        settings.rate_limit_max_clients,
+    )
+
+
+async def limit_rate(
+    request: Request,
+    settings: Annotated[Settings, Depends(get_settings)],
+    limiter: Annotated[RateLimiter, Depends(get_rate_limiter)],
+) -> AsyncIterator[None]:
+    """FastAPI app dependency limiting the requests and upstream calls per client, see `RateLimiter`."""
+    if not settings.rate_limit_enabled:
+        yield
+        return
+
+    header = settings.rate_limit_client_header
+    key = get_client_key(
+        request.client.host if request.client else None, request.headers.get(header) if header else None
+    )
+    limiter.acquire(key)
+    context = get_request_context()
+    if context is not None:
+        # commands are charged once sent, i.e. not if debounced into a later one or skipped
+        context.charge_upstream = partial(limiter.charge, key)
+    try:
+        yield
+    finally:
+        if context is not None:
+            limiter.charge(key, context.upstream_calls)
+
+
+def reserve_threads(settings: Settings) -> None:
+    """Size the threadpool running sync endpoints to `threadpool_size` threads, grown if admitted upstream requests
+    wouldn't leave `reserved_threads` threads free.
+
+    Must be called from the event loop.
+    """
+    limiter = to_thread.current_default_thread_limiter()
+    appletv_concurrency = settings.appletv_max_concurrency * len(get_appletv_devices(settings))
+    required = settings.vicare_max_concurrency + appletv_concurrency + settings.reserved_threads
+    if settings.threadpool_size < required:
+        logger.info("Growing threadpool from configured %d to %d threads", settings.threadpool_size, required)
+    limiter.total_tokens = max(settings.threadpool_size, required)
+
+
+@lru_cache
+def get_loop_monitor(settings: Annotated[Settings, Depends(get_settings)]) -> LoopMonitor:
+    return LoopMonitor(settings.loop_monitor_interval, settings.loop_block_threshold, settings.loop_block_stacks)
+
+
+@lru_cache
+def get_upstream_executor(settings: Annotated[Settings, Depends(get_settings)]) -> UpstreamExecutor:
+    return UpstreamExecutor(
+        settings.vicare_upstream_workers,
+        settings.vicare_upstream_queue_size,
+        settings.vicare_upstream_aging,
+        settings.admission_retry_after,
+    )
+
+
+@lru_cache
+def get_command_queue(settings: Annotated[Settings, Depends(get_settings)]) -> CommandQueue:
+    # called like FastAPI resolves dependencies, i.e. by keyword, to share the same cached instance
+    return CommandQueue(
+        settings.command_debounce_window,
+        get_upstream_executor(settings=settings),
+        skip_max_age=settings.command_skip_max_age,
+    )
+
+
+@lru_cache
+def get_change_log(settings: Annotated[Settings, Depends(get_settings)]) -> ChangeLog:
+    return ChangeLog(settings.change_log_size)
 
-            logger.debug(f"Trying port {port}")
-            atv = await _try_to_connect_to_appletv_on_port(port, settings)
-            if atv:
-                logger.info(f"Found AppleTV service on port {port} and connected to it")
-                _last_scan_failed_at = None
-                _cached_appletv_connection = AppleTvConnection(atv, settings.appletv_host, port)
-                return _cached_appletv_connection
 
-        logger.warning(f"No working connection to AppleTV found on {settings.appletv_host}")
-        _last_scan_failed_at = time.monotonic()
-        return None
+@lru_cache
+def get_heatpump_stats(settings: Annotated[Settings, Depends(get_settings)]) -> HeatPumpStats:
+    return HeatPumpStats(settings.heatpump_short_cycle_runtime, settings.heatpump_short_cycle_starts_per_hour)
+
+
+def get_devices(
+    vicare: Annotated[PyViCare, Depends(get_vicare)],
+    executor: Annotated[UpstreamExecutor, Depends(get_upstream_executor)],
+    change_log: Annotated[ChangeLog, Depends(get_change_log)],
+    heatpump_stats: Annotated[HeatPumpStats, Depends(get_heatpump_stats)],
+) -> list[PyViCareDeviceConfig]:
+    """FastAPI dependency to get all ViCare devices with freshly fetched features."""
+    refresh_device_features(vicare.devices, executor, [change_log, heatpump_stats])
+    return vicare.devices
 
 
-async def teardown_cached_appletv_connection() -> None:
-    global _cached_appletv_connection
+def restore_state(settings: Settings) -> None:
+    """Restore the state (e.g. the change log) persisted on the last shutdown, if persisted at all."""
+    if settings.state_file is None:
+        return
+    state = load_state(settings.state_file)
+    if state is None:
+        return
+    get_change_log(settings=settings).restore(state["change_log"])
+    get_heatpump_stats(settings=settings).restore(state["heatpump_stats"])
+    # not persisted by earlier versions
+    get_appletv_manager(settings=settings).restore_port_histories(state.get("appletv_ports", {}))
+    logger.info("Restored state from %s", settings.state_file)
 
-    if _cached_appletv_connection is not None:
+
+async def shutdown(settings: Settings) -> None:
+    """Shut down in order within half of `settings.shutdown_timeout` seconds, so no command is dropped on restarts.
+
+    Called by the lifespan shutdown, i.e. once uvicorn stopped admitting requests and waited for the ones in flight
+    within the other half (see `--timeout-graceful-shutdown` in the Dockerfile). Pending commands are flushed, the
+    state and the token are persisted, and finally the background work is cancelled. Must be called from the event
+    loop.
+    """
+    started = time.monotonic()
+    deadline = started + settings.shutdown_timeout / 2
+
+    # called like FastAPI resolves dependencies, i.e. by keyword, to share the same cached instances
+    flushed, unfinished = await asyncio.to_thread(
+        get_command_queue(settings=settings).flush, deadline - time.monotonic()
+    )
+
+    state_persisted = False
+    if settings.state_file is not None:
         try:
-            await asyncio.gather(*_cached_appletv_connection.atv.close())
-            logger.info("Apple TV connection closed")
+            state = {
+                "change_log": get_change_log(settings=settings).get_state(),
+                "heatpump_stats": get_heatpump_stats(settings=settings).get_state(),
+                "appletv_ports": get_appletv_manager(settings=settings).get_port_histories(),
+            }
+            await asyncio.to_thread(save_state, settings.state_file, state)
+            state_persisted = True
         except Exception:
-            logger.info("Apple TV connection closing failed", exc_info=True)
-    _cached_appletv_connection = None
+            logger.exception("Persisting state to %s failed", settings.state_file)
 
+    tokens_persisted = 0
+    for oauth_manager in list(_oauth_managers):
+        try:
+            tokens_persisted += await asyncio.to_thread(oauth_manager.save_token)
+        except Exception:
+            logger.exception("Persisting token to %s failed", oauth_manager.token_file)
 
-async def _try_to_connect_to_appletv_on_port(port: int, settings: Settings) -> AppleTV | None:
-    logger.debug(f"Attempting connection to {settings.appletv_host}:{port}")
+    # commands were flushed above, any other upstream work is obsolete
+    cancelled = get_upstream_executor(settings=settings).cancel(
+        [Priority.INTERACTIVE, Priority.BACKGROUND, Priority.PREFETCH]
+    )
+    await get_appletv_manager(settings=settings).close()
+    await get_loop_monitor(settings=settings).stop()
 
-    config = conf.AppleTV(settings.appletv_host, "Auto")
-    config.add_service(
-        conf.ManualService(
-            settings.appletv_companion_identifier,
-            Protocol.Companion,
-            port,
-            {},
-            credentials=settings.appletv_companion_credentials,
-        )
+    logger.info(
+        "Shutdown finished in %.1fs: %d commands flushed (%d unfinished)",
+        time.monotonic() - started,
+        flushed,
+        unfinished,
+        extra={
+            "commands_flushed": flushed,
+            "commands_unfinished": unfinished,
+            "upstream_cancelled": cancelled,
+            "state_persisted": state_persisted,
+            "tokens_persisted": tokens_persisted,
+        },
     )
 
-    try:
-        return await asyncio.wait_for(connect(config, asyncio.get_running_loop()), timeout=CONNECTION_TRYING_TIMEOUT)
-    except TimeoutError:
-        logger.debug(f"Connection to port {port} timed out after {CONNECTION_TRYING_TIMEOUT}s.")
-        return None
-    except Exception as e:
-        logger.debug(f"Connection to port {port} failed: {type(e).__name__}: {e}")
-        return None
+
+class FeaturesRecorder(Protocol):
+    def record(self, device: str, snapshot: DeviceSnapshot) -> Any: ...
+
+
+def refresh_device_features(
+    devices: list[PyViCareDeviceConfig],
+    executor: UpstreamExecutor,
+    recorders: Sequence[FeaturesRecorder] = (),
+    priority: Priority = Priority.INTERACTIVE,
+) -> None:
+    """Fetch the features of all devices concurrently with `priority`, warming the cache of PyViCare's per-device services.
+
+    The refresh time therefore stays close to the one of the slowest device instead of growing with the number of
+    devices. Failures are only logged, as the next feature read of the affected device replays the cached error.
+    The snapshot of the fetched features, built once per refresh and then backing all endpoint builders, is passed to
+    all `recorders` (e.g. to record their changes), keyed by the device key.
+    """
+    # run in a copy of the request's context, e.g. to attribute upstream timings to the request
+    futures = [(device, executor.submit(priority, copy_context().run, get_snapshot, device)) for device in devices]
+    for device, future in futures:
+        try:
+            snapshot = future.result()
+            for recorder in recorders:
+                recorder.record(f"{device.accessor.serial}.{device.device_id}", snapshot)
+        except Exception:
+            logger.warning("Refreshing features of device %s failed", device.device_id, exc_info=True)
@@ -0,0 +1,388 @@
+"""Fake ViCare cloud, i.e. login (IAM) and API, serving recorded device features for load and resilience testing.
+
+Serves the paths PyViCare requests, so the server can be pointed at it via `VICARE_BASE_URL` (see
+`app.upstream.redirect_vicare`). Latency, errors and a request quota are configurable on startup and at runtime via
+`PUT /fake/config`, e.g. to reproduce incidents. Run on localhost with
+`uv run python -m app.fake_vicare tests/resources/heatpump_features.json --port 8081`, or in-process via `running`.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+from random import Random
+from typing import Any
+from urllib.parse import parse_qs, urlencode
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ConfigDict, Field
+from pydantic.alias_generators import to_camel
+
+REDIRECT_URI = "vicare://oauth-callback/everest"
+
+
+class FakeViCareConfig(BaseModel):
+    """Behaviour of the fake ViCare API, applying to API calls only (i.e. not to the login)."""
+
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    # latency per API call is log-normally distributed around `latency` seconds, `latency_sigma` 0 means constant
+    latency: float = Field(0.0, ge=0)
+    latency_sigma: float = Field(0.0, ge=0)
+    # probability of an API call to fail with the respective error
+    rate_limit_rate: float = Field(0.0, ge=0, le=1)
+    server_error_rate: float = Field(0.0, ge=0, le=1)
+    timeout_rate: float = Field(0.0, ge=0, le=1)
+    # seconds until a timed out API call responds `504`, should exceed the client's read timeout
+    timeout_delay: float = Field(35.0, ge=0)
+    # API calls allowed per quota window, like ViCare's limits of 120 per 10 minutes and 1450 per day
+    quota: int | None = Field(None, ge=0)
+    quota_window: float = Field(600.0, gt=0)
+    # seconds until issued access tokens expire, forcing PyViCare to log in again; authlib already considers tokens
+    # expiring within 60 seconds as expired
+    token_lifetime: int = Field(3600, gt=60)
+
+
+@dataclass
+class FakeDevice:
+    installation_id: int
+    gateway_serial: str
+    device_id: str
+    model_id: str
+    roles: list[str]
+    features: dict[str, dict]
+
+    @classmethod
+    def from_features(cls, payload: dict, model_id: str = "E3_Vitocal", roles: list[str] | None = None) -> "FakeDevice":
+        """Create a device from a recorded features payload, taking its ids from the features."""
+        first = payload["data"][0]
+        installation_id = int(re.search(r"/installations/(\d+)/", first["uri"]).group(1))
+        return cls(
+            installation_id,
+            first["gatewayId"],
+            first["deviceId"],
+            model_id,
+            roles if roles is not None else ["type:heatpump"],
+            {feature["feature"]: feature for feature in payload["data"]},
+        )
+
+
+def _error(status_code: int, error_type: str, message: str, **extra: Any) -> JSONResponse:
+    content = {"viErrorId": uuid.uuid4().hex, "statusCode": status_code, "errorType": error_type, "message": message}
+    return JSONResponse(content | extra, status_code)
+
+
+def _timestamp() -> str:
+    return datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class FakeViCare:
+    """State of the fake ViCare cloud: devices, issued tokens, the quota window and request statistics."""
+
+    def __init__(
+        self,
+        devices: list[FakeDevice],
+        config: FakeViCareConfig | None = None,
+        email: str | None = None,
+        password: str | None = None,
+        seed: int | None = None,
+    ) -> None:
+        self.devices = {(d.installation_id, d.gateway_serial, d.device_id): d for d in devices}
+        self.config = config or FakeViCareConfig()
+        # any credentials are accepted if none are given
+        self._credentials = (email, password) if email is not None and password is not None else None
+        self._random = Random(seed)
+        # handlers of a uvicorn server run on the event loop, but in-process use may access it from other threads
+        self._lock = threading.Lock()
+        self._codes: dict[str, str] = {}
+        self._tokens: dict[str, float] = {}
+        self._quota_window_start = time.time()
+        self._quota_used = 0
+        self.stats: Counter[str] = Counter()
+
+    def check_credentials(self, authorization: str | None) -> bool:
+        if self._credentials is None:
+            return True
+        if authorization is None or not authorization.startswith("Basic "):
+            return False
+        email, _, password = base64.b64decode(authorization.removeprefix("Basic ")).decode().partition(":")
+        return (email, password) == self._credentials
+
+    def issue_code(self, code_challenge: str) -> str:
+        code = secrets.token_urlsafe(16)
+        with self._lock:
+            self._codes[code] = code_challenge
+        return code
+
+    def redeem_code(self, code: str, code_verifier: str) -> dict | None:
+        """Exchange an authorization `code` for a token, verifying its PKCE `code_verifier`."""
+        with self._lock:
+            challenge = self._codes.pop(code, None)
+        digest = hashlib.sha256(code_verifier.encode()).digest()
+        if challenge is None or base64.urlsafe_b64encode(digest).rstrip(b"=").decode() != challenge:
+            return None
+        return self.issue_token()
+
+    def issue_token(self) -> dict:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._tokens[token] = time.time() + self.config.token_lifetime
+            self.stats["tokens"] += 1
+        return {
+            "access_token": token,
+            "token_type": "Bearer",
+            "expires_in": self.config.token_lifetime,
+            "scope": "IoT User",
+        }
+
+    def check_token(self, authorization: str | None) -> bool:
+        token = (authorization or "").removeprefix("Bearer ")
+        with self._lock:
+            expires_at = self._tokens.get(token)
+            if expires_at is not None and expires_at < time.time():
+                del self._tokens[token]
+                expires_at = None
+        return expires_at is not None
+
+    def revoke_tokens(self) -> None:
+        """Revoke all issued tokens, i.e. respond `EXPIRED TOKEN` to their next API call."""
+        with self._lock:
+            self._tokens.clear()
+
+    def use_quota(self) -> float | None:
+        """Count an API call against the quota, returning the time of the quota reset if it is exceeded."""
+        with self._lock:
+            now = time.time()
+            if now - self._quota_window_start >= self.config.quota_window:
+                self._quota_window_start, self._quota_used = now, 0
+            self._quota_used += 1
+            if self.config.quota is not None and self._quota_used > self.config.quota:
+                return self._quota_window_start + self.config.quota_window
+        return None
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            if self.config.latency_sigma == 0:
+                return self.config.latency
+            # log-normal with the configured median
+            return self.config.latency * self._random.lognormvariate(0, self.config.latency_sigma)
+
+    def sample_fault(self) -> str | None:
+        with self._lock:
+            draw = self._random.random()
+        for fault, rate in (
+            ("rateLimited", self.config.rate_limit_rate),
+            ("serverError", self.config.server_error_rate),
+            ("timeout", self.config.timeout_rate),
+        ):
+            if draw < rate:
+                return fault
+            draw -= rate
+        return None
+
+    def get_installations(self) -> dict:
+        installations: dict[int, dict[str, list[FakeDevice]]] = {}
+        for device in self.devices.values():
+            installations.setdefault(device.installation_id, {}).setdefault(device.gateway_serial, []).append(device)
+        return {
+            "data": [
+                {
+                    "id": installation_id,
+                    "gateways": [
+                        {
+                            "serial": serial,
+                            "devices": [
+                                {
+                                    "id": device.device_id,
+                                    "modelId": device.model_id,
+                                    "status": "Online",
+                                    "deviceType": "heating",
+                                    "roles": device.roles,
+                                }
+                                for device in devices
+                            ],
+                        }
+                        for serial, devices in gateways.items()
+                    ],
+                }
+                for installation_id, gateways in installations.items()
+            ]
+        }
+
+    def serialize_features(self, device: FakeDevice) -> str:
+        # serialized under the lock, as commands may update features concurrently
+        with self._lock:
+            return json.dumps({"data": list(device.features.values())})
+
+    def execute(self, device: FakeDevice, name: str, command: str, params: dict) -> bool:
+        """Execute `command` of feature `name` by updating the properties it sets, i.e. activation or same name."""
+        with self._lock:
+            feature = device.features.get(name)
+            if feature is None or command not in feature.get("commands", {}):
+                return False
+            properties = feature["properties"]
+            if command in ("activate", "deactivate") and "active" in properties:
+                properties["active"]["value"] = command == "activate"
+            for param, value in params.items():
+                if param in properties:
+                    properties[param]["value"] = value
+                elif len(params) == 1 and "value" in properties:
+                    properties["value"]["value"] = value
+            feature["timestamp"] = _timestamp()
+            self.stats["commands"] += 1
+        return True
+
+
+def create_app(fake: FakeViCare) -> FastAPI:
+    """Create the ASGI app of the fake ViCare cloud `fake`."""
+    app = FastAPI(title="Fake ViCare API")
+
+    @app.middleware("http")
+    async def inject_faults(request: Request, call_next):
+        if not request.url.path.startswith("/iot/"):
+            return await call_next(request)
+
+        fake.stats["requests"] += 1
+        if not fake.check_token(request.headers.get("Authorization")):
+            fake.stats["expiredTokens"] += 1
+            return JSONResponse({"error": "EXPIRED TOKEN"}, 401)
+
+        await asyncio.sleep(fake.sample_latency())
+        limit_reset = fake.use_quota()
+        fault = "rateLimited" if limit_reset is not None else fake.sample_fault()
+        if fault is not None:
+            fake.stats[fault] += 1
+        if fault == "rateLimited":
+            limit_reset = limit_reset or time.time() + fake.config.quota_window
+            return _error(
+                429,
+                "RATE_LIMIT_EXCEEDED",
+                "API calls rate limit has been exceeded. Please wait until your limit will be renewed.",
+                extendedPayload={
+                    "name": "ViCare limit",
+                    "requestCountLimit": fake.config.quota or 0,
+                    "limitReset": int(limit_reset * 1000),
+                },
+            )
+        if fault == "serverError":
+            return _error(500, "INTERNAL_SERVER_ERROR", "Internal server error")
+        if fault == "timeout":
+            await asyncio.sleep(fake.config.timeout_delay)
+            return _error(504, "GATEWAY_TIMEOUT", "Gateway timeout")
+        return await call_next(request)
+
+    @app.post("/idp/v3/authorize")
+    async def authorize(request: Request) -> Response:
+        if not fake.check_credentials(request.headers.get("Authorization")):
+            # like ViCare, which responds with its login page instead of redirecting
+            return Response("<html><body>Login failed</body></html>", media_type="text/html")
+        code = fake.issue_code(request.query_params.get("code_challenge", ""))
+        query = urlencode({"code": code, "state": request.query_params.get("state", "")})
+        return Response(status_code=302, headers={"Location": f"{REDIRECT_URI}?{query}"})
+
+    @app.post("/idp/v3/token")
+    async def token(request: Request) -> Response:
+        form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        issued = None
+        if form.get("grant_type") == "authorization_code":
+            issued = fake.redeem_code(form.get("code", ""), form.get("code_verifier", ""))
+        if issued is None:
+            return JSONResponse({"error": "invalid_grant"}, 400)
+        return JSONResponse(issued)
+
+    @app.get("/iot/v2/equipment/installations")
+    async def get_installations() -> dict:
+        return fake.get_installations()
+
+    @app.get("/iot/v2/features/installations/{installation_id}/gateways/{serial}/devices/{device_id}/features/")
+    async def get_features(installation_id: int, serial: str, device_id: str) -> Response:
+        device = fake.devices.get((installation_id, serial, device_id))
+        if device is None:
+            return _error(404, "DEVICE_NOT_FOUND", "Device not found")
+        return Response(fake.serialize_features(device), media_type="application/json")
+
+    @app.post(
+        "/iot/v2/features/installations/{installation_id}/gateways/{serial}/devices/{device_id}"
+        "/features/{feature}/commands/{command}"
+    )
+    async def execute_command(
+        installation_id: int, serial: str, device_id: str, feature: str, command: str, request: Request
+    ) -> Response:
+        device = fake.devices.get((installation_id, serial, device_id))
+        params = await request.json() if await request.body() else {}
+        if device is None or not fake.execute(device, feature, command, params):
+            return _error(400, "INVALID_COMMAND", f"Command {command} of feature {feature} not found")
+        return JSONResponse({"data": {"success": True, "reason": "COMMAND_EXECUTION_SUCCESS", "message": None}})
+
+    @app.get("/fake/config")
+    async def get_config() -> dict:
+        return fake.config.model_dump(by_alias=True)
+
+    @app.put("/fake/config")
+    async def set_config(config: FakeViCareConfig) -> dict:
+        fake.config = config
+        return fake.config.model_dump(by_alias=True)
+
+    @app.post("/fake/revoke-tokens", status_code=204)
+    async def revoke_tokens() -> None:
+        fake.revoke_tokens()
+
+    @app.get("/fake/stats")
+    async def get_stats() -> dict:
+        return dict(fake.stats)
+
+    return app
+
+
+@contextmanager
+def running(app: FastAPI, host: str = "127.0.0.1", port: int = 0) -> Iterator[str]:
+    """Run `app` on a background thread of this process, yielding its base URL until the context is left."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name=f"server-{app.title}", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"{app.title} failed to start")
+        time.sleep(0.01)
+    try:
+        bound_port = server.servers[0].sockets[0].getsockname()[1]
+        yield f"http://{host}:{bound_port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("features", nargs="+", type=Path, help="recorded features payloads, one per device")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--email", help="only accept this email (and password) on login, else any")
+    parser.add_argument("--password")
+    parser.add_argument("--seed", type=int, help="seed of latencies and errors, for reproducible runs")
+    for name, field in FakeViCareConfig.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=field.default)
+    args = parser.parse_args()
+
+    config = FakeViCareConfig(**{name: getattr(args, name) for name in FakeViCareConfig.model_fields})
+    devices = [FakeDevice.from_features(json.loads(path.read_text())) for path in args.features]
+    fake = FakeViCare(devices, config, args.email, args.password, args.seed)
+    uvicorn.run(create_app(fake), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
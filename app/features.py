@@ -0,0 +1,284 @@
+import math
+import sys
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+from typing import Any
+
+from PyViCare.PyViCareDevice import Device
+from PyViCare.PyViCareUtils import (
+    PyViCareCommandError,
+    PyViCareNotSupportedFeatureError,
+)
+
+# string values up to this length are interned, i.e. states and units like `on` or `celsius`, but not e.g. messages
+MAX_INTERNED_LENGTH = 32
+
+
+def _compact(value: Any) -> Any:
+    """Compact a JSON value: keys and short strings interned, lists turned into tuples."""
+    if isinstance(value, str):
+        return sys.intern(value) if len(value) <= MAX_INTERNED_LENGTH else value
+    if isinstance(value, dict):
+        return {sys.intern(key): _compact(v) for key, v in value.items()}
+    if isinstance(value, list):
+        return tuple(_compact(v) for v in value)
+    return value
+
+
+class Feature:
+    """A feature reduced to the fields the API uses: its typed properties (`{"type": ..., "value": ...}`) are reduced to
+    their values, e.g. `{"value": 48}` instead of `{"value": {"type": "number", "value": 48, "unit": "celsius"}}`, and
+    their units are kept apart, e.g. `{"value": "celsius"}`.
+    """
+
+    __slots__ = ("name", "properties", "timestamp", "units")
+
+    def __init__(
+        self, name: str, timestamp: str | None, properties: dict[str, Any], units: dict[str, str] | None = None
+    ) -> None:
+        self.name = name
+        # as reported by the ViCare API, i.e. shared by most features of a payload
+        self.timestamp = timestamp
+        self.properties = properties
+        # None instead of an empty dict, as most features have no units
+        self.units = units or None
+
+    @classmethod
+    def from_payload(cls, feature: dict[str, Any]) -> "Feature":
+        timestamp = feature.get("timestamp")
+        props = feature.get("properties", {})
+        return cls(
+            sys.intern(feature["feature"]),
+            sys.intern(timestamp) if timestamp is not None else None,
+            {
+                sys.intern(name): _compact(prop["value"] if isinstance(prop, dict) and "value" in prop else prop)
+                for name, prop in props.items()
+            },
+            {
+                sys.intern(name): sys.intern(prop["unit"])
+                for name, prop in props.items()
+                if isinstance(prop, dict) and isinstance(prop.get("unit"), str)
+            },
+        )
+
+    def __repr__(self) -> str:
+        return f"Feature({self.name!r}, {self.properties!r})"
+
+
+class CommandSpec:
+    """A command of a feature reduced to whether it is executable and the type and constraints of its parameters, e.g.
+    `{"temperature": {"type": "number", "required": True, "min": 10, "max": 60, "stepping": 1}}`.
+    """
+
+    __slots__ = ("executable", "params")
+
+    def __init__(self, executable: bool, params: dict[str, dict[str, Any]]) -> None:
+        self.executable = executable
+        self.params = params
+
+    @classmethod
+    def from_payload(cls, command: dict[str, Any]) -> "CommandSpec":
+        return cls(
+            command.get("isExecutable", True),
+            {
+                sys.intern(name): _compact(
+                    {
+                        "type": param.get("type"),
+                        "required": param.get("required", False),
+                        **param.get("constraints", {}),
+                    }
+                )
+                for name, param in command.get("params", {}).items()
+            },
+        )
+
+    def __repr__(self) -> str:
+        return f"CommandSpec({self.executable!r}, {self.params!r})"
+
+
+class DeviceSnapshot:
+    """Compact snapshot of the features of a single device, built in one pass over its features payload.
+
+    Only features carrying properties are kept, and every key and short string is interned, so the keys repeated in
+    every feature (e.g. `value`) and by every device are stored once per process instead of once per occurrence.
+    Feature names are additionally kept sorted, so all features below a prefix (e.g. `heating.circuits.0.`) are found
+    by binary search, i.e. in O(log n + k) for k matching features instead of scanning all n features per lookup.
+    The commands of all features (with or without properties) are kept by feature name to validate commands locally.
+    """
+
+    __slots__ = ("_names", "commands", "created_at", "features")
+
+    def __init__(
+        self,
+        features: list[Feature],
+        commands: dict[str, dict[str, CommandSpec]] | None = None,
+        created_at: float | None = None,
+    ) -> None:
+        self.features: dict[str, Feature] = {feature.name: feature for feature in features}
+        self.commands = commands or {}
+        # wall clock time the payload was fetched at (if known, else now), i.e. the state of the device is known from
+        self.created_at = created_at if created_at is not None else time.time()
+        self._names = sorted(self.features)
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any], created_at: float | None = None) -> "DeviceSnapshot":
+        return cls(
+            [Feature.from_payload(feature) for feature in payload["data"] if feature.get("properties")],
+            {
+                sys.intern(feature["feature"]): {
+                    sys.intern(name): CommandSpec.from_payload(command) for name, command in feature["commands"].items()
+                }
+                for feature in payload["data"]
+                if feature.get("commands")
+            },
+            created_at,
+        )
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def has_same_features(self, other: "DeviceSnapshot") -> bool:
+        """Whether `other` has the same features with the same timestamps and property values as this snapshot."""
+        return self._names == other._names and all(
+            (feature.timestamp, feature.properties) == (other.features[name].timestamp, other.features[name].properties)
+            for name, feature in self.features.items()
+        )
+
+    def below(self, prefix: str) -> dict[str, Feature]:
+        """Get all features with names starting with `prefix`, keyed by their name relative to `prefix`."""
+        start = bisect_left(self._names, prefix)
+        end = bisect_left(self._names, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo=start) if prefix else len(self._names)
+        return {name[len(prefix) :]: self.features[name] for name in self._names[start:end]}
+
+
+def properties(features: dict[str, Feature], name: str) -> dict[str, Any]:
+    """Get the property values of feature `name` in `features`, raising like PyViCare if the feature is missing."""
+    feature = features.get(name)
+    if feature is None:
+        raise PyViCareNotSupportedFeatureError(name)
+    return feature.properties
+
+
+def value(features: dict[str, Feature], name: str, prop: str = "value") -> Any:
+    """Get the value of property `prop` of feature `name` in `features`, raising like PyViCare if it is missing."""
+    try:
+        return properties(features, name)[prop]
+    except KeyError as e:
+        raise PyViCareNotSupportedFeatureError(f"{name}.{prop}") from e
+
+
+def unit(features: dict[str, Feature], name: str, prop: str = "value") -> str:
+    """Get the unit of property `prop` of feature `name` in `features`, raising like PyViCare if it is missing."""
+    feature = features.get(name)
+    if feature is None or feature.units is None or prop not in feature.units:
+        raise PyViCareNotSupportedFeatureError(f"{name}.{prop}.unit")
+    return feature.units[prop]
+
+
+def constraint(snapshot: "DeviceSnapshot", name: str, command: str, param: str, key: str) -> Any:
+    """Get constraint `key` (e.g. `max`) of parameter `param` of command `command` of feature `name` in `snapshot`,
+    raising like PyViCare if it is missing.
+    """
+    try:
+        return snapshot.commands[name][command].params[param][key]
+    except KeyError as e:
+        raise PyViCareNotSupportedFeatureError(f"{name}.{command}.{param}.{key}") from e
+
+
+def validate_command(snapshot: DeviceSnapshot, feature: str, command: str, params: dict[str, Any]) -> None:
+    """Validate command `command` of feature `feature` with `params` against the command metadata in `snapshot`.
+
+    Raises like PyViCare would once the ViCare API rejected the command, i.e. `PyViCareNotSupportedFeatureError` if the
+    device doesn't support it and `PyViCareCommandError` if it is not executable or a parameter violates its type or
+    constraints (`min`, `max`, `stepping` and `enum`).
+    """
+    spec = snapshot.commands.get(feature, {}).get(command)
+    if spec is None:
+        raise PyViCareNotSupportedFeatureError(f"{feature}.{command}")
+    if not spec.executable:
+        raise PyViCareCommandError(f"{feature}.{command} is currently not executable")
+
+    unknown = params.keys() - spec.params.keys()
+    if unknown:
+        raise PyViCareCommandError(f"Unknown parameters {sorted(unknown)} of {feature}.{command}")
+    for name, param in spec.params.items():
+        if name not in params:
+            if param["required"]:
+                raise PyViCareCommandError(f"Missing parameter {name} of {feature}.{command}")
+            continue
+        error = _check_param(param, params[name])
+        if error is not None:
+            raise PyViCareCommandError(f"Invalid parameter {name} of {feature}.{command}: {params[name]!r} {error}")
+
+
+def _check_param(param: dict[str, Any], value: Any) -> str | None:
+    """Check `value` against the type and constraints of `param`, returning the violation if any."""
+    if param["type"] == "number":
+        if isinstance(value, bool) or not isinstance(value, int | float):
+            return "is not a number"
+        if "min" in param and value < param["min"]:
+            return f"is below {param['min']}"
+        if "max" in param and value > param["max"]:
+            return f"is above {param['max']}"
+        if param.get("stepping"):
+            steps = (value - param.get("min", 0)) / param["stepping"]
+            if not math.isclose(steps, round(steps), abs_tol=1e-9):
+                return f"is not a multiple of {param['stepping']}"
+    elif param["type"] == "string" and not isinstance(value, str):
+        return "is not a string"
+    elif param["type"] == "boolean" and not isinstance(value, bool):
+        return "is not a boolean"
+    if "enum" in param and value not in param["enum"]:
+        return f"is not one of {list(param['enum'])}"
+    return None
+
+
+# the snapshot per device with the version of the payload it was built from, see `get_snapshot`
+_snapshots: dict[tuple, tuple[tuple[int, Any] | None, DeviceSnapshot]] = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(device: Device) -> DeviceSnapshot:
+    """Get the snapshot of the cached features of `device`.
+
+    The snapshot is only rebuilt if PyViCare's cache returns a new features payload, i.e. at most once per refresh. New
+    payloads are detected by their identity together with the time PyViCare cached them at, so the payload itself is
+    not referenced, i.e. freed as soon as PyViCare's cache replaces it. Without cache, every payload is a new one.
+
+    The snapshot is created at the time PyViCare fetched its payload. If the fetch failed, PyViCare serves the stale
+    payload again under a new cache time: if the payload is the same object with the same features, the previous
+    snapshot is kept, so stale features are never considered fresher than they are (e.g. to skip commands).
+    """
+    data = device.service.fetch_all_features(device.accessor)
+    cached_at = getattr(device.service, "_cacheTime", None)
+    version = (id(data), cached_at) if cached_at is not None else None
+    key = (device.accessor.id, device.accessor.serial, device.accessor.device_id)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached is not None and version is not None and cached[0] == version:
+            return cached[1]
+
+    snapshot = DeviceSnapshot.from_payload(data, cached_at.timestamp() if isinstance(cached_at, datetime) else None)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        # the payload served again, unless an equal one was allocated at the address of a freed one (kept all the same)
+        if _is_same_payload(cached, version) and cached[1].has_same_features(snapshot):
+            snapshot = cached[1]
+        _snapshots[key] = (version, snapshot)
+    return snapshot
+
+
+def _is_same_payload(
+    cached: tuple[tuple[int, Any] | None, DeviceSnapshot] | None, version: tuple[int, Any] | None
+) -> bool:
+    return cached is not None and cached[0] is not None and version is not None and cached[0][0] == version[0]
+
+
+def get_cached_snapshot(device: Device) -> DeviceSnapshot | None:
+    """Get the last snapshot of the features of `device` without fetching them, None if never fetched."""
+    key = (device.accessor.id, device.accessor.serial, device.accessor.device_id)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+    return cached[1] if cached is not None else None
@@ -0,0 +1,55 @@
+from collections.abc import Callable
+from functools import lru_cache
+
+HeatCurveFormular = Callable[[float, float, float, float], float]
+
+# outside temperatures per evaluation, i.e. the size of every cached curve, e.g. -50 to 50 in steps of 0.1
+MAX_POINTS = 1_001
+# curves (and grids) cached, i.e. at most `CACHE_SIZE * MAX_POINTS` (about 128k) floats or a few MiB per cache
+CACHE_SIZE = 128
+
+
+def outside_temperatures(start: float, end: float, step: float) -> tuple[float, ...]:
+    """Get the outside temperatures from `start` to `end` (inclusive, if reached by `step`)."""
+    # computed from the index instead of summing up steps, which would accumulate rounding errors
+    return tuple(round(start + i * step, 6) for i in range(int((end - start) / step + 1e-9) + 1))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _get_basis(
+    formular: HeatCurveFormular, inside: float, start: float, end: float, step: float
+) -> tuple[float, tuple[float, ...]]:
+    """Decompose `formular` for the given outside temperatures into its offset and its slope coefficients.
+
+    The formulars are affine in shift and slope, i.e. `formular(delta, inside, shift, slope) = inside + shift + offset +
+    slope * coefficient(delta)`, so the polynomial in delta is evaluated once per grid of outside temperatures and each
+    curve is a single multiply-add per point on top of it.
+    """
+    offset = formular(0, 0, 0, 0)
+    coefficients = tuple(
+        formular(outside - inside, 0, 0, 1) - offset for outside in outside_temperatures(start, end, step)
+    )
+    return offset, coefficients
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def evaluate(
+    formular: HeatCurveFormular,
+    inside: float,
+    start: float,
+    end: float,
+    step: float,
+    shift: float,
+    slope: float,
+    minimum: float,
+    maximum: float,
+) -> tuple[float, ...]:
+    """Evaluate the heating curve `formular` with `shift` and `slope` for the given outside temperatures.
+
+    Returns the target supply temperatures limited to `minimum` and `maximum` and rounded like
+    `HeatingCircuit.getTargetSupplyTemperature`. Results are cached per curve and grid, as clients tuning a curve
+    request the same candidates repeatedly.
+    """
+    offset, coefficients = _get_basis(formular, inside, start, end, step)
+    base = inside + shift + offset
+    return tuple(float(round(max(minimum, min(base + slope * c, maximum)), 1)) for c in coefficients)
@@ -0,0 +1,209 @@
+import copy
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any, TypedDict
+
+from app.features import DeviceSnapshot, Feature
+
+# sliding windows the statistics are computed over, by name
+WINDOWS = {"1h": 3600, "24h": 24 * 3600, "7d": 7 * 24 * 3600}
+# time buckets per window, i.e. its resolution (1 min for 1h), and thereby the fixed memory per window
+BUCKETS = 60
+# samples further apart than this are not interpolated, i.e. the compressor's runtime is taken from its hours counter
+MAX_SAMPLE_GAP = 15 * 60
+
+SUPPLY_TEMPERATURE = "heating.secondaryCircuit.sensors.temperature.supply"
+RETURN_TEMPERATURE = "heating.sensors.temperature.return"
+
+# totals kept per time bucket (and window)
+_OBSERVED, _RUNTIME, _STARTS, _SPREAD, _SPREAD_OBSERVED = range(5)
+
+
+class WindowStats(TypedDict):
+    observed: float
+    duty_cycle: float | None
+    starts: int
+    starts_per_hour: float | None
+    average_runtime: float | None
+    supply_return_spread: float | None
+    short_cycling: bool
+
+
+class SlidingWindow:
+    """Totals over the last `duration` seconds, kept in a ring buffer of `buckets` time buckets.
+
+    Adding to and reading the totals is O(1), as the totals are maintained incrementally: expired buckets are subtracted
+    once when their slot of the ring buffer is reused, instead of summing all buckets per read.
+    """
+
+    def __init__(self, duration: float, buckets: int = BUCKETS) -> None:
+        self._width = duration / buckets
+        self._numbers = [-1] * buckets
+        self._buckets = [[0.0] * 5 for _ in range(buckets)]
+        self._totals = [0.0] * 5
+        self._current = -1
+
+    def _advance(self, timestamp: float) -> int:
+        """Expire all buckets older than the window ending at `timestamp`, returning the slot of its bucket."""
+        number = int(timestamp // self._width)
+        size = len(self._buckets)
+        # at most one pass over the ring buffer, however long ago the last sample was
+        for expired in range(max(self._current + 1, number - size + 1), number + 1):
+            slot = expired % size
+            if self._numbers[slot] != expired:
+                self._totals = [total - value for total, value in zip(self._totals, self._buckets[slot], strict=True)]
+                self._buckets[slot] = [0.0] * 5
+                self._numbers[slot] = expired
+        self._current = max(self._current, number)
+        return number % size
+
+    def add(self, timestamp: float, values: list[float]) -> None:
+        slot = self._advance(timestamp)
+        bucket = self._buckets[slot]
+        for i, value in enumerate(values):
+            bucket[i] += value
+            self._totals[i] += value
+
+    def totals(self, timestamp: float) -> list[float]:
+        self._advance(timestamp)
+        # incremental subtraction may leave rounding errors below zero
+        return [max(total, 0.0) for total in self._totals]
+
+
+@dataclass
+class _Sample:
+    timestamp: float
+    active: bool
+    starts: int | None
+    hours: float | None
+    spread: float | None
+
+
+def _value(features: dict[str, Feature], name: str, prop: str = "value") -> Any:
+    feature = features.get(name)
+    return feature.properties.get(prop) if feature is not None else None
+
+
+class CompressorStats:
+    """Derived statistics of a single compressor, updated incrementally with each sample of its features.
+
+    The runtime between two samples is interpolated from the compressor's state at the earlier one, or taken from its
+    hours counter if the samples are further apart than `MAX_SAMPLE_GAP`. Starts are taken from its starts counter, so
+    they are exact regardless of the sample rate.
+    """
+
+    def __init__(self, short_cycle_runtime: float, short_cycle_starts_per_hour: float) -> None:
+        self._short_cycle_runtime = short_cycle_runtime
+        self._short_cycle_starts_per_hour = short_cycle_starts_per_hour
+        self._windows = {name: SlidingWindow(duration) for name, duration in WINDOWS.items()}
+        self._last: _Sample | None = None
+
+    def add(self, sample: _Sample) -> None:
+        last, self._last = self._last, sample
+        if last is None or sample.timestamp <= last.timestamp:
+            return
+
+        elapsed = sample.timestamp - last.timestamp
+        values = [elapsed, 0.0, 0.0, 0.0, 0.0]
+        if elapsed <= MAX_SAMPLE_GAP:
+            values[_RUNTIME] = elapsed if last.active else 0.0
+            if last.active and last.spread is not None:
+                values[_SPREAD] = last.spread * elapsed
+                values[_SPREAD_OBSERVED] = elapsed
+        elif sample.hours is not None and last.hours is not None:
+            values[_RUNTIME] = min(max(sample.hours - last.hours, 0.0) * 3600, elapsed)
+        # counters may be reset, e.g. by a service technician
+        if sample.starts is not None and last.starts is not None and sample.starts >= last.starts:
+            values[_STARTS] = sample.starts - last.starts
+
+        for window in self._windows.values():
+            window.add(sample.timestamp, values)
+
+    def get_stats(self, timestamp: float) -> dict[str, WindowStats]:
+        return {name: self._get_window_stats(window.totals(timestamp)) for name, window in self._windows.items()}
+
+    def _get_window_stats(self, totals: list[float]) -> WindowStats:
+        observed, runtime, starts = totals[_OBSERVED], totals[_RUNTIME], round(totals[_STARTS])
+        starts_per_hour = starts / observed * 3600 if observed else None
+        average_runtime = runtime / starts if starts else None
+        return WindowStats(
+            observed=round(observed, 1),
+            duty_cycle=round(runtime / observed, 3) if observed else None,
+            starts=starts,
+            starts_per_hour=round(starts_per_hour, 2) if starts_per_hour is not None else None,
+            average_runtime=round(average_runtime, 1) if average_runtime is not None else None,
+            supply_return_spread=(
+                round(totals[_SPREAD] / totals[_SPREAD_OBSERVED], 2) if totals[_SPREAD_OBSERVED] else None
+            ),
+            short_cycling=starts > 1
+            and (average_runtime < self._short_cycle_runtime or starts_per_hour > self._short_cycle_starts_per_hour),
+        )
+
+
+class HeatPumpStats:
+    """Thread-safe derived statistics of the compressors of all heat pumps, sampled at each refresh of their features.
+
+    Memory is fixed per compressor, i.e. `BUCKETS` time buckets per window.
+    """
+
+    def __init__(
+        self,
+        short_cycle_runtime: float,
+        short_cycle_starts_per_hour: float,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._short_cycle_runtime = short_cycle_runtime
+        self._short_cycle_starts_per_hour = short_cycle_starts_per_hour
+        self._clock = clock
+        self._lock = threading.Lock()
+        # last snapshot per device, to skip unchanged, i.e. still cached ones
+        self._snapshots: dict[str, DeviceSnapshot] = {}
+        self._compressors: dict[tuple[str, str], CompressorStats] = {}
+
+    def record(self, device: str, snapshot: DeviceSnapshot) -> None:
+        """Sample the compressors of `device` from its features `snapshot`, if any."""
+        with self._lock:
+            if self._snapshots.get(device) is snapshot:
+                return
+            self._snapshots[device] = snapshot
+
+            timestamp = self._clock()
+            features = snapshot.features
+            supply, ret = _value(features, SUPPLY_TEMPERATURE), _value(features, RETURN_TEMPERATURE)
+            spread = supply - ret if supply is not None and ret is not None else None
+            for name, feature in features.items():
+                prefix, _, compressor = name.rpartition(".")
+                if prefix != "heating.compressors" or "active" not in feature.properties:
+                    continue
+                sample = _Sample(
+                    timestamp,
+                    bool(_value(features, name, "active")),
+                    _value(features, f"{name}.statistics", "starts"),
+                    _value(features, f"{name}.statistics", "hours"),
+                    spread,
+                )
+                stats = self._compressors.get((device, compressor))
+                if stats is None:
+                    stats = CompressorStats(self._short_cycle_runtime, self._short_cycle_starts_per_hour)
+                    self._compressors[(device, compressor)] = stats
+                stats.add(sample)
+
+    def get_state(self) -> dict[str, Any]:
+        """Get the statistics of all compressors, e.g. to persist them across restarts."""
+        with self._lock:
+            # copied, as the statistics are updated in place
+            return {"compressors": copy.deepcopy(self._compressors)}
+
+    def restore(self, state: dict[str, Any]) -> None:
+        with self._lock:
+            self._compressors.update(state["compressors"])
+
+    def get_stats(self, device: str, compressor: str) -> dict[str, WindowStats]:
+        """Get the statistics of `compressor` of `device` per window, empty ones if it was not sampled yet."""
+        with self._lock:
+            stats = self._compressors.get((device, compressor))
+            if stats is None:
+                stats = CompressorStats(self._short_cycle_runtime, self._short_cycle_starts_per_hour)
+            return stats.get_stats(self._clock())
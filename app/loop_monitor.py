@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import TypedDict
+
+from anyio import to_thread
+
+logger = logging.getLogger(__name__)
+
+# lag samples kept to report their distribution, i.e. a minute at the default interval
+LAG_SAMPLES = 120
+
+
+class LoopMetrics(TypedDict):
+    # of the last `LAG_SAMPLES` samples, in milliseconds
+    lag_avg_ms: float
+    lag_max_ms: float
+    # samples lagging longer than the block threshold since started
+    blocked: int
+    tasks: int
+    threadpool_size: int
+    threadpool_active: int
+    threadpool_waiting: int
+
+
+class LoopMonitor:
+    """Samples the lag of the event loop, the saturation of the threadpool running sync endpoints and the asyncio tasks.
+
+    Every `interval` seconds, a background task measures how much later than scheduled it is woken up, i.e. how long
+    the event loop was blocked, logging a warning if longer than `block_threshold` seconds. If `sample_stacks` is set,
+    a watchdog thread additionally logs the stack of the event loop thread while it is blocked, i.e. of the blocking
+    code, which is only known while blocking.
+
+    Started and stopped from the event loop, the metrics are thread-safe.
+    """
+
+    def __init__(self, interval: float, block_threshold: float, sample_stacks: bool) -> None:
+        self._interval = interval
+        self._block_threshold = block_threshold
+        self._sample_stacks = sample_stacks
+        self._lock = threading.Lock()
+        self._lags: deque[float] = deque(maxlen=LAG_SAMPLES)
+        self._blocked = 0
+        self._tasks = 0
+        self._threadpool: tuple[int, int, int] = (0, 0, 0)
+        # monotonic time the sampling task last ran at, read by the watchdog thread
+        self._heartbeat = 0.0
+        self._task: asyncio.Task | None = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start sampling in the background. Must be called from the event loop."""
+        self._stopped.clear()
+        self._heartbeat = time.monotonic()
+        threadpool = _get_threadpool_usage()
+        with self._lock:
+            self._threadpool = threadpool
+        self._task = asyncio.get_running_loop().create_task(self._sample(), name="loop-monitor")
+        if self._sample_stacks:
+            loop_thread = threading.get_ident()
+            threading.Thread(target=self._watch, args=(loop_thread,), name="loop-monitor-watchdog", daemon=True).start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sample(self) -> None:
+        while True:
+            scheduled = time.monotonic() + self._interval
+            await asyncio.sleep(self._interval)
+            self._heartbeat = now = time.monotonic()
+            lag = max(now - scheduled, 0.0)
+            if lag > self._block_threshold:
+                logger.warning("Event loop was blocked for %.0fms", lag * 1000, extra={"lag_ms": round(lag * 1000)})
+
+            threadpool = _get_threadpool_usage()
+            with self._lock:
+                self._lags.append(lag)
+                self._blocked += lag > self._block_threshold
+                self._tasks = len(asyncio.all_tasks())
+                self._threadpool = threadpool
+
+    def _watch(self, loop_thread: int) -> None:
+        """Log the stack of the event loop thread once per block, i.e. as long as the heartbeat stays the same."""
+        sampled = None
+        while not self._stopped.wait(self._block_threshold / 2):
+            heartbeat = self._heartbeat
+            if heartbeat == sampled or time.monotonic() - heartbeat < self._interval + self._block_threshold:
+                continue
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                return
+            sampled = heartbeat
+            logger.warning(
+                "Event loop blocked for more than %.0fms in:\n%s",
+                self._block_threshold * 1000,
+                "".join(traceback.format_stack(frame)),
+            )
+
+    def get_metrics(self) -> LoopMetrics:
+        with self._lock:
+            size, active, waiting = self._threadpool
+            return LoopMetrics(
+                lag_avg_ms=round(sum(self._lags) / len(self._lags) * 1000, 1) if self._lags else 0.0,
+                lag_max_ms=round(max(self._lags) * 1000, 1) if self._lags else 0.0,
+                blocked=self._blocked,
+                tasks=self._tasks,
+                threadpool_size=size,
+                threadpool_active=active,
+                threadpool_waiting=waiting,
+            )
+
+
+def _get_threadpool_usage() -> tuple[int, int, int]:
+    """Size, active and waiting tasks of the threadpool running sync endpoints. Must be called from the event loop."""
+    statistics = to_thread.current_default_thread_limiter().statistics()
+    return statistics.total_tokens, statistics.borrowed_tokens, statistics.tasks_waiting
@@ -1,6 +1,8 @@
+import asyncio
+import math
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
 from PyViCare.PyViCareUtils import (
     PyViCareBrowserOAuthTimeoutReachedError,
     PyViCareCommandError,
@@ -15,30 +17,66 @@ from starlette import status
 from starlette.responses import PlainTextResponse
 
 from app import dependencies
-from app.api import appletv, circuit, dhw, health, heatpump, ventilation
+from app.admission import AdmissionRejectedError
+from app.api import (
+    appletv,
+    changes,
+    circuit,
+    commands,
+    devices,
+    dhw,
+    health,
+    heatpump,
+    ventilation,
+)
 from app.dependencies import get_request_tracker
+from app.rate_limiting import RateLimitedError
 from app.request_tracking import RequestTrackingMiddleware
+from app.structured_logging import (
+    RequestContextMiddleware,
+    start_queue_listeners,
+    stop_queue_listeners,
+)
+from app.upstream import UpstreamUnavailableError
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Application startup")
+    start_queue_listeners()
+    settings = dependencies.get_settings()
+    dependencies.reserve_threads(settings)
+    # called like FastAPI resolves dependencies, i.e. by keyword, to share the same cached instance
+    dependencies.get_loop_monitor(settings=settings).start()
+    dependencies.restore_state(settings)
+    # referenced until done, as the event loop only keeps weak references to tasks
+    warm_up = asyncio.create_task(dependencies.warm_up(settings), name="vicare-warm-up")
     yield
     # Teardown
     print("Application shutdown")
-    await dependencies.teardown_cached_appletv_connection()
+    warm_up.cancel()
+    await dependencies.shutdown(settings)
+    # last, so the logs of the shutdown are emitted
+    stop_queue_listeners()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(dependencies.limit_rate)])
 
 app.include_router(appletv.router)
+app.include_router(changes.router)
 app.include_router(circuit.router)
+app.include_router(commands.router)
+app.include_router(devices.router)
 app.include_router(dhw.router)
 app.include_router(health.router)
 app.include_router(heatpump.router)
 app.include_router(ventilation.router)
 
+for device_router in (circuit.router, dhw.router, heatpump.router, ventilation.router):
+    app.include_router(device_router, prefix=devices.ROUTE_PREFIX_DEVICE)
+
 app.add_middleware(RequestTrackingMiddleware, request_tracker=get_request_tracker())
+app.add_middleware(RequestContextMiddleware)
 
 
 @app.exception_handler(PyViCareRateLimitError)
@@ -64,6 +102,39 @@ def auth_exception_handler(_request, exc):
     return PlainTextResponse(str(exc), status.HTTP_401_UNAUTHORIZED)
 
 
+@app.exception_handler(AdmissionRejectedError)
+def admission_rejected_exception_handler(_request, exc):
+    return PlainTextResponse(
+        str(exc), status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(RateLimitedError)
+def rate_limited_exception_handler(_request, exc):
+    return PlainTextResponse(str(exc), status.HTTP_429_TOO_MANY_REQUESTS, headers={"Retry-After": str(exc.retry_after)})
+
+
 @app.exception_handler(PyViCareInternalServerError)
-def internal_server_exception_handler(_request, exc):
+def internal_server_exception_handler(request, exc):
+    retry_after = _get_upstream_retry_after(request, exc)
+    if retry_after is not None:
+        # no (stale) cached data to fall back on while the circuit breaker is open
+        return PlainTextResponse(
+            str(UpstreamUnavailableError(retry_after)),
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
     return PlainTextResponse(exc.message, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _get_upstream_retry_after(request: Request, exc: PyViCareInternalServerError) -> float | None:
+    """Get the seconds until the ViCare API is called again if `exc` is due to the open circuit breaker, else None.
+
+    Only the fetch rejected by the breaker raises an error caused by it, the following reads of the device replay
+    PyViCare's cached error without cause (e.g. after a refresh of all devices), so the breaker is checked as well.
+    """
+    if isinstance(exc.__cause__, UpstreamUnavailableError):
+        return exc.__cause__.retry_after
+    # resolved like FastAPI does, to respect overridden settings
+    settings = request.app.dependency_overrides.get(dependencies.get_settings, dependencies.get_settings)()
+    return dependencies.get_upstream_circuit_breaker(settings=settings).get_retry_after()
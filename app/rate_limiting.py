@@ -0,0 +1,167 @@
+import copy
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import TypedDict
+
+# clients reported by `get_metrics`, i.e. the ones with the most upstream calls
+REPORTED_CLIENTS = 20
+
+
+class RateLimitedError(Exception):
+    """Raised if a client exceeded its budget of requests or of upstream calls."""
+
+    def __init__(self, client: str, budget: str, retry_after: int) -> None:
+        super().__init__(f"Too many {budget} of client {client}, retry in {retry_after}s")
+        self.client = client
+        self.budget = budget
+        self.retry_after = retry_after
+
+
+class ClientUsage(TypedDict):
+    client: str
+    requests: int
+    upstream_calls: int
+    limited: int
+    tokens: float
+    upstream_tokens: float
+
+
+class RateLimiterMetrics(TypedDict):
+    clients: int
+    max_clients: int
+    evicted: int
+    limited: int
+    top_clients: list[ClientUsage]
+
+
+class _Client:
+    """Token buckets and usage of a single client."""
+
+    __slots__ = ("limited", "requests", "tokens", "updated_at", "upstream_calls", "upstream_tokens")
+
+    def __init__(self, tokens: float, upstream_tokens: float, now: float) -> None:
+        self.tokens = tokens
+        self.upstream_tokens = upstream_tokens
+        self.updated_at = now
+        self.requests = 0
+        self.upstream_calls = 0
+        self.limited = 0
+
+
+class RateLimiter:
+    """Token bucket rate limits per client, protecting the ViCare API quota shared by all clients of the server.
+
+    Each client has two buckets: one for all of its requests (most of them are served from PyViCare's cache), refilled
+    at `rate` tokens per second up to `burst`, and one for its upstream calls, refilled at `upstream_rate` up to
+    `upstream_burst`. Requests are charged for the upstream calls they actually made afterwards, reads as they
+    finished and commands once they are sent, i.e. not if debounced into a later one or skipped. So a client is only
+    limited once it exceeded its upstream budget, i.e. its upstream bucket is in debt.
+
+    Buckets are refilled lazily on access, so checks are O(1). At most `max_clients` clients are kept, evicting the
+    least recently seen one, so memory is fixed regardless of the number of clients.
+
+    Thread-safe, as commands are charged by the threads sending them.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        upstream_rate: float,
+        upstream_burst: float,
+        max_clients: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._upstream_rate = upstream_rate
+        self._upstream_burst = upstream_burst
+        self._max_clients = max_clients
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._clients: OrderedDict[str, _Client] = OrderedDict()
+        self._evicted = 0
+        self._limited = 0
+
+    def _get_client(self, key: str) -> _Client:
+        now = self._clock()
+        client = self._clients.get(key)
+        if client is None:
+            client = _Client(self._burst, self._upstream_burst, now)
+            self._clients[key] = client
+            if len(self._clients) > self._max_clients:
+                self._clients.popitem(last=False)
+                self._evicted += 1
+        else:
+            self._clients.move_to_end(key)
+            elapsed = now - client.updated_at
+            client.tokens = min(self._burst, client.tokens + elapsed * self._rate)
+            client.upstream_tokens = min(self._upstream_burst, client.upstream_tokens + elapsed * self._upstream_rate)
+            client.updated_at = now
+        return client
+
+    def acquire(self, key: str) -> None:
+        """Take a token of client `key` for a request.
+
+        Raises a `RateLimitedError` if the client has no token left or its upstream bucket is in debt, taking none.
+        """
+        with self._lock:
+            client = self._get_client(key)
+            if client.tokens < 1:
+                self._reject(client, key, "requests", 1 - client.tokens, self._rate)
+            if client.upstream_tokens < 0:
+                self._reject(client, key, "upstream calls", -client.upstream_tokens, self._upstream_rate)
+
+            client.tokens -= 1
+            client.requests += 1
+
+    def charge(self, key: str, upstream_calls: int) -> None:
+        """Charge client `key` for `upstream_calls` made by a request, possibly putting its upstream bucket in debt."""
+        if not upstream_calls:
+            return
+        with self._lock:
+            client = self._get_client(key)
+            # bounded, so a single expensive request can't lock out a client for long
+            client.upstream_tokens = max(client.upstream_tokens - upstream_calls, -self._upstream_burst)
+            client.upstream_calls += upstream_calls
+
+    def _reject(self, client: _Client, key: str, budget: str, missing: float, rate: float) -> None:
+        client.limited += 1
+        self._limited += 1
+        raise RateLimitedError(key, budget, math.ceil(missing / rate) if rate > 0 else 60)
+
+    def get_metrics(self) -> RateLimiterMetrics:
+        with self._lock:
+            clients = [(key, copy.copy(client)) for key, client in self._clients.items()]
+        ranked = sorted(clients, key=lambda item: (item[1].upstream_calls, item[1].requests), reverse=True)
+        return RateLimiterMetrics(
+            clients=len(clients),
+            max_clients=self._max_clients,
+            evicted=self._evicted,
+            limited=self._limited,
+            top_clients=[
+                ClientUsage(
+                    client=key,
+                    requests=client.requests,
+                    upstream_calls=client.upstream_calls,
+                    limited=client.limited,
+                    tokens=round(client.tokens, 2),
+                    upstream_tokens=round(client.upstream_tokens, 2),
+                )
+                for key, client in ranked[:REPORTED_CLIENTS]
+            ],
+        )
+
+
+def get_client_key(host: str | None, header_value: str | None) -> str:
+    """Identify a client by the value of its identifying header (e.g. an API key), else by its IP address.
+
+    Header values are hashed, so e.g. API keys are not exposed by the reported metrics.
+    """
+    if header_value:
+        return f"key:{hashlib.blake2b(header_value.encode(), digest_size=6).hexdigest()}"
+    return f"ip:{host or 'unknown'}"
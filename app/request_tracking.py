@@ -20,7 +20,9 @@ class RequestTrackingMiddleware(BaseHTTPMiddleware):
         response = await call_next(request)
         if not request.url.path.startswith("/health"):
             message = self._extract_message(response)
-            self.request_tracker.record_request(request.url.path, response.status_code, message)
+            # the route template (e.g. `/commands/{command_id}`) if matched, set by the router on the same scope
+            route = getattr(request.scope.get("route"), "path", UNMATCHED_ROUTE)
+            self.request_tracker.record_request(request.url.path, response.status_code, message, route)
         return response
 
     @staticmethod
@@ -34,6 +36,74 @@ class RequestTrackingMiddleware(BaseHTTPMiddleware):
         return "n/a"
 
 
+# rolling windows of the request statistics by label, in seconds
+ROLLING_WINDOWS = {"1m": 60, "5m": 5 * 60, "1h": 60 * 60, "24h": 24 * 60 * 60}
+# time buckets per rolling window, i.e. its resolution
+BUCKETS_PER_WINDOW = 60
+# rolling statistics of requests not matching any route, e.g. of scanners, excluded from the overall error rates
+UNMATCHED_ROUTE = "unmatched"
+# routes with rolling statistics, further ones are counted as `OTHER_ROUTES` to keep memory constant
+MAX_ROLLING_ROUTES = 64
+OTHER_ROUTES = "other"
+
+
+class WindowStatistics(TypedDict):
+    requests: int
+    failures: int
+    error_rate: float
+
+
+class RollingStatistics(TypedDict):
+    overall: WindowStatistics
+    by_endpoint: dict[str, WindowStatistics]
+
+
+class _RollingCounter:
+    """Requests and failures within the last `window` seconds, counted in a ring of `buckets` time buckets.
+
+    Memory is fixed and recording is O(1): a bucket is reset when reused for a later time slot. Counts are accurate to
+    the width of a bucket, i.e. `window / buckets` seconds.
+    """
+
+    __slots__ = ("_failures", "_requests", "_slots", "_width")
+
+    def __init__(self, window: float, buckets: int) -> None:
+        self._width = window / buckets
+        # the time slot (i.e. timestamp divided by the bucket width) each bucket currently counts
+        self._slots = [-1] * buckets
+        self._requests = [0] * buckets
+        self._failures = [0] * buckets
+
+    def record(self, timestamp: float, failed: bool) -> None:
+        slot = int(timestamp // self._width)
+        index = slot % len(self._slots)
+        if self._slots[index] != slot:
+            if self._slots[index] > slot:
+                # older than the window, as the bucket already counts a later slot
+                return
+            self._slots[index] = slot
+            self._requests[index] = 0
+            self._failures[index] = 0
+        self._requests[index] += 1
+        self._failures[index] += failed
+
+    def get(self, timestamp: float) -> tuple[int, int]:
+        """Get the requests and failures within the window ending at `timestamp`."""
+        oldest = int(timestamp // self._width) - len(self._slots)
+        requests = failures = 0
+        for index, slot in enumerate(self._slots):
+            if slot > oldest:
+                requests += self._requests[index]
+                failures += self._failures[index]
+        return requests, failures
+
+
+def _window_statistics(requests: int, failures: int) -> WindowStatistics:
+    return WindowStatistics(
+        requests=requests, failures=failures, error_rate=round(failures / requests, 4) if requests else 0.0
+    )
+
+
 class LastSuccessMessage(TypedDict):
     endpoint: str
     status_code: int
@@ -53,24 +123,43 @@ class RequestTracker:
         self._counts_by_endpoint: dict[str, Counter[int]] = defaultdict(Counter)
         self._last_success_message: LastSuccessMessage | None = None
         self._last_failure_message: LastFailureMessage | None = None
+        # rolling counters per route, one per window of `ROLLING_WINDOWS`
+        self._rolling_by_endpoint: dict[str, list[_RollingCounter]] = {}
+
+    def record_request(self, endpoint: str, status_code: int, message: str, route: str | None = None) -> None:
+        """Record a request with its status code, optional message, and endpoint.
 
-    def record_request(self, endpoint: str, status_code: int, message: str) -> None:
-        """Record a request with its status code, optional message, and endpoint."""
+        Rolling statistics are kept by `route`, e.g. the template of the route matching the endpoint, if given.
+        """
+        now = time.time()
+        failed = status_code < 200 or status_code >= 300
+        route = endpoint if route is None else route
         with self._lock:
             self._counts_by_endpoint[endpoint][status_code] += 1
 
-            if status_code < 200 or status_code >= 300:
+            rolling = self._rolling_by_endpoint.get(route)
+            if rolling is None:
+                if len(self._rolling_by_endpoint) >= MAX_ROLLING_ROUTES:
+                    route = OTHER_ROUTES
+                rolling = self._rolling_by_endpoint.get(route)
+            if rolling is None:
+                rolling = [_RollingCounter(window, BUCKETS_PER_WINDOW) for window in ROLLING_WINDOWS.values()]
+                self._rolling_by_endpoint[route] = rolling
+            for counter in rolling:
+                counter.record(now, failed)
+
+            if failed:
                 self._last_failure_message = LastFailureMessage(
                     endpoint=endpoint,
                     message=message,
                     status_code=status_code,
-                    timestamp=time.time(),
+                    timestamp=now,
                 )
             else:
                 self._last_success_message = LastSuccessMessage(
                     endpoint=endpoint,
                     status_code=status_code,
-                    timestamp=time.time(),
+                    timestamp=now,
                 )
 
     def get_statistics(self) -> dict[str, Any]:
@@ -98,6 +187,30 @@ class RequestTracker:
             "by_endpoint": counts_by_endpoint,
         }
 
+    def get_rolling_statistics(self) -> dict[str, RollingStatistics]:
+        """Get the requests, failures and error rates within each of the `ROLLING_WINDOWS`, overall and by route.
+
+        Routes without requests within a window are omitted from it. Requests not matching any route are excluded from
+        the overall statistics.
+        """
+        now = time.time()
+        statistics = {}
+        with self._lock:
+            for position, label in enumerate(ROLLING_WINDOWS):
+                by_endpoint = {}
+                total_requests = total_failures = 0
+                for endpoint, rolling in self._rolling_by_endpoint.items():
+                    requests, failures = rolling[position].get(now)
+                    if requests:
+                        by_endpoint[endpoint] = _window_statistics(requests, failures)
+                    if endpoint != UNMATCHED_ROUTE:
+                        total_requests += requests
+                        total_failures += failures
+                statistics[label] = RollingStatistics(
+                    overall=_window_statistics(total_requests, total_failures), by_endpoint=by_endpoint
+                )
+        return statistics
+
     def get_last_success_message(self) -> LastSuccessMessage | None:
         """Get the last success message.
 
@@ -122,5 +235,6 @@ class RequestTracker:
         """Reset all statistics (mainly for testing)."""
         with self._lock:
             self._counts_by_endpoint.clear()
+            self._rolling_by_endpoint.clear()
             self._last_success_message = None
             self._last_failure_message = None
@@ -1,19 +1,131 @@
 from ipaddress import IPv4Address
+from typing import Literal
 
+from pydantic import BaseModel, ConfigDict, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# name of the Apple TV configured by `appletv_host` etc., i.e. addressed by `/appletv/default`
+DEFAULT_APPLETV = "default"
+
+
+class AppleTvDevice(BaseModel):
+    # frozen, i.e. hashable like the settings
+    model_config = ConfigDict(frozen=True)
+
+    host: IPv4Address
+    companion_identifier: str
+    companion_credentials: str
+
 
 class Settings(BaseSettings):
     client_id: str
     email: str
     password: str
 
-    appletv_host: IPv4Address
-    appletv_companion_identifier: str
-    appletv_companion_credentials: str
+    # optional integration, if disabled its dependencies (i.e. pyatv) are not even imported
+    appletv_enabled: bool = True
+    appletv_host: IPv4Address | None = None
+    appletv_companion_identifier: str | None = None
+    appletv_companion_credentials: str | None = None
+    # further Apple TVs by name, as JSON, e.g. `{"bedroom": {"host": "…", "companion_identifier": "…", …}}`
+    appletv_devices: dict[str, AppleTvDevice] = {}
+    # Apple TVs are (re)connected in the background, retrying with exponential backoff and full jitter from the initial
+    # backoff up to the maximum (in seconds); the port range is scanned at most once per cooldown
+    appletv_reconnect_backoff: float = 1.0
+    appletv_reconnect_max_backoff: float = 60.0
+    appletv_scan_cooldown: float = 60.0
+
+    # send all ViCare requests (login and API calls) to this URL instead, e.g. to a local fake (see `app.fake_vicare`)
+    vicare_base_url: str | None = None
+
+    # should match the concurrency of upstream calls, i.e. at least the number of concurrently refreshed devices
+    vicare_pool_size: int = 8
+    vicare_connect_timeout: float = 5.0
+    vicare_read_timeout: float = 31.0
+    vicare_keep_alive_idle: int = 60
+
+    # idempotent reads are retried on connection errors, timeouts and server errors with jittered exponential backoff
+    vicare_retries: int = 2
+    vicare_retry_backoff: float = 0.5
+
+    # the circuit breaker opens if the rate of failed or slow calls within the window reaches the threshold
+    vicare_breaker_window: int = 20
+    vicare_breaker_failure_rate: float = 0.5
+    vicare_breaker_slow_call_duration: float = 10.0
+    vicare_breaker_open_duration: float = 30.0
+
+    # all ViCare API work is executed by these threads, commands before reads of requests before background work, each
+    # class queued up to the queue size; waiting raises the priority by one class per aging seconds, to prevent starvation
+    vicare_upstream_workers: int = 8
+    vicare_upstream_queue_size: int = 64
+    vicare_upstream_aging: float = 10.0
+
+    # concurrent requests per upstream dependency, further ones wait in a bounded queue or are shed with 503
+    vicare_max_concurrency: int = 8
+    vicare_max_queue: int = 32
+    appletv_max_concurrency: int = 2
+    appletv_max_queue: int = 8
+    admission_retry_after: int = 5
+    # threads of the threadpool not available to upstream requests, i.e. reserved for e.g. `/health`
+    reserved_threads: int = 4
+    # threads of the threadpool running sync endpoints (i.e. all ViCare routes), grown if too few to leave the reserved
+    threadpool_size: int = 40
+
+    # seconds between samples of the event loop lag, logged as blocked if longer than the threshold, optionally with the
+    # stack of the blocking code (sampled by a watchdog thread)
+    loop_monitor_interval: float = 0.5
+    loop_block_threshold: float = 0.1
+    loop_block_stacks: bool = False
+
+    # token buckets per client (requests per second and burst), for all requests and for those calling the ViCare API
+    # (commands, and reads not served from cache), so a single client can't exhaust the quota shared by all clients
+    rate_limit_enabled: bool = True
+    rate_limit_rate: float = 5.0
+    rate_limit_burst: float = 30.0
+    rate_limit_upstream_rate: float = 0.1
+    rate_limit_upstream_burst: float = 20.0
+    rate_limit_max_clients: int = 1024
+    # clients are identified by the value of this header (e.g. `X-API-Key`) if set and sent, else by their IP address
+    rate_limit_client_header: str | None = None
+
+    # if set, `/health` reports the last failure as its status code once the error rate within the rolling window
+    # reaches this threshold (e.g. `0.5`), instead of once the last failure is persistent, i.e. not followed by a success
+    health_error_rate_threshold: float | None = None
+    health_error_rate_window: Literal["1m", "5m", "1h", "24h"] = "5m"
+    # seconds the detailed report of `/health` is served from cache, unlike the probes `/health/live` and `/health/ready`
+    health_cache_ttl: float = 2.0
+
+    # number of feature value changes kept in memory to be served by `/changes`
+    change_log_size: int = 1000
+
+    # a compressor is considered short cycling if its cycles run shorter (in seconds) or start more often on average
+    heatpump_short_cycle_runtime: float = 600.0
+    heatpump_short_cycle_starts_per_hour: float = 3.0
+
+    # seconds without repeated commands (e.g. PUT requests of a slider) before executing the latest value of them
+    command_debounce_window: float = 1.0
+    # seconds the state of a device, as last fetched, is trusted to skip commands that wouldn't change it
+    command_skip_max_age: float = 60.0
+
+    # on shutdown, uvicorn waits for the requests in flight within the first half of this time (see the Dockerfile),
+    # then pending commands are flushed and the state persisted within the second half, i.e. it should stay below the
+    # grace period of the orchestrator (e.g. 30 seconds of Kubernetes) between SIGTERM and SIGKILL
+    shutdown_timeout: float = 25.0
+    # file the change log, heat pump statistics and Apple TV port histories are persisted to on shutdown and restored
+    # from on startup, if set
+    state_file: str | None = None
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
+    @model_validator(mode="after")
+    def check_appletv_settings(self) -> "Settings":
+        legacy = (self.appletv_host, self.appletv_companion_identifier, self.appletv_companion_credentials)
+        if self.appletv_enabled and None in legacy and (not self.appletv_devices or any(legacy)):
+            raise ValueError("Apple TV host, companion identifier and credentials are required if it is enabled")
+        if self.appletv_host is not None and DEFAULT_APPLETV in self.appletv_devices:
+            raise ValueError(f"Apple TV `{DEFAULT_APPLETV}` is already configured by the Apple TV host")
+        return self
+
     def __hash__(self):
         """
         Custom hash function based on mail - one client per mail - to be able to hash it in
@@ -26,6 +138,22 @@ class Settings(BaseSettings):
             + self.email
             + self.password
             + str(self.appletv_host)
-            + self.appletv_companion_identifier
-            + self.appletv_companion_credentials
+            + str(self.appletv_companion_identifier)
+            + str(self.appletv_companion_credentials)
+            + str(self.appletv_devices)
+        )
+
+
+def get_appletv_devices(settings: Settings) -> dict[str, AppleTvDevice]:
+    """All Apple TVs by name, none if the integration is disabled."""
+    if not settings.appletv_enabled:
+        return {}
+    # copied, as the default one is added
+    devices = dict(settings.appletv_devices)
+    if settings.appletv_host is not None:
+        devices[DEFAULT_APPLETV] = AppleTvDevice(
+            host=settings.appletv_host,
+            companion_identifier=settings.appletv_companion_identifier,
+            companion_credentials=settings.appletv_companion_credentials,
         )
+    return devices
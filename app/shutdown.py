@@ -0,0 +1,27 @@
+import logging
+import os
+import pickle
+from pickle import UnpicklingError
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+def save_state(path: str, state: dict[str, Any]) -> None:
+    """Persist `state` to `path`, replacing the previous state atomically, so it is never left half-written."""
+    temporary = f"{path}.tmp"
+    with open(temporary, mode="wb") as file:
+        pickle.dump(state, file)
+    os.replace(temporary, path)
+
+
+def load_state(path: str) -> dict[str, Any] | None:
+    """Load the state persisted to `path`, if any and readable (e.g. not written by an incompatible version)."""
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, mode="rb") as file:
+            return pickle.load(file)
+    except (UnpicklingError, EOFError, AttributeError, ImportError):
+        logger.warning("Could not restore state from %s", path, exc_info=True)
+        return None
@@ -0,0 +1,146 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from logging.handlers import QueueListener
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+@dataclass
+class RequestContext:
+    request_id: str
+    endpoint: str
+    upstream_calls: int = 0
+    upstream_ms: float = 0.0
+    # charges upstream calls made on behalf of the request after it finished (e.g. by its commands) to its client
+    charge_upstream: Callable[[int], None] | None = field(default=None, repr=False)
+    # upstream calls of a request may be made concurrently, e.g. when refreshing multiple devices
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record_upstream_call(self, duration_ms: float) -> None:
+        with self._lock:
+            self.upstream_calls += 1
+            self.upstream_ms += duration_ms
+
+
+_request_context: ContextVar[RequestContext | None] = ContextVar("request_context", default=None)
+
+
+def get_request_context() -> RequestContext | None:
+    """Get the context of the request currently handled, if any."""
+    return _request_context.get()
+
+
+class RequestContextMiddleware:
+    """ASGI middleware providing a `RequestContext` to everything handling a request, e.g. to logging.
+
+    The request id is taken from the `X-Request-ID` request header (or generated) and returned as response header. On
+    completion, each request is logged with its duration and the number and duration of the upstream calls it made.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        context = RequestContext(request_id, scope["path"])
+        token = _request_context.set(context)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append(REQUEST_ID_HEADER, request_id)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            logger.info(
+                "%s %s responded %d in %.1f ms",
+                scope["method"],
+                scope["path"],
+                status_code,
+                duration_ms,
+                extra={
+                    "status_code": status_code,
+                    "duration_ms": round(duration_ms, 1),
+                    "upstream_calls": context.upstream_calls,
+                    "upstream_ms": round(context.upstream_ms, 1),
+                },
+            )
+            _request_context.reset(token)
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds `request_id` and `endpoint` of the current request to log records.
+
+    Must be attached to the handler the record is emitted to (e.g. a `QueueHandler`), as the context is not available
+    anymore once the record is passed to another thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        record.request_id = context.request_id if context else None
+        record.endpoint = context.endpoint if context else None
+        return True
+
+
+# attributes of every log record, i.e. everything else was passed via `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as single line JSON objects including all fields passed via `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str | None = None) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+
+
+def _get_queue_listeners() -> list[QueueListener]:
+    handlers = (logging.getHandlerByName(name) for name in logging.getHandlerNames())
+    return [handler.listener for handler in handlers if isinstance(getattr(handler, "listener", None), QueueListener)]
+
+
+def start_queue_listeners() -> None:
+    """Start the listeners of all configured `QueueHandler`s, unless already started by `logging.config`."""
+    for listener in _get_queue_listeners():
+        if listener._thread is None:
+            listener.start()
+
+
+def stop_queue_listeners() -> None:
+    """Stop the listeners of all configured `QueueHandler`s, flushing the records still queued."""
+    for listener in _get_queue_listeners():
+        if listener._thread is not None:
+            listener.stop()
@@ -0,0 +1,388 @@
+import logging
+import os
+import pickle
+import random
+import socket
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Any, Literal, TypedDict
+
+import PyViCare.PyViCareAbstractOAuthManager
+import PyViCare.PyViCareOAuthManager
+from PyViCare.PyViCareOAuthManager import ViCareOAuthManager
+from requests import ConnectionError as RequestsConnectionError
+from requests import PreparedRequest, RequestException, Response, Session, Timeout
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from app.structured_logging import get_request_context
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics(TypedDict):
+    size: int
+    in_use: int
+    waiting: int
+    new_connections: int
+    requests: int
+
+
+class UpstreamPoolMetrics:
+    """Thread-safe metrics of the connection pool used for requests to the ViCare API."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._size = 0
+        self._in_flight = 0
+        self._new_connections = 0
+        self._requests = 0
+
+    def set_size(self, size: int) -> None:
+        with self._lock:
+            self._size = size
+
+    def record_request_started(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+            self._requests += 1
+
+    def record_request_finished(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def record_new_connection(self) -> None:
+        with self._lock:
+            self._new_connections += 1
+
+    def get_metrics(self) -> PoolMetrics:
+        with self._lock:
+            return PoolMetrics(
+                size=self._size,
+                in_use=min(self._in_flight, self._size),
+                # the pool blocks, so requests exceeding its size wait for a connection to be returned
+                waiting=max(0, self._in_flight - self._size),
+                new_connections=self._new_connections,
+                requests=self._requests,
+            )
+
+    def reset(self) -> None:
+        """Reset all counters (mainly for testing)."""
+        with self._lock:
+            self._in_flight = 0
+            self._new_connections = 0
+            self._requests = 0
+
+
+BreakerState = Literal["closed", "open", "half_open"]
+
+
+class BreakerMetrics(TypedDict):
+    state: BreakerState
+    error_rate: float
+    slow_call_rate: float
+    calls: int
+    rejected: int
+    retry_after: float
+
+
+class UpstreamUnavailableError(RequestsConnectionError):
+    """Raised instead of calling the ViCare API while the circuit breaker is open.
+
+    As a `ConnectionError`, PyViCare handles it like any other connection failure, i.e. it serves stale cached features
+    if available and raises a `PyViCareInternalServerError` caused by it otherwise.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"ViCare API unavailable, circuit breaker open (retry in {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker for calls to the ViCare API.
+
+    The outcomes of the last `window_size` calls are tracked, a call counting as failed if it errored or took longer
+    than `slow_call_duration` seconds. Once at least `min_calls` were made and the rate of failed calls reaches
+    `failure_rate_threshold`, the breaker opens and rejects all calls for `open_duration` seconds. Afterwards it is
+    half-open and lets a single trial call pass, which closes it again on success or reopens it on failure.
+    """
+
+    _OK, _ERROR, _SLOW = 0, 1, 2
+
+    def __init__(
+        self,
+        window_size: int = 20,
+        min_calls: int = 5,
+        failure_rate_threshold: float = 0.5,
+        slow_call_duration: float = 10.0,
+        open_duration: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._min_calls = min_calls
+        self._failure_rate_threshold = failure_rate_threshold
+        self._slow_call_duration = slow_call_duration
+        self._open_duration = open_duration
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes: deque[int] = deque(maxlen=window_size)
+        self._state: BreakerState = "closed"
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._rejected = 0
+
+    def before_call(self) -> None:
+        """Check whether a call may be made, raising `UpstreamUnavailableError` if not."""
+        with self._lock:
+            if self._state == "open":
+                retry_after = self._opened_at + self._open_duration - self._clock()
+                if retry_after > 0:
+                    self._rejected += 1
+                    raise UpstreamUnavailableError(retry_after)
+                self._state = "half_open"
+            if self._state == "half_open":
+                if self._trial_in_flight:
+                    self._rejected += 1
+                    raise UpstreamUnavailableError(self._open_duration)
+                self._trial_in_flight = True
+
+    def record_success(self, duration: float) -> None:
+        slow = duration > self._slow_call_duration
+        with self._lock:
+            if self._state == "half_open":
+                self._trial_in_flight = False
+                if slow:
+                    self._open()
+                else:
+                    self._state = "closed"
+                    self._outcomes.clear()
+                return
+            self._record(self._SLOW if slow else self._OK)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state == "half_open":
+                self._trial_in_flight = False
+                self._open()
+                return
+            self._record(self._ERROR)
+
+    def _record(self, outcome: int) -> None:
+        self._outcomes.append(outcome)
+        if self._state == "closed" and len(self._outcomes) >= self._min_calls:
+            failed = sum(1 for o in self._outcomes if o != self._OK)
+            if failed / len(self._outcomes) >= self._failure_rate_threshold:
+                self._open()
+
+    def _open(self) -> None:
+        logger.warning("Opening circuit breaker of ViCare API for %.0f seconds", self._open_duration)
+        self._state = "open"
+        self._opened_at = self._clock()
+
+    def is_open(self) -> bool:
+        """Whether calls are currently rejected, i.e. open and not yet due for a trial call, in constant time."""
+        with self._lock:
+            return self._state == "open" and self._clock() < self._opened_at + self._open_duration
+
+    def get_retry_after(self) -> float | None:
+        """Get the seconds until calls are let through again if currently rejected (see `is_open`), else None."""
+        with self._lock:
+            retry_after = self._opened_at + self._open_duration - self._clock()
+            return retry_after if self._state == "open" and retry_after > 0 else None
+
+    def get_metrics(self) -> BreakerMetrics:
+        with self._lock:
+            calls = len(self._outcomes)
+            errors = sum(1 for o in self._outcomes if o == self._ERROR)
+            slow = sum(1 for o in self._outcomes if o == self._SLOW)
+            retry_after = self._opened_at + self._open_duration - self._clock() if self._state == "open" else 0.0
+            return BreakerMetrics(
+                state=self._state,
+                error_rate=errors / calls if calls else 0.0,
+                slow_call_rate=slow / calls if calls else 0.0,
+                calls=calls,
+                rejected=self._rejected,
+                retry_after=max(0.0, retry_after),
+            )
+
+    def reset(self) -> None:
+        """Close the breaker and forget all outcomes (mainly for testing)."""
+        with self._lock:
+            self._outcomes.clear()
+            self._state = "closed"
+            self._trial_in_flight = False
+            self._rejected = 0
+
+
+def _keep_alive_socket_options(idle: int) -> list[tuple[int, int, int]]:
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # fine-grained keep-alive options are platform specific
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 4)))
+    if hasattr(socket, "TCP_KEEPCNT"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4))
+    return options
+
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RETRYABLE_STATUS_CODES = frozenset({500, 502, 503, 504})
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTP adapter keeping a bounded pool of TCP keep-alive connections with explicit connect and read timeouts.
+
+    Requests block on the pool instead of opening additional connections, so TLS handshakes are only paid for the
+    connections of the pool. All requests pass the circuit breaker; idempotent ones are retried up to `retries` times
+    on connection errors, timeouts and server errors, backing off exponentially with full jitter from `retry_backoff`.
+    """
+
+    def __init__(
+        self,
+        metrics: UpstreamPoolMetrics,
+        breaker: CircuitBreaker,
+        pool_size: int,
+        connect_timeout: float,
+        read_timeout: float,
+        keep_alive_idle: int,
+        retries: int = 0,
+        retry_backoff: float = 0.5,
+    ) -> None:
+        # set before `super().__init__` as it already initializes the pool manager
+        self._metrics = metrics
+        self._breaker = breaker
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._timeout = (connect_timeout, read_timeout)
+        self._keep_alive_idle = keep_alive_idle
+        metrics.set_size(pool_size)
+        super().__init__(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+
+    def init_poolmanager(self, connections: int, maxsize: int, block: bool = True, **pool_kwargs: Any) -> None:
+        socket_options = HTTPConnection.default_socket_options + _keep_alive_socket_options(self._keep_alive_idle)
+        super().init_poolmanager(connections, maxsize, block, socket_options=socket_options, **pool_kwargs)
+
+        metrics = self._metrics
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                metrics.record_new_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                metrics.record_new_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request: PreparedRequest, stream: bool = False, timeout: Any = None, **kwargs: Any) -> Response:
+        attempts = 1 + (self._retries if request.method in IDEMPOTENT_METHODS else 0)
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1:
+                time.sleep(random.uniform(0, self._retry_backoff * 2 ** (attempt - 2)))
+
+            self._breaker.before_call()
+            started = time.monotonic()
+            self._metrics.record_request_started()
+            try:
+                # configured timeouts take precedence over the ones PyViCare passes (if any)
+                response = super().send(request, stream=stream, timeout=self._timeout, **kwargs)
+            except RequestException as e:
+                self._breaker.record_failure()
+                if attempt >= attempts or not isinstance(e, (RequestsConnectionError, Timeout)):
+                    raise
+                logger.debug("Retrying %s %s after attempt %d failed: %s", request.method, request.url, attempt, e)
+                continue
+            except BaseException:
+                # e.g. invalid URLs or interrupts, which must not leave a half-open breaker's trial call in flight
+                self._breaker.record_failure()
+                raise
+            finally:
+                self._metrics.record_request_finished()
+                self._record_timing(request, attempt, started)
+
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                self._breaker.record_success(time.monotonic() - started)
+                return response
+            self._breaker.record_failure()
+            if attempt >= attempts:
+                return response
+            logger.debug(
+                "Retrying %s %s after attempt %d responded %d",
+                request.method,
+                request.url,
+                attempt,
+                response.status_code,
+            )
+            response.close()
+
+    @staticmethod
+    def _record_timing(request: PreparedRequest, attempt: int, started: float) -> None:
+        duration_ms = (time.monotonic() - started) * 1000
+        context = get_request_context()
+        if context is not None:
+            context.record_upstream_call(duration_ms)
+        logger.debug(
+            "Upstream %s %s took %.1f ms",
+            request.method,
+            request.path_url,
+            duration_ms,
+            extra={"upstream_attempt": attempt, "upstream_ms": round(duration_ms, 1)},
+        )
+
+
+def redirect_vicare(base_url: str) -> None:
+    """Send all requests of PyViCare, i.e. login and API calls, to `base_url` instead of the ViCare cloud.
+
+    Intended for a fake ViCare API (see `app.fake_vicare`) serving the same paths. PyViCare has no option for this, so
+    its module constants are replaced, which affects all PyViCare clients of the process.
+    """
+    base_url = base_url.rstrip("/")
+    PyViCare.PyViCareAbstractOAuthManager.API_BASE_URL = f"{base_url}/iot/v2"
+    PyViCare.PyViCareOAuthManager.AUTHORIZE_URL = f"{base_url}/idp/v3/authorize"
+    PyViCare.PyViCareOAuthManager.TOKEN_URL = f"{base_url}/idp/v3/token"
+
+
+class PooledViCareOAuthManager(ViCareOAuthManager):
+    """PyViCare OAuth manager mounting a `PooledHTTPAdapter` on every OAuth session, including renewed ones."""
+
+    def __init__(
+        self, username: str, password: str, client_id: str, token_file: str | None, adapter: HTTPAdapter
+    ) -> None:
+        self._adapter = adapter
+        super().__init__(username, password, client_id, token_file)
+        self._mount_adapter(self.oauth_session)
+
+    def replace_session(self, new_session: Session) -> None:
+        self._mount_adapter(new_session)
+        super().replace_session(new_session)
+
+    def save_token(self) -> bool:
+        """Persist the token of the current session to the token file (if any), returning whether it was persisted.
+
+        PyViCare persists new tokens only, this persists whatever the session holds (e.g. on shutdown), replacing the
+        token file atomically, so it is never left half-written.
+        """
+        token = self.oauth_session.token
+        if self.token_file is None or not token:
+            return False
+        temporary = f"{self.token_file}.tmp"
+        with open(temporary, mode="wb") as file:
+            pickle.dump(token, file)
+        os.replace(temporary, self.token_file)
+        return True
+
+    def _mount_adapter(self, session: Session) -> None:
+        logger.debug("Mounting pooled HTTP adapter on OAuth session")
+        session.mount("https://", self._adapter)
+        # only used if redirected to a fake ViCare API, see `redirect_vicare`
+        session.mount("http://", self._adapter)
@@ -0,0 +1,160 @@
+import enum
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, TypedDict
+
+from app.admission import AdmissionRejectedError
+
+logger = logging.getLogger(__name__)
+
+# queue wait times kept per priority class to report their distribution
+WAIT_SAMPLES = 256
+
+
+class Priority(enum.IntEnum):
+    """Priority classes of upstream work, the lower the more urgent."""
+
+    COMMAND = 0
+    INTERACTIVE = 1
+    BACKGROUND = 2
+    PREFETCH = 3
+
+
+class QueueMetrics(TypedDict):
+    queue_size: int
+    queued: int
+    executed: int
+    rejected: int
+    cancelled: int
+    # of the last `WAIT_SAMPLES` executed work items, in milliseconds
+    wait_avg_ms: float
+    wait_p95_ms: float
+    wait_max_ms: float
+
+
+@dataclass
+class _WorkItem:
+    future: Future
+    fn: Callable[..., Any]
+    args: tuple
+    enqueued_at: float
+
+
+@dataclass
+class _Queue:
+    items: deque[_WorkItem] = field(default_factory=deque)
+    waits: deque[float] = field(default_factory=lambda: deque(maxlen=WAIT_SAMPLES))
+    executed: int = 0
+    rejected: int = 0
+    cancelled: int = 0
+
+
+class UpstreamExecutor:
+    """Executes all upstream work (e.g. ViCare API calls) on `workers` threads, the most urgent first.
+
+    Work is queued per `Priority` class in a queue bounded to `queue_size` items, work beyond is rejected with an
+    `AdmissionRejectedError`. Within a class, work is executed in order of submission. Across classes, the head of the
+    class with the lowest priority value is executed next, where waiting lowers it by one per `aging` seconds, so e.g.
+    a prefetch waiting for `3 * aging` seconds is on par with a fresh command and lower priority work cannot starve.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int,
+        aging: float,
+        retry_after: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._workers = workers
+        self._queue_size = queue_size
+        self._aging = aging
+        self._retry_after = retry_after
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._queues = {priority: _Queue() for priority in Priority}
+        self._threads: list[threading.Thread] = []
+
+    def submit(self, priority: Priority, fn: Callable[..., Any], *args: Any) -> Future:
+        """Queue `fn(*args)` with `priority`, returning a future of its result."""
+        queue = self._queues[priority]
+        with self._condition:
+            if len(queue.items) >= self._queue_size:
+                queue.rejected += 1
+                logger.warning("Rejecting %s upstream work as %d are queued", priority.name.lower(), len(queue.items))
+                raise AdmissionRejectedError(f"ViCare API ({priority.name.lower()} queue)", self._retry_after)
+
+            future: Future = Future()
+            queue.items.append(_WorkItem(future, fn, args, self._clock()))
+            if len(self._threads) < self._workers:
+                self._start_worker()
+            self._condition.notify()
+        return future
+
+    def cancel(self, priorities: Iterable[Priority]) -> int:
+        """Cancel all queued work of `priorities`, e.g. on shutdown, returning the number of cancelled work items."""
+        cancelled = 0
+        with self._condition:
+            for priority in priorities:
+                queue = self._queues[priority]
+                for item in queue.items:
+                    item.future.cancel()
+                queue.cancelled += len(queue.items)
+                cancelled += len(queue.items)
+                queue.items.clear()
+        return cancelled
+
+    def _start_worker(self) -> None:
+        # daemon threads, as queued work is cancelled or flushed by the shutdown sequence anyway
+        thread = threading.Thread(target=self._work, name=f"vicare-upstream-{len(self._threads)}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _next(self) -> tuple[_WorkItem, _Queue]:
+        """Wait for and dequeue the most urgent work item. Must be called holding the condition."""
+        while True:
+            now = self._clock()
+            candidates = [
+                (priority - (now - queue.items[0].enqueued_at) / self._aging, priority, queue)
+                for priority, queue in self._queues.items()
+                if queue.items
+            ]
+            if candidates:
+                _, _, queue = min(candidates, key=lambda candidate: candidate[:2])
+                return queue.items.popleft(), queue
+            self._condition.wait()
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                item, queue = self._next()
+                queue.waits.append(self._clock() - item.enqueued_at)
+                queue.executed += 1
+            if not item.future.set_running_or_notify_cancel():
+                continue
+            try:
+                item.future.set_result(item.fn(*item.args))
+            except BaseException as e:  # noqa: BLE001 - re-raised to the caller of the future, like ThreadPoolExecutor
+                item.future.set_exception(e)
+
+    def get_metrics(self) -> dict[str, QueueMetrics]:
+        with self._condition:
+            return {priority.name.lower(): self._get_queue_metrics(queue) for priority, queue in self._queues.items()}
+
+    def _get_queue_metrics(self, queue: _Queue) -> QueueMetrics:
+        waits = sorted(queue.waits)
+        return QueueMetrics(
+            queue_size=self._queue_size,
+            queued=len(queue.items),
+            executed=queue.executed,
+            rejected=queue.rejected,
+            cancelled=queue.cancelled,
+            wait_avg_ms=round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            wait_p95_ms=round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            wait_max_ms=round(waits[-1] * 1000, 1) if waits else 0.0,
+        )
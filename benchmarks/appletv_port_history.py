@@ -0,0 +1,86 @@
+"""Benchmark the connection attempts to find the Companion port of an Apple TV after restarts, with and without history.
+
+Each restart of the Apple TV picks its port from a simulated distribution: mostly one of a few recurring ports, else
+any port of the range. Each restart of the server, one per restart of the Apple TV, scans for it with a fresh
+`AppleTvConnectionManager`, either starting without history (scanning the range upward) or restoring the port history
+persisted by the previous one. Every failed attempt costs up to `CONNECTION_TRYING_TIMEOUT`. Run with
+`uv run python -m benchmarks.appletv_port_history`.
+"""
+
+import asyncio
+import random
+from ipaddress import IPv4Address
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from pyatv.const import Protocol
+
+from app.appletv import (
+    CONNECTION_TRYING_TIMEOUT,
+    PORT_END,
+    PORT_START,
+    AppleTvConnectionManager,
+)
+from app.settings import AppleTvDevice
+
+RESTARTS = 500
+SEED = 42
+# probability of the recurring ports, any port of the range is picked otherwise
+RECURRING_PORTS = {PORT_START + 31: 0.5, PORT_START + 17: 0.25, PORT_START + 44: 0.1}
+DAY = 24 * 3600.0
+
+device = AppleTvDevice(
+    host=IPv4Address("192.168.1.100"), companion_identifier="id42", companion_credentials="credentials"
+)
+
+
+def pick_port(rng: random.Random) -> int:
+    draw = rng.random()
+    for port, probability in RECURRING_PORTS.items():
+        if draw < probability:
+            return port
+        draw -= probability
+    return rng.randint(PORT_START, PORT_END)
+
+
+async def simulate(with_history: bool) -> list[int]:
+    """Simulate `RESTARTS` restarts a day apart, returning the connection attempts to find the port after each."""
+    rng = random.Random(SEED)
+    now = 0.0
+    histories: dict = {}
+    attempts = []
+    for _ in range(RESTARTS):
+        port = pick_port(rng)
+        manager = AppleTvConnectionManager(
+            {"default": device}, scan_cooldown=60.0, backoff=1.0, max_backoff=60.0, clock=lambda now=now: now
+        )
+        if with_history:
+            manager.restore_port_histories(histories)
+
+        def _connect(config, _loop, port=port):
+            service = next(s for s in config.services if s.protocol == Protocol.Companion)
+            return MagicMock() if service.port == port else None
+
+        with patch("app.appletv.connect", new_callable=AsyncMock, side_effect=_connect) as connect:
+            assert await manager.try_connect("default")
+        attempts.append(connect.call_count)
+        histories = manager.get_port_histories()
+        now += DAY
+    return attempts
+
+
+def main() -> None:
+    print(f"{RESTARTS} restarts, recurring ports {RECURRING_PORTS}, any port of {PORT_START}-{PORT_END} otherwise")
+    results = {}
+    for with_history in (False, True):
+        attempts = sorted(asyncio.run(simulate(with_history)))
+        mean = sum(attempts) / len(attempts)
+        p95 = attempts[int(len(attempts) * 0.95)]
+        results[with_history] = mean
+        print(f"{'with' if with_history else 'without'} history:")
+        print(f"  attempts mean / p95:           {mean:8.2f} / {p95}")
+        print(f"  time to connect, worst case:   {(mean - 1) * CONNECTION_TRYING_TIMEOUT:8.2f} s")
+    print(f"attempts saved by history:       {1 - results[True] / results[False]:8.0%}")
+
+
+if __name__ == "__main__":
+    main()
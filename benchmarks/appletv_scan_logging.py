@@ -0,0 +1,127 @@
+"""Benchmark the event loop time spent logging during a full Apple TV port scan at DEBUG level.
+
+Every port of the scan range fails immediately, so the measured time is dominated by the scan's own work and the
+logging it does on the event loop. Compares a synchronous `StreamHandler` (as configured by `log-config.json`) against
+the `QueueHandler` of `log-config-json.json`, writing to a local file as well as to a stream blocking for
+`BLOCKING_WRITE_LATENCY` per write, like stdout of a container whose log driver applies back pressure. Run with
+`uv run python -m benchmarks.appletv_scan_logging`.
+"""
+
+import asyncio
+import logging
+import tempfile
+import time
+from collections.abc import Callable
+from ipaddress import IPv4Address
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from unittest.mock import AsyncMock, patch
+
+from app.appletv import PORT_END, PORT_START, AppleTvConnectionManager
+from app.settings import AppleTvDevice
+from app.structured_logging import JsonFormatter, RequestContextFilter
+
+ROUNDS = 20
+BLOCKING_WRITE_LATENCY = 0.0002
+
+
+class BlockingStream:
+    """File stream blocking for `BLOCKING_WRITE_LATENCY` per write."""
+
+    def __init__(self, filename: str) -> None:
+        self._file = open(filename, "w", encoding="utf-8")
+
+    def write(self, text: str) -> int:
+        time.sleep(BLOCKING_WRITE_LATENCY)
+        return self._file.write(text)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+device = AppleTvDevice(
+    host=IPv4Address("192.168.1.100"), companion_identifier="id42", companion_credentials="credentials"
+)
+
+
+async def scan() -> float:
+    # a new manager, i.e. without cached port or cooldown
+    manager = AppleTvConnectionManager({"default": device}, scan_cooldown=60.0, backoff=1.0, max_backoff=60.0)
+    started = time.perf_counter()
+    await manager.try_connect("default")
+    return time.perf_counter() - started
+
+
+Configure = Callable[[logging.Logger, logging.StreamHandler], Callable[[], None]]
+
+
+def measure(configure: Configure, blocking: bool = False) -> float:
+    """Measure the mean duration of a full scan with logging configured by `configure` (returning its teardown)."""
+    logger = logging.getLogger("app.appletv")
+    with tempfile.NamedTemporaryFile("w", suffix=".log") as f:
+        stream_handler = logging.StreamHandler(
+            BlockingStream(f.name) if blocking else open(f.name, "w", encoding="utf-8")
+        )
+        teardown = configure(logger, stream_handler)
+        try:
+            with patch("app.appletv.connect", AsyncMock(side_effect=OSError("Connection refused"))):
+                durations = [asyncio.run(scan()) for _ in range(ROUNDS)]
+        finally:
+            teardown()
+            stream_handler.close()
+            stream_handler.stream.close()
+    return sum(durations) / len(durations)
+
+
+def configure_sync(logger: logging.Logger, stream_handler: logging.StreamHandler) -> Callable[[], None]:
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s"))
+    logger.addHandler(stream_handler)
+    logger.setLevel(logging.DEBUG)
+    return lambda: logger.removeHandler(stream_handler)
+
+
+def configure_queued(logger: logging.Logger, stream_handler: logging.StreamHandler) -> Callable[[], None]:
+    stream_handler.setFormatter(JsonFormatter())
+    queue: SimpleQueue = SimpleQueue()
+    handler = QueueHandler(queue)
+    handler.addFilter(RequestContextFilter())
+    listener = QueueListener(queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    def teardown() -> None:
+        logger.removeHandler(handler)
+        listener.stop()
+
+    return teardown
+
+
+def configure_info(logger: logging.Logger, stream_handler: logging.StreamHandler) -> Callable[[], None]:
+    logger.addHandler(stream_handler)
+    logger.setLevel(logging.INFO)
+    return lambda: logger.removeHandler(stream_handler)
+
+
+def main() -> None:
+    logger = logging.getLogger("app.appletv")
+    logger.propagate = False
+    ports = PORT_END - PORT_START + 1
+
+    print(f"full scan of {ports} ports failing immediately, {ROUNDS} rounds each, event loop time per scan")
+    print(f"INFO level:                    {measure(configure_info) * 1e3:8.2f} ms")
+    for blocking in (False, True):
+        sink = f"stream blocking {BLOCKING_WRITE_LATENCY * 1e6:.0f} µs per write" if blocking else "local file"
+        synchronous = measure(configure_sync, blocking)
+        queued = measure(configure_queued, blocking)
+        print(f"DEBUG to {sink}:")
+        print(f"  synchronous:                 {synchronous * 1e3:8.2f} ms")
+        print(f"  queued:                      {queued * 1e3:8.2f} ms")
+        print(f"  saved by queueing:           {(synchronous - queued) * 1e3:8.2f} ms ({1 - queued / synchronous:.0%})")
+
+
+if __name__ == "__main__":
+    main()
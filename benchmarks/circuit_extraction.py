@@ -0,0 +1,62 @@
+"""Benchmark building the `/heating/circuit` payload from the recorded heatpump features.
+
+Compares the former per-getter extraction, where every getter searches PyViCare's feature list, against the single pass
+over the features of the circuit in the device's snapshot. Run with `uv run python -m benchmarks.circuit_extraction`.
+"""
+
+import timeit
+from unittest.mock import patch
+
+from app.api.circuit import get_circuit
+from app.features import get_snapshot
+from tests.recorded_devices import recorded_device_config
+
+ROUNDS = 2000
+
+
+def get_circuit_via_getters(circuit) -> dict:
+    """Former implementation of `app.api.circuit.get_circuit`, reduced to the PyViCare calls it made."""
+    no = circuit.circuit
+    program = circuit.getActiveProgram()
+    programs = {
+        program: circuit.getProperty(f"heating.circuits.{no}.operating.programs.{program}")["properties"]
+        for program in circuit.getPrograms()
+    }
+    return {
+        "active": circuit.getActive(),
+        "frostProtectionActive": circuit.getFrostProtectionActive(),
+        "heatingCurve": (circuit.getHeatingCurveShift(), circuit.getHeatingCurveSlope()),
+        "mode": circuit.getActiveMode(),
+        "name": circuit.getName(),
+        "pumpActive": circuit.getCirculationPumpActive(),
+        "programs": (program, programs),
+        "temperature": (
+            circuit.getTemperatureLevelsMin(),
+            circuit.getTemperatureLevelsMax(),
+            circuit.getSupplyTemperature(),
+            circuit.getProperty(f"heating.circuits.{no}.temperature")["properties"]["value"]["value"],
+            circuit.getTargetSupplyTemperature(),
+        ),
+    }
+
+
+def main() -> None:
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    circuit = device.asHeatPump().circuits[0]
+    features = len(get_snapshot(device))
+
+    with patch.object(device.service, "getProperty", wraps=device.service.getProperty) as get_property:
+        get_circuit_via_getters(circuit)
+        lookups = get_property.call_count
+
+    getters = timeit.timeit(lambda: get_circuit_via_getters(circuit), number=ROUNDS) / ROUNDS
+    snapshot = timeit.timeit(lambda: get_circuit(circuit), number=ROUNDS) / ROUNDS
+
+    print(f"{features} recorded features, {len(circuit.getPrograms())} programs, {ROUNDS} rounds each")
+    print(f"getters:  {getters * 1e6:8.1f} µs per payload ({lookups} feature list searches)")
+    print(f"snapshot: {snapshot * 1e6:8.1f} µs per payload (1 pass over the features of the circuit)")
+    print(f"speedup:  {getters / snapshot:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark the memory the server holds per device with PyViCare's cache, keeping either raw payloads or snapshots.
+
+PyViCare's cache holds the current features payload of every device in any case. On top of it, the server keeps
+either the previous generation of each payload as is (`raw`, e.g. to diff against it), or the current and the
+previous `DeviceSnapshot` of each device (`snapshot`) without referencing any payload. The recorded features payload is
+parsed once per device and generation, like PyViCare receives it. Every variant runs in a fresh interpreter, as freed
+memory is not necessarily returned to the OS, and reports the resident set size of the whole process and its growth.
+Run with `uv run python -m benchmarks.snapshot_memory`.
+"""
+
+import argparse
+import gc
+import json
+import resource
+import subprocess
+import sys
+from pathlib import Path
+
+from tests.recorded_devices import RESOURCES
+
+ROOT = Path(__file__).parent.parent
+PAYLOAD = RESOURCES / "heatpump_features.json"
+VARIANTS = ["raw", "snapshot"]
+DEVICES = 50
+
+
+def _rss() -> int:
+    """Get the resident set size of this process in bytes, its peak if the current one is unavailable (non-Linux)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(variant: str, devices: int) -> dict:
+    """Measure holding the features of `devices` devices as `variant`, in this process."""
+    from app.features import DeviceSnapshot
+
+    text = PAYLOAD.read_text()
+    gc.collect()
+    baseline = _rss()
+
+    # the payloads of PyViCare's cache, and what the server keeps on top of them
+    cache, held = [], []
+    for _ in range(devices):
+        previous, current = json.loads(text), json.loads(text)
+        cache.append(current)
+        if variant == "raw":
+            held.append(previous)
+        else:
+            held.append((DeviceSnapshot.from_payload(previous), DeviceSnapshot.from_payload(current)))
+        del previous, current
+    gc.collect()
+
+    rss = _rss()
+    return {"variant": variant, "devices": devices, "rss": rss, "growth": rss - baseline}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=DEVICES, help="devices held (default: %(default)s)")
+    parser.add_argument("--variant", choices=VARIANTS, help="measure a single variant in this process")
+    args = parser.parse_args()
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.devices)))
+        return
+
+    results = {}
+    for variant in VARIANTS:
+        command = [
+            sys.executable,
+            "-m",
+            "benchmarks.snapshot_memory",
+            "--variant",
+            variant,
+            f"--devices={args.devices}",
+        ]
+        output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        results[variant] = json.loads(output)
+
+    print(f"{args.devices} devices with payloads of {PAYLOAD.name} cached")
+    for variant, result in results.items():
+        print(
+            f"{variant:8}: {result['rss'] / 1024:8.0f} KiB RSS, {result['growth'] / 1024:8.0f} KiB growth, "
+            f"{result['growth'] / args.devices / 1024:6.1f} KiB per device"
+        )
+    raw, snapshot = results["raw"]["growth"], results["snapshot"]["growth"]
+    print(f"saved   : {1 - snapshot / raw:8.1%} of the growth")
+
+
+if __name__ == "__main__":
+    main()
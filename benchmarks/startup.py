@@ -0,0 +1,113 @@
+"""Report the cold start of the server: import time per module and time to the first successful `/health` request.
+
+Every measurement runs in a fresh interpreter (with the ViCare client mocked), as imports are cached per process. Run
+with `uv run python -m benchmarks.startup`.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# imported before measuring, as only needed to issue the request
+SNIPPET = """
+import json, sys, time
+from unittest.mock import MagicMock
+from fastapi.testclient import TestClient
+
+started = time.perf_counter()
+import app.main
+from app.dependencies import get_vicare
+imported = time.perf_counter()
+
+vicare = MagicMock(installations=[], **{"oauth_manager.oauth_session.trust_env": False})
+app.main.app.dependency_overrides[get_vicare] = lambda: vicare
+response = TestClient(app.main.app).get("/health")
+responded = time.perf_counter()
+
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (responded - started) * 1000,
+    "status_code": response.status_code,
+    "pyatv_imported": "pyatv" in sys.modules,
+}))
+"""
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass
+class StartupReport:
+    import_ms: float
+    first_request_ms: float
+    status_code: int
+    pyatv_imported: bool
+    # cumulative import time in ms of the modules imported by `app.main` and its own modules
+    modules: dict[str, float]
+
+
+def measure_startup(appletv_enabled: bool = True) -> StartupReport:
+    env = {
+        **os.environ,
+        "CLIENT_ID": "client",
+        "EMAIL": "mail@example.com",
+        "PASSWORD": "password",
+        "APPLETV_ENABLED": str(appletv_enabled).lower(),
+        "APPLETV_HOST": "192.168.1.100",
+        "APPLETV_COMPANION_IDENTIFIER": "id",
+        "APPLETV_COMPANION_CREDENTIALS": "credentials",
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SNIPPET],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    measured = json.loads(result.stdout.splitlines()[-1])
+    return StartupReport(**measured, modules=_parse_import_times(result.stderr))
+
+
+def _parse_import_times(output: str) -> dict[str, float]:
+    """Parse cumulative import times of `app` modules and the modules they import directly from `-X importtime`."""
+    modules = {}
+    # modules are listed after their nested imports, which are indented deeper, so parents come first in reverse
+    parents: list[tuple[int, str]] = []
+    for text in reversed(output.splitlines()):
+        match = _IMPORT_TIME.match(text)
+        if match is None:
+            continue
+        indent, name = len(match.group(3)), match.group(4)
+        while parents and parents[-1][0] >= indent:
+            parents.pop()
+        parent = parents[-1][1] if parents else ""
+        if _is_app_module(name) or _is_app_module(parent):
+            modules[name] = int(match.group(2)) / 1000
+        parents.append((indent, name))
+    return modules
+
+
+def _is_app_module(name: str) -> bool:
+    return name == "app" or name.startswith("app.")
+
+
+def main() -> None:
+    for appletv_enabled in (True, False):
+        report = measure_startup(appletv_enabled)
+        print(f"Apple TV integration {'enabled' if appletv_enabled else 'disabled'}:")
+        print(f"  import of app.main:        {report.import_ms:8.1f} ms")
+        print(f"  first successful /health:  {report.first_request_ms:8.1f} ms (status {report.status_code})")
+        print(f"  pyatv imported:            {report.pyatv_imported}")
+    print("slowest imports (cumulative):")
+    for name, ms in sorted(report.modules.items(), key=lambda m: m[1], reverse=True)[:15]:
+        print(f"  {name:40} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,10 @@ from pyatv.const import PowerState
 from starlette import status
 
 from app.api.appletv import ROUTE_PREFIX_APPLETV
-from app.dependencies import PORT_START, get_appletv_connection
+from app.appletv import PORT_START, AppleTvState
+from app.dependencies import get_appletv_state
 from app.main import app
+from app.settings import AppleTvDevice
 
 client = TestClient(app)
 
@@ -22,6 +24,7 @@ def test_appletv_active(dependency_mocker):
         assert data["active"] == 1
         assert data["atv"]["port"] == PORT_START + 1
         assert data["atv"]["status"] == "connected"
+        assert data["atv"]["name"] == "default"
     finally:
         app.dependency_overrides.clear()
 
@@ -43,10 +46,75 @@ def test_appletv_inactive(dependency_mocker):
 
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
 def test_appletv_unavailable(dependency_mocker):
-    app.dependency_overrides[get_appletv_connection] = lambda: None
+    app.dependency_overrides[get_appletv_state] = lambda: AppleTvState(
+        dependency_mocker.settings.appletv_host, None, "connecting", None
+    )
 
     try:
         response = client.get(ROUTE_PREFIX_APPLETV)
         assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
     finally:
         app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_appletv_reconnecting_responds_last_known_state(dependency_mocker):
+    app.dependency_overrides[get_appletv_state] = lambda: AppleTvState(
+        dependency_mocker.settings.appletv_host, PORT_START + 1, "reconnecting", PowerState.On
+    )
+
+    try:
+        response = client.get(ROUTE_PREFIX_APPLETV)
+        assert response.status_code == 200
+        assert response.json()["active"] == 1
+        assert response.json()["atv"]["status"] == "reconnecting"
+        assert response.json()["atv"]["port"] == PORT_START + 1
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("dependency_mocker", [(app, {"appletv_enabled": False})], indirect=True)
+def test_appletv_disabled(dependency_mocker):
+    try:
+        response = client.get(ROUTE_PREFIX_APPLETV)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert response.json() == {"detail": "Apple TV integration is disabled."}
+    finally:
+        app.dependency_overrides.clear()
+
+
+BEDROOM = AppleTvDevice(host="192.168.1.101", companion_identifier="id43", companion_credentials="credentials")
+
+
+@pytest.mark.parametrize("dependency_mocker", [(app, {"appletv_devices": (("bedroom", BEDROOM),)})], indirect=True)
+def test_appletv_by_name(dependency_mocker):
+    dependency_mocker.appletv_connection.power.power_state = PowerState.On
+
+    try:
+        response = client.get(f"{ROUTE_PREFIX_APPLETV}/bedroom")
+        assert response.status_code == 200
+        assert response.json()["atv"]["name"] == "bedroom"
+        assert response.json()["active"] == 1
+        assert client.get(f"{ROUTE_PREFIX_APPLETV}/default").json()["atv"]["name"] == "default"
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("dependency_mocker", [(app, {"appletv_devices": (("bedroom", BEDROOM),)})], indirect=True)
+def test_appletv_must_be_addressed_by_name_if_multiple(dependency_mocker):
+    try:
+        response = client.get(ROUTE_PREFIX_APPLETV)
+        assert response.status_code == 422
+        assert "/appletv/{name}" in response.json()["detail"]
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_appletv_unknown(dependency_mocker):
+    try:
+        response = client.get(f"{ROUTE_PREFIX_APPLETV}/kitchen")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert response.json() == {"detail": "No Apple TV kitchen configured."}
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,45 @@
+import copy
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette import status
+
+from app.api.changes import ROUTE_PREFIX_CHANGES
+from app.api.heatpump import ROUTE_PREFIX_HEATING_HEATPUMP
+from app.main import app
+from tests.recorded_devices import load_resource, recorded_device_config
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_changes_should_serve_changes_detected_by_refreshes(dependency_mocker):
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
+    client.get(ROUTE_PREFIX_HEATING_HEATPUMP)
+    since = datetime.now().isoformat()
+
+    changed = copy.deepcopy(load_resource("heatpump_features.json"))
+    compressor = next(f for f in changed["data"] if f["feature"] == "heating.compressors.0")
+    compressor["properties"]["active"]["value"] = True
+    device.service.oauth_manager.get = lambda _url: changed
+    device.service.clear_cache()
+    client.get(ROUTE_PREFIX_HEATING_HEATPUMP)
+
+    response = client.get(ROUTE_PREFIX_CHANGES, params={"since": since, "device": "7633107093013212.0"})
+
+    assert response.status_code == status.HTTP_200_OK
+    changes = response.json()
+    assert len(changes) == 1
+    assert changes[0]["path"] == "heating.compressors.0.active"
+    assert changes[0]["old"] is False
+    assert changes[0]["new"] is True
+    assert changes[0]["featureTimestamp"] == compressor["timestamp"]
+    assert changes[0]["timestamp"] > since
+
+
+def test_changes_should_validate_since():
+    response = client.get(ROUTE_PREFIX_CHANGES, params={"since": "yesterday"})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
@@ -1,5 +1,5 @@
 from typing import Any
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import pytest
 from fastapi.testclient import TestClient
@@ -12,69 +12,30 @@ from app.api.circuit import (
 )
 from app.api.types import HeatingCommand
 from app.main import app
+from tests.recorded_devices import (
+    load_resource,
+    payload_device_config,
+    recorded_device_config,
+)
 
 client = TestClient(app)
 
 
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
 def test_heatpump_circuit_get_should_return_current_state(dependency_mocker):
-    property_map = {
-        "heating.circuits.1.temperature": {"properties": {"value": {"value": 30}}},
-        f"heating.circuits.1.operating.programs.{HeatingCircuitProgram.Comfort.value}": {
-            "properties": {
-                "active": {"value": False},
-                "demand": {"value": "unknown"},
-            }
-        },
-        f"heating.circuits.1.operating.programs.{HeatingCircuitProgram.Normal.value}": {
-            "properties": {
-                "active": {"value": True},
-                "demand": {"value": "unknown"},
-                "temperature": {"value": 22, "unit": "celsius"},
-            }
-        },
-        f"heating.circuits.1.operating.programs.{HeatingCircuitProgram.Reduced.value}": {
-            "properties": {
-                "active": {"value": False},
-                "temperature": {"value": 18, "unit": "celsius"},
-            }
-        },
-    }
-    configure_mocked_circuit(
-        dependency_mocker,
-        Mock(
-            getActive=lambda: True,
-            getActiveMode=lambda: HeatingCircuitMode.DhwAndHeating.value,
-            getFrostProtectionActive=lambda: False,
-            getHeatingCurveShift=lambda: -1,
-            getHeatingCurveSlope=lambda: 0.4,
-            getName=lambda: "Heizkreis",
-            getCirculationPumpActive=lambda: True,
-            getActiveProgram=lambda: HeatingCircuitProgram.Normal.value,
-            getTemperatureLevelsMin=lambda: 10,
-            getTemperatureLevelsMax=lambda: 40,
-            getSupplyTemperature=lambda: 27.4,
-            getTargetSupplyTemperature=lambda: 29.2,
-            getPrograms=lambda: [
-                HeatingCircuitProgram.Comfort.value,
-                HeatingCircuitProgram.Normal.value,
-                HeatingCircuitProgram.Reduced.value,
-            ],
-            circuit=1,
-            getProperty=lambda p: property_map[p],
-        ),
-    )
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
 
     response = client.get(ROUTE_PREFIX_HEATING_CIRCUIT)
 
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {
         "active": 1,
-        "circuitNo": 1,
+        "circuitNo": "0",
         "frostProtectionActive": 0,
         "heatingCurve": {
-            "shift": -1,
-            "slope": 0.4,
+            "shift": 0,
+            "slope": 0.6,
         },
         "mode": HeatingCircuitMode.DhwAndHeating.value,
         "modeNo": 2,
@@ -83,40 +44,55 @@ def test_heatpump_circuit_get_should_return_current_state(dependency_mocker):
         "programs": {
             "active": HeatingCircuitProgram.Normal.value,
             "activeNo": 3,
-            "comfort": {
-                "active": 0,
-                "demand": "unknown",
-                "temperature": "n/a",
-            },
-            "normal": {
-                "active": 1,
-                "demand": "unknown",
-                "temperature": 22,
-            },
-            "reduced": {
-                "active": 0,
-                "demand": "n/a",
-                "temperature": 18,
-            },
+            "comfort": {"active": 0, "demand": "unknown", "temperature": 23},
+            "eco": {"active": 0, "demand": "n/a", "temperature": 21},
+            "fixed": {"active": 0, "demand": "n/a", "temperature": "n/a"},
+            "normal": {"active": 1, "demand": "unknown", "temperature": 21},
+            "reduced": {"active": 0, "demand": "unknown", "temperature": 18},
+            "standby": {"active": 0, "demand": "n/a", "temperature": "n/a"},
+            "summerEco": {"active": 0, "demand": "n/a", "temperature": "n/a"},
         },
         "temperature": {
             "levels": {
-                "min": 10,
-                "max": 40,
+                "min": 15,
+                "max": 45,
             },
-            "supply": 27.4,
-            "target": 30,
-            "targetCalc": 29.2,
+            "supply": 30.8,
+            "target": 32.1,
+            "targetCalc": device.asHeatPump().circuits[0].getTargetSupplyTemperature(),
         },
     }
 
 
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_heatpump_circuit_get_should_only_read_cached_features_once(dependency_mocker):
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
+
+    with patch.object(device.service, "getProperty", wraps=device.service.getProperty) as get_property:
+        response = client.get(ROUTE_PREFIX_HEATING_CIRCUIT)
+
+    assert response.status_code == status.HTTP_200_OK
+    # only selecting the circuit reads single features, building the payload does not
+    assert get_property.call_count == 1
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_heatpump_circuit_get_should_fail_for_missing_features(dependency_mocker):
+    circuit = configure_mocked_circuit(dependency_mocker, Mock(circuit=1))
+    circuit.device.service.fetch_all_features.return_value = {"data": []}
+
+    response = client.get(ROUTE_PREFIX_HEATING_CIRCUIT)
+
+    assert response.status_code == status.HTTP_405_METHOD_NOT_ALLOWED
+
+
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
 def test_heatpump_circuit_set_mode_should_forward_call_correctly(dependency_mocker):
     mode = HeatingCircuitMode.Dhw.value
     circuit = configure_mocked_circuit(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/mode/{mode}")
+    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/mode/{mode}", params={"wait": True})
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
     circuit.setMode.assert_called_once_with(mode)
@@ -148,7 +124,7 @@ def test_heatpump_circuit_set_program_should_handle_errors_correctly(
 ):
     circuit = configure_mocked_circuit(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program}", json=command)
+    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program}", json=command, params={"wait": True})
 
     assert response.status_code == expected
     circuit.assert_not_called()
@@ -192,7 +168,9 @@ def test_heatpump_circuit_set_program_should_forward_call_correctly(
 ):
     circuit = configure_mocked_circuit(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program.value}", json=command.value)
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program.value}", json=command.value, params={"wait": True}
+    )
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
@@ -227,7 +205,7 @@ def test_heatpump_circuit_set_program_temperature_should_handle_errors_correctly
 ):
     circuit = configure_mocked_circuit(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program}/{temperature}")
+    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program}/{temperature}", params={"wait": True})
 
     assert response.status_code == expected
     circuit.assert_not_called()
@@ -246,7 +224,9 @@ def test_heatpump_circuit_set_program_temperature_should_handle_errors_correctly
 def test_heatpump_circuit_set_program_temperature(dependency_mocker, program: HeatingCircuitProgram, temperature: int):
     circuit = configure_mocked_circuit(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program.value}/{temperature}")
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program.value}/{temperature}", params={"wait": True}
+    )
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
@@ -271,3 +251,188 @@ def assert_mock_calls(mock: Mock, expected_call_args: list[str]):
         assert mock.call_count == len(expected_call_args)
         for arg in expected_call_args:
             mock.assert_any_call(arg)
+
+
+@pytest.mark.parametrize(
+    "dependency_mocker, circuit_no, expected",
+    [
+        (app, 0, status.HTTP_204_NO_CONTENT),
+        (app, 1, status.HTTP_204_NO_CONTENT),
+        (app, 2, status.HTTP_404_NOT_FOUND),
+    ],
+    indirect=["dependency_mocker"],
+)
+def test_heatpump_circuit_should_address_circuit_by_number(dependency_mocker, circuit_no: int, expected: int):
+    circuits = [Mock(circuit=0), Mock(circuit=1)]
+    dependency_mocker.vicare.devices = [
+        Mock(service=Mock(roles=["type:heatpump"]), asHeatPump=lambda: Mock(circuits=circuits))
+    ]
+
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/{circuit_no}/mode/{HeatingCircuitMode.Dhw.value}", params={"wait": True}
+    )
+
+    assert response.status_code == expected
+    for circuit in circuits:
+        if circuit.circuit == circuit_no:
+            circuit.setMode.assert_called_once_with(HeatingCircuitMode.Dhw.value)
+        else:
+            circuit.setMode.assert_not_called()
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_heatpump_circuit_should_reject_multiple_circuits_without_number(dependency_mocker):
+    dependency_mocker.vicare.devices = [
+        Mock(service=Mock(roles=["type:heatpump"]), asHeatPump=lambda: Mock(circuits=[Mock(), Mock()]))
+    ]
+
+    response = client.put(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/mode/{HeatingCircuitMode.Dhw.value}", params={"wait": True})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+@pytest.mark.parametrize("path", ["/curve", "/0/curve"])
+def test_heatpump_circuit_curve_should_match_target_supply_temperature(dependency_mocker, path: str):
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
+    circuit = device.asHeatPump().circuits[0]
+    outside = device.asHeatPump().getOutsideTemperature()
+
+    response = client.get(f"{ROUTE_PREFIX_HEATING_CIRCUIT}{path}", params={"start": outside, "end": outside + 10})
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body["outside"] == [outside + i for i in range(11)]
+    assert body["curves"][0]["shift"] == circuit.getHeatingCurveShift()
+    assert body["curves"][0]["slope"] == circuit.getHeatingCurveSlope()
+    assert len(body["curves"][0]["supply"]) == 11
+    assert body["curves"][0]["supply"][0] == circuit.getTargetSupplyTemperature()
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_heatpump_circuit_curve_should_evaluate_candidate_curves(dependency_mocker):
+    dependency_mocker.vicare.devices = [recorded_device_config("heatpump_features.json", ["type:heatpump"])]
+
+    response = client.get(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/curve",
+        params={"shift": [5], "slope": [0.8, 1.2], "inside": 20, "start": -10, "end": 10, "step": 0.5},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body["inside"] == 20
+    assert len(body["outside"]) == 41
+    assert [(c["shift"], c["slope"]) for c in body["curves"]] == [(5, 0.8), (5, 1.2)]
+    # steeper curves require higher supply temperatures below the inside temperature
+    assert body["curves"][1]["supply"][-1] > body["curves"][0]["supply"][-1]
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"shift": [1, 2], "slope": [1, 2, 3]},
+        {"start": -60, "end": 60, "step": 0.1},
+        {"start": 10, "end": -10},
+        {"start": -20, "end": 20, "step": 0.001},
+        {"step": 0},
+    ],
+)
+def test_heatpump_circuit_curve_should_reject_invalid_requests(dependency_mocker, params: dict):
+    dependency_mocker.vicare.devices = [recorded_device_config("heatpump_features.json", ["type:heatpump"])]
+
+    response = client.get(f"{ROUTE_PREFIX_HEATING_CIRCUIT}/curve", params=params)
+
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+@pytest.mark.parametrize(
+    "temperature, expected", [(25, status.HTTP_204_NO_CONTENT), (26, status.HTTP_405_METHOD_NOT_ALLOWED)]
+)
+def test_heatpump_circuit_set_program_temperature_should_be_validated_against_device(
+    dependency_mocker, temperature: int, expected: int
+):
+    features = load_resource("heatpump_features.json")
+    comfort = next(f for f in features["data"] if f["feature"] == "heating.circuits.0.operating.programs.comfort")
+    comfort["commands"]["setTemperature"]["params"]["targetTemperature"]["constraints"]["max"] = 25
+    device = payload_device_config(features, ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
+
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{HeatingCircuitProgram.Comfort.value}/{temperature}",
+        params={"wait": True},
+    )
+
+    assert response.status_code == expected
+    # rejected locally, i.e. without calling the ViCare API
+    assert device.service.oauth_manager.post.call_count == (1 if expected == status.HTTP_204_NO_CONTENT else 0)
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+@pytest.mark.parametrize("force, expected", [(False, status.HTTP_200_OK), (True, status.HTTP_204_NO_CONTENT)])
+def test_heatpump_circuit_set_mode_should_skip_command_if_device_already_in_mode(
+    dependency_mocker, force: bool, expected: int
+):
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
+    client.get(ROUTE_PREFIX_HEATING_CIRCUIT)
+
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/mode/{HeatingCircuitMode.DhwAndHeating.value}",
+        params={"wait": True, "force": force},
+    )
+
+    assert response.status_code == expected
+    if not force:
+        assert response.json()["status"] == "skipped"
+    assert device.service.oauth_manager.post.call_count == (1 if force else 0)
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+@pytest.mark.parametrize(
+    "program, expected, posts",
+    [
+        # comfort and eco are both inactive, i.e. nothing to deactivate
+        (HeatingCircuitProgram.Default, status.HTTP_200_OK, 0),
+        (HeatingCircuitProgram.Eco, status.HTTP_204_NO_CONTENT, 1),
+    ],
+)
+def test_heatpump_circuit_set_program_should_only_send_commands_changing_programs(
+    dependency_mocker, program: HeatingCircuitProgram, expected: int, posts: int
+):
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
+    client.get(ROUTE_PREFIX_HEATING_CIRCUIT)
+
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{program.value}",
+        json=HeatingCommand.Activate.value,
+        params={"wait": True},
+    )
+
+    assert response.status_code == expected
+    assert device.service.oauth_manager.post.call_count == posts
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_heatpump_circuit_set_default_program_should_deactivate_program_with_pending_activation(dependency_mocker):
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"])
+    dependency_mocker.vicare.devices = [device]
+    client.get(ROUTE_PREFIX_HEATING_CIRCUIT)
+    client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{HeatingCircuitProgram.Comfort.value}",
+        json=HeatingCommand.Activate.value,
+    )
+
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_CIRCUIT}/program/{HeatingCircuitProgram.Default.value}",
+        json=HeatingCommand.Activate.value,
+        params={"wait": True},
+    )
+
+    # comfort is inactive as last fetched, but not once its pending activation is executed
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    urls = [c.args[0] for c in device.service.oauth_manager.post.call_args_list]
+    assert any("programs.comfort/commands/deactivate" in url for url in urls)
@@ -0,0 +1,118 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+from fastapi.testclient import TestClient
+from PyViCare.PyViCareUtils import PyViCareNotSupportedFeatureError
+from starlette import status
+
+from app.api.commands import ROUTE_PREFIX_COMMANDS
+from app.api.ventilation import ROUTE_PREFIX_VENTILATION
+from app.dependencies import get_rate_limiter
+from app.main import app
+from app.rate_limiting import RateLimiter
+
+client = TestClient(app)
+
+
+def configure_mocked_ventilation(dependency_mocker, **kwargs) -> Mock:
+    ventilation = Mock(accessor=Mock(serial="7633107093013212", device_id="0"), **kwargs)
+    dependency_mocker.vicare.devices = [
+        Mock(service=Mock(roles=["type:ventilation"]), asVentilation=lambda: ventilation)
+    ]
+    return ventilation
+
+
+def wait_for_command(command_id: str, timeout: float = 2.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        command = client.get(f"{ROUTE_PREFIX_COMMANDS}/{command_id}").json()
+        if command["status"] in ("succeeded", "failed") or time.monotonic() > deadline:
+            return command
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_command_should_be_accepted_and_executed_in_background(dependency_mocker):
+    ventilation = configure_mocked_ventilation(dependency_mocker)
+
+    response = client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/40")
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    accepted = response.json()
+    assert accepted["status"] == "pending"
+    assert accepted["command"] == "ventilation.mode.permanent"
+    assert accepted["device"] == "7633107093013212.0"
+    assert accepted["value"] == "levelTwo"
+
+    command = wait_for_command(accepted["commandId"])
+
+    assert command["status"] == "succeeded"
+    assert command["executedAt"] is not None
+    ventilation.setPermanentLevel.assert_called_once_with("levelTwo")
+
+
+# wide enough for all requests of the burst to arrive within, even on slow machines
+@pytest.mark.parametrize("dependency_mocker", [(app, {"command_debounce_window": 0.5})], indirect=True)
+def test_command_burst_should_be_coalesced_into_latest_value(dependency_mocker):
+    ventilation = configure_mocked_ventilation(dependency_mocker)
+
+    responses = [client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/{level}") for level in (10, 40, 60, 90)]
+
+    command_ids = {response.json()["commandId"] for response in responses}
+    assert len(command_ids) == 1
+    command = wait_for_command(command_ids.pop())
+    assert command["status"] == "succeeded"
+    assert command["coalesced"] == 3
+    assert command["value"] == "levelFour"
+    ventilation.setPermanentLevel.assert_called_once_with("levelFour")
+
+
+@pytest.mark.parametrize(
+    "dependency_mocker", [(app, {"command_debounce_window": 0.5, "rate_limit_enabled": True})], indirect=True
+)
+def test_command_burst_should_be_charged_a_single_upstream_call(dependency_mocker):
+    ventilation = configure_mocked_ventilation(dependency_mocker)
+    limiter = RateLimiter(rate=100, burst=100, upstream_rate=0.1, upstream_burst=5, max_clients=10)
+    app.dependency_overrides[get_rate_limiter] = lambda: limiter
+
+    try:
+        # e.g. dragging a slider, far more often than the upstream budget allows
+        responses = [client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/{level}") for level in range(0, 101, 5)]
+        command = wait_for_command(responses[-1].json()["commandId"])
+    finally:
+        del app.dependency_overrides[get_rate_limiter]
+
+    assert {response.status_code for response in responses} == {status.HTTP_202_ACCEPTED}
+    assert command["status"] == "succeeded"
+    ventilation.setPermanentLevel.assert_called_once_with("levelFour")
+    assert limiter.get_metrics()["top_clients"][0]["upstream_calls"] == 1
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_failed_command_should_report_error(dependency_mocker):
+    configure_mocked_ventilation(dependency_mocker, setPermanentLevel=Mock(side_effect=ValueError("boom")))
+
+    response = client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/40")
+
+    command = wait_for_command(response.json()["commandId"])
+    assert command["status"] == "failed"
+    assert command["error"] == "boom"
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_waited_for_command_should_propagate_errors_to_exception_handlers(dependency_mocker):
+    configure_mocked_ventilation(
+        dependency_mocker,
+        setPermanentLevel=Mock(side_effect=PyViCareNotSupportedFeatureError("ventilation.operating.modes.permanent")),
+    )
+
+    response = client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/40", params={"wait": True})
+
+    assert response.status_code == status.HTTP_405_METHOD_NOT_ALLOWED
+
+
+def test_unknown_command_should_return_404():
+    response = client.get(f"{ROUTE_PREFIX_COMMANDS}/unknown")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
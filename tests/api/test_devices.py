@@ -0,0 +1,88 @@
+import pytest
+from fastapi.testclient import TestClient
+from PyViCare.PyViCareDeviceConfig import PyViCareDeviceConfig
+from starlette import status
+
+from app.api.devices import ROUTE_PREFIX_DEVICES
+from app.api.dhw import ROUTE_PREFIX_HEATING_DHW
+from app.api.ventilation import ROUTE_PREFIX_VENTILATION
+from app.main import app
+from tests.recorded_devices import features_device_config
+
+client = TestClient(app)
+
+
+def mocked_ventilation_device(device_id: str, serial: str, mode: str) -> PyViCareDeviceConfig:
+    return features_device_config(
+        {"ventilation.operating.modes.active": {"properties": {"value": {"type": "string", "value": mode}}}},
+        ["type:ventilation"],
+        "test_device",
+        serial,
+        device_id,
+        device_type="ventilation",
+    )
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_devices_should_list_all_devices(dependency_mocker):
+    dependency_mocker.vicare.devices = [mocked_ventilation_device("0", "serial1", "permanent")]
+
+    response = client.get(ROUTE_PREFIX_DEVICES)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [
+        {
+            "deviceId": "0",
+            "deviceKey": "serial1.0",
+            "installationId": 1234567,
+            "gatewaySerial": "serial1",
+            "model": "test_device",
+            "roles": ["type:ventilation"],
+            "status": "Online",
+        }
+    ]
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_devices_single_route_should_reject_multiple_devices(dependency_mocker):
+    dependency_mocker.vicare.devices = [
+        mocked_ventilation_device("0", "serial1", "permanent"),
+        mocked_ventilation_device("0", "serial2", "sensorDriven"),
+    ]
+
+    response = client.get(f"{ROUTE_PREFIX_VENTILATION}/mode")
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    assert ROUTE_PREFIX_DEVICES in response.json()["detail"]
+
+
+@pytest.mark.parametrize(
+    "dependency_mocker, device_id, expected_status, expected_mode",
+    [
+        (app, "serial1.0", status.HTTP_200_OK, "permanent"),
+        (app, "serial2.0", status.HTTP_200_OK, "sensorDriven"),
+        (app, "0", status.HTTP_422_UNPROCESSABLE_CONTENT, None),
+        (app, "serial3.0", status.HTTP_404_NOT_FOUND, None),
+    ],
+    indirect=["dependency_mocker"],
+)
+def test_devices_should_address_device_by_id(dependency_mocker, device_id, expected_status, expected_mode):
+    dependency_mocker.vicare.devices = [
+        mocked_ventilation_device("0", "serial1", "permanent"),
+        mocked_ventilation_device("0", "serial2", "sensorDriven"),
+    ]
+
+    response = client.get(f"{ROUTE_PREFIX_DEVICES}/{device_id}{ROUTE_PREFIX_VENTILATION}/mode")
+
+    assert response.status_code == expected_status
+    if expected_mode is not None:
+        assert response.json() == expected_mode
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_devices_should_only_address_devices_of_matching_type(dependency_mocker):
+    dependency_mocker.vicare.devices = [mocked_ventilation_device("0", "serial1", "permanent")]
+
+    response = client.get(f"{ROUTE_PREFIX_DEVICES}/0{ROUTE_PREFIX_HEATING_DHW}")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -3,32 +3,69 @@ from unittest.mock import Mock
 
 import pytest
 from fastapi.testclient import TestClient
+from PyViCare.PyViCareUtils import VICARE_DAYS
 from starlette import status
 
 from app.api.dhw import ROUTE_PREFIX_HEATING_DHW, HeatingDomesticHotWaterLevel
 from app.api.types import HeatingCommand
 from app.main import app
+from tests.recorded_devices import features_device_config
 
 client = TestClient(app)
 
 
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
 def test_heating_dhw_get_should_return_current_status(dependency_mocker):
-    configure_mocked_heating(
-        dependency_mocker,
-        Mock(
-            getDomesticHotWaterChargingActive=lambda: False,
-            getDomesticHotWaterConfiguredTemperature=lambda: 40,
-            getDomesticHotWaterMaxTemperature=lambda: 60,
-            getDomesticHotWaterMinTemperature=lambda: 10,
-            getDomesticHotWaterConfiguredTemperature2=lambda: 45,
-            getOneTimeCharge=lambda: False,
-            getDomesticHotWaterCirculationPumpActive=lambda: True,
-            getDomesticHotWaterCirculationMode=lambda: "10/25-cycle",
-            getDomesticHotWaterActive=lambda: True,
-            getDomesticHotWaterStorageTemperature=lambda: 40.5,
-        ),
-    )
+    # scheduled all day, so the mode of the entry is the current one
+    entries = [{"start": "00:00", "end": "24:00", "mode": "10/25-cycle", "position": 0}]
+    dependency_mocker.vicare.devices = [
+        features_device_config(
+            {
+                "heating.dhw": {"properties": {"active": {"value": True}, "status": {"value": "on"}}},
+                "heating.dhw.charging": {"properties": {"active": {"value": False}}},
+                "heating.dhw.temperature.main": {
+                    "properties": {"value": {"value": 40, "unit": "celsius"}},
+                    "commands": {
+                        "setTargetTemperature": {
+                            "isExecutable": True,
+                            "params": {
+                                "temperature": {
+                                    "type": "number",
+                                    "required": True,
+                                    "constraints": {"min": 10, "max": 60, "stepping": 1},
+                                }
+                            },
+                        }
+                    },
+                },
+                "heating.dhw.temperature.temp2": {"properties": {"value": {"value": 45, "unit": "celsius"}}},
+                "heating.dhw.oneTimeCharge": {"properties": {"active": {"value": False}}},
+                "heating.dhw.pumps.circulation": {"properties": {"status": {"value": "on"}}},
+                "heating.dhw.pumps.circulation.schedule": {
+                    "properties": {
+                        "active": {"value": True},
+                        "entries": {"value": {day: entries for day in VICARE_DAYS}},
+                    },
+                    "commands": {
+                        "setSchedule": {
+                            "isExecutable": True,
+                            "params": {
+                                "newSchedule": {
+                                    "type": "Schedule",
+                                    "required": True,
+                                    "constraints": {"modes": ["5/25-cycles", "10/25-cycle"], "defaultMode": "off"},
+                                }
+                            },
+                        }
+                    },
+                },
+                "heating.dhw.sensors.temperature.dhwCylinder": {
+                    "properties": {"value": {"value": 40.5, "unit": "celsius"}}
+                },
+            },
+            ["type:heatpump"],
+        )
+    ]
 
     response = client.get(ROUTE_PREFIX_HEATING_DHW)
 
@@ -62,7 +99,7 @@ def test_heating_dhw_get_should_return_current_status(dependency_mocker):
 def test_heating_dhw_set_one_time_charge_should_handle_errors_correctly(dependency_mocker, command: str, expected: int):
     heating = configure_mocked_heating(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/onetimecharge", json=command)
+    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/onetimecharge", json=command, params={"wait": True})
 
     assert response.status_code == expected
     heating.assert_not_called()
@@ -74,7 +111,9 @@ def test_heating_dhw_set_one_time_charge_should_handle_errors_correctly(dependen
 def test_heating_dhw_one_time_change_should_forward_activation_call_correctly(dependency_mocker):
     heating = configure_mocked_heating(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/onetimecharge", json=HeatingCommand.Activate.value)
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_DHW}/onetimecharge", json=HeatingCommand.Activate.value, params={"wait": True}
+    )
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
     heating.assert_not_called()
@@ -86,7 +125,9 @@ def test_heating_dhw_one_time_change_should_forward_activation_call_correctly(de
 def test_heating_dhw_one_time_change_should_forward_deactivation_call_correctly(dependency_mocker):
     heating = configure_mocked_heating(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/onetimecharge", json=HeatingCommand.Deactivate.value)
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_DHW}/onetimecharge", json=HeatingCommand.Deactivate.value, params={"wait": True}
+    )
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
     heating.assert_not_called()
@@ -109,7 +150,7 @@ def test_heating_dhw_set_level_temperature_should_handle_errors_correctly(
 ):
     heating = configure_mocked_heating(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/level/{level}/{temperature}")
+    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/level/{level}/{temperature}", params={"wait": True})
 
     assert response.status_code == expected
     heating.assert_not_called()
@@ -121,7 +162,9 @@ def test_heating_dhw_set_level_temperature_should_handle_errors_correctly(
 def test_heating_dhw_set_level_main_temperature(dependency_mocker):
     heating = configure_mocked_heating(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/level/{HeatingDomesticHotWaterLevel.Main.value}/{30}")
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_DHW}/level/{HeatingDomesticHotWaterLevel.Main.value}/{30}", params={"wait": True}
+    )
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
@@ -134,7 +177,9 @@ def test_heating_dhw_set_level_main_temperature(dependency_mocker):
 def test_heating_dhw_set_level_temp2_temperature(dependency_mocker):
     heating = configure_mocked_heating(dependency_mocker, Mock())
 
-    response = client.put(f"{ROUTE_PREFIX_HEATING_DHW}/level/{HeatingDomesticHotWaterLevel.Temp2.value}/{20}")
+    response = client.put(
+        f"{ROUTE_PREFIX_HEATING_DHW}/level/{HeatingDomesticHotWaterLevel.Temp2.value}/{20}", params={"wait": True}
+    )
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
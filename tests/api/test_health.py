@@ -7,7 +7,13 @@ import pytest
 from fastapi.testclient import TestClient
 from starlette import status
 
+import app.api.health as health_api
 from app.api.health import FAILURE_EXPIRATION_SECONDS, ROUTE_PREFIX_HEALTH, HealthModel
+from app.dependencies import (
+    get_logged_in_vicare,
+    get_upstream_circuit_breaker,
+    get_upstream_pool_metrics,
+)
 from app.main import app
 from tests.conftest import record_requests
 
@@ -368,3 +374,170 @@ def test_health_endpoint_not_tracked(dependency_mocker, request_tracker):
     assert stats["overall"]["failure"] == 0
     assert stats["by_endpoint"] == {}
     assert stats["by_status_code"] == {}
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_health_includes_upstream_pool_metrics(dependency_mocker):
+    pool_metrics = get_upstream_pool_metrics()
+    pool_metrics.reset()
+    pool_metrics.set_size(4)
+    pool_metrics.record_request_started()
+    pool_metrics.record_new_connection()
+
+    response = client.get(ROUTE_PREFIX_HEALTH)
+
+    assert response.status_code == status.HTTP_200_OK
+    pool = HealthModel(**response.json()).upstream.pool
+    assert pool.size == 4
+    assert pool.in_use == 1
+    assert pool.waiting == 0
+    assert pool.new_connections == 1
+    assert pool.requests == 1
+    pool_metrics.reset()
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_health_reports_open_circuit_breaker(dependency_mocker, request_tracker):
+    record_requests(request_tracker, [("/heating/circuit", 200)])
+    breaker = get_upstream_circuit_breaker(settings=dependency_mocker.settings)
+    breaker.reset()
+    for _ in range(5):
+        breaker.record_failure()
+
+    response = client.get(ROUTE_PREFIX_HEALTH)
+
+    assert response.status_code == status.HTTP_200_OK
+    health = HealthModel(**response.json())
+    assert health.status_code == 9
+    assert health.upstream.breaker.state == "open"
+    assert health.upstream.breaker.error_rate == 1.0
+    assert health.upstream.breaker.calls == 5
+    assert 0 < health.upstream.breaker.retry_after <= 30
+    breaker.reset()
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_health_includes_admission_metrics(dependency_mocker):
+    response = client.get(ROUTE_PREFIX_HEALTH)
+
+    assert response.status_code == status.HTTP_200_OK
+    admission = HealthModel(**response.json()).admission
+    assert admission.keys() == {"vicare", "appletv/default"}
+    assert admission["vicare"].limit == 8
+    assert admission["vicare"].queue_size == 32
+    assert admission["appletv/default"].limit == 2
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_health_includes_rolling_request_stats(dependency_mocker, request_tracker):
+    record_requests(
+        request_tracker,
+        [("/test/endpoint", status.HTTP_200_OK), ("/test/endpoint", status.HTTP_500_INTERNAL_SERVER_ERROR, "Error")],
+    )
+
+    response = client.get(ROUTE_PREFIX_HEALTH)
+
+    rolling_stats = HealthModel(**response.json()).requests.rolling_stats
+    assert rolling_stats.keys() == {"1m", "5m", "1h", "24h"}
+    assert rolling_stats["1m"].overall.error_rate == 0.5
+    assert rolling_stats["24h"].by_endpoint["/test/endpoint"].requests == 2
+
+
+@pytest.mark.parametrize(
+    "dependency_mocker, failures, successes, expected_code",
+    [
+        ((app, {"health_error_rate_threshold": 0.5}), 6, 6, 7),
+        ((app, {"health_error_rate_threshold": 0.5}), 5, 6, 1),
+        # too few requests to be conclusive
+        ((app, {"health_error_rate_threshold": 0.1}), 1, 1, 1),
+    ],
+    indirect=["dependency_mocker"],
+)
+def test_health_status_code_by_error_rate_threshold(
+    dependency_mocker, failures, successes, expected_code, request_tracker
+):
+    dependency_mocker.vicare.oauth_manager.oauth_session.token.is_expired = Mock(return_value=False)
+    # the last request succeeded, which would report no error without a threshold
+    record_requests(
+        request_tracker,
+        [("/test/endpoint", status.HTTP_500_INTERNAL_SERVER_ERROR, "Error")] * failures
+        + [("/test/endpoint", status.HTTP_200_OK)] * successes,
+    )
+
+    response = client.get(ROUTE_PREFIX_HEALTH)
+
+    assert HealthModel(**response.json()).status_code == expected_code
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_live_probe_responds_without_dependencies(dependency_mocker):
+    dependency_mocker.vicare.oauth_manager.oauth_session.token = None
+
+    response = client.get(f"{ROUTE_PREFIX_HEALTH}/live")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"status": "UP"}
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_ready_probe_reports_up_once_logged_in(dependency_mocker):
+    get_upstream_circuit_breaker(settings=dependency_mocker.settings).reset()
+    dependency_mocker.vicare.oauth_manager.oauth_session.token.is_expired = Mock(return_value=True)
+
+    response = client.get(f"{ROUTE_PREFIX_HEALTH}/ready")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"status": "UP"}
+    # only reads the state kept anyway
+    assert dependency_mocker.vicare.installations.mock_calls == []
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_ready_probe_reports_down_with_reasons(dependency_mocker):
+    breaker = get_upstream_circuit_breaker(settings=dependency_mocker.settings)
+    breaker.reset()
+    for _ in range(5):
+        breaker.record_failure()
+    dependency_mocker.vicare.oauth_manager.oauth_session.token = None
+
+    response = client.get(f"{ROUTE_PREFIX_HEALTH}/ready")
+    app.dependency_overrides[get_logged_in_vicare] = lambda: None
+    warming_up = client.get(f"{ROUTE_PREFIX_HEALTH}/ready")
+    breaker.reset()
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json() == {
+        "status": "DOWN",
+        "reasons": ["invalid auth token", "circuit breaker of ViCare API open"],
+    }
+    assert warming_up.json()["reasons"][0] == "not logged in to ViCare API yet"
+
+
+@pytest.mark.parametrize("dependency_mocker", [[app, {"health_cache_ttl": 60.0}]], indirect=True)
+def test_health_report_is_cached_for_ttl(dependency_mocker, request_tracker):
+    record_requests(request_tracker, [("/heating/circuit", 200)])
+    first = client.get(ROUTE_PREFIX_HEALTH)
+    record_requests(request_tracker, [("/heating/circuit", 200)])
+
+    cached = client.get(ROUTE_PREFIX_HEALTH)
+    try:
+        with patch("app.api.health.time.monotonic", return_value=time.monotonic() + 60.0):
+            fresh = client.get(ROUTE_PREFIX_HEALTH)
+    finally:
+        # cached as of the patched time, i.e. in the future for the following tests
+        health_api._cached_report = None
+
+    assert cached.json() == first.json()
+    assert HealthModel(**cached.json()).requests.request_stats["overall"]["success"] == 1
+    assert HealthModel(**fresh.json()).requests.request_stats["overall"]["success"] == 2
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_health_includes_loop_metrics(dependency_mocker):
+    response = client.get(ROUTE_PREFIX_HEALTH)
+
+    assert response.status_code == status.HTTP_200_OK
+    loop = HealthModel(**response.json()).loop
+    # not started, as the tests don't run the lifespan
+    assert loop.blocked == 0
+    assert loop.threadpool_active == 0
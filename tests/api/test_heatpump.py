@@ -1,43 +1,42 @@
-from unittest.mock import Mock
-
 import pytest
 from fastapi.testclient import TestClient
+from starlette import status
 
 from app.api.heatpump import ROUTE_PREFIX_HEATING_HEATPUMP
 from app.main import app
+from tests.recorded_devices import features_device_config, recorded_device_config
 
 client = TestClient(app)
 
 
+def heatpump_features(compressors: dict[str, int]) -> dict[str, dict]:
+    """The features of a heat pump with `compressors`, given as their number to their hours."""
+    features = {
+        "heating.boiler.serial": {"properties": {"value": {"type": "string", "value": "boiler-serial"}}},
+        "heating.controller.serial": {"properties": {"value": {"type": "string", "value": "controller-serial"}}},
+        "heating.bufferCylinder.sensors.temperature.top": {"properties": {"value": {"type": "number", "value": 21.3}}},
+        "heating.sensors.temperature.outside": {"properties": {"value": {"type": "number", "value": 3.3}}},
+        "heating.primaryCircuit.sensors.temperature.supply": {"properties": {"value": {"type": "number", "value": 29}}},
+        "heating.secondaryCircuit.sensors.temperature.supply": {
+            "properties": {"value": {"type": "number", "value": 24.7}}
+        },
+        "heating.sensors.temperature.return": {"properties": {"value": {"type": "number", "value": 4.4}}},
+        "heating.compressors": {"properties": {"enabled": {"type": "array", "value": list(compressors)}}},
+    }
+    for no, hours in compressors.items():
+        features[f"heating.compressors.{no}"] = {
+            "properties": {"active": {"type": "boolean", "value": True}, "phase": {"type": "string", "value": "?"}}
+        }
+        features[f"heating.compressors.{no}.statistics"] = {
+            "properties": {"hours": {"type": "number", "value": hours}, "starts": {"type": "number", "value": 12}}
+        }
+    return features
+
+
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
 def test_heatpump_should_return_meta_information_on_root(dependency_mocker):
     dependency_mocker.vicare.devices = [
-        Mock(
-            asHeatPump=lambda: Mock(
-                compressors=[
-                    Mock(
-                        getActive=lambda: True,
-                        getHours=lambda: 100,
-                        getPhase=lambda: "?",
-                        getStarts=lambda: 12,
-                    )
-                ],
-                getBoilerSerial=lambda: "boiler-serial",
-                getBufferTopTemperature=lambda: 21.3,
-                getControllerSerial=lambda: "controller-serial",
-                getOutsideTemperature=lambda: 3.3,
-                getSupplyTemperaturePrimaryCircuit=lambda: 29,
-                getSupplyTemperatureSecondaryCircuit=lambda: 24.7,
-                getReturnTemperature=lambda: 4.4,
-            ),
-            device_id=1234,
-            device_model="test_device",
-            accessor=Mock(serial="test_serial"),
-            service=Mock(
-                roles=["type:heatpump"],
-            ),
-            status="online",
-        )
+        features_device_config(heatpump_features({"0": 100}), ["type:heatpump"], "test_device", "test_serial", 1234)
     ]
 
     response = client.get(ROUTE_PREFIX_HEATING_HEATPUMP)
@@ -65,5 +64,47 @@ def test_heatpump_should_return_meta_information_on_root(dependency_mocker):
             "return": 4.4,
             "secondaryCircuitSupply": 24.7,
         },
-        "status": "online",
+        "status": "Online",
+    }
+
+
+@pytest.mark.parametrize(
+    "dependency_mocker, path, expected",
+    [
+        (app, "", status.HTTP_422_UNPROCESSABLE_CONTENT),
+        (app, "/compressors/1", status.HTTP_200_OK),
+        (app, "/compressors/2", status.HTTP_404_NOT_FOUND),
+    ],
+    indirect=["dependency_mocker"],
+)
+def test_heatpump_should_address_compressor_by_number(dependency_mocker, path: str, expected: int):
+    dependency_mocker.vicare.devices = [
+        features_device_config(heatpump_features({"0": 100, "1": 200}), ["type:heatpump"])
+    ]
+
+    response = client.get(f"{ROUTE_PREFIX_HEATING_HEATPUMP}{path}")
+
+    assert response.status_code == expected
+    if expected == status.HTTP_200_OK:
+        assert response.json()["compressor"]["hours"] == 200
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+@pytest.mark.parametrize("path", ["/stats", "/compressors/0/stats"])
+def test_heatpump_stats_should_return_windows_of_compressor(dependency_mocker, path: str):
+    dependency_mocker.vicare.devices = [recorded_device_config("heatpump_features.json", ["type:heatpump"])]
+
+    response = client.get(f"{ROUTE_PREFIX_HEATING_HEATPUMP}{path}")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["compressor"] == "0"
+    assert list(response.json()["windows"]) == ["1h", "24h", "7d"]
+    assert set(response.json()["windows"]["1h"]) == {
+        "averageRuntime",
+        "dutyCycle",
+        "observed",
+        "shortCycling",
+        "starts",
+        "startsPerHour",
+        "supplyReturnSpread",
     }
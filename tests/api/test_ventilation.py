@@ -2,11 +2,11 @@ from unittest.mock import Mock
 
 import pytest
 from fastapi.testclient import TestClient
-from PyViCare.PyViCareDeviceConfig import PyViCareDeviceConfig
 from starlette import status
 
 from app.api.ventilation import ROUTE_PREFIX_VENTILATION
 from app.main import app
+from tests.recorded_devices import features_device_config
 
 client = TestClient(app)
 
@@ -72,11 +72,8 @@ def test_ventilation_should_return_meta_information_on_root(dependency_mocker):
         "ventilation.levels.levelFour": {"properties": {"volumeFlow": {"value": 40, "unit": "m³/h"}}},
     }
     dependency_mocker.vicare.devices = [
-        PyViCareDeviceConfig(
-            Mock(serial="test_serial", device_id=1234),
-            Mock(roles=["type:ventilation"], getProperty=lambda accessor, p: property_map[p]),
-            "test_device",
-            "online",
+        features_device_config(
+            property_map, ["type:ventilation"], "test_device", "test_serial", 1234, device_type="ventilation"
         )
     ]
 
@@ -130,7 +127,7 @@ def test_ventilation_should_return_meta_information_on_root(dependency_mocker):
                 "extractPercent": 47,
             },
         },
-        "status": "online",
+        "status": "Online",
         "volumeFlow": {
             "inputCubicMetersPerHour": 127,
             "outputCubicMetersPerHour": 126,
@@ -141,9 +138,9 @@ def test_ventilation_should_return_meta_information_on_root(dependency_mocker):
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
 def test_ventilation_mode(dependency_mocker):
     dependency_mocker.vicare.devices = [
-        Mock(
-            service=Mock(roles=["type:ventilation"]),
-            asVentilation=lambda: Mock(getActiveMode=lambda: "permanent"),
+        features_device_config(
+            {"ventilation.operating.modes.active": {"properties": {"value": {"type": "string", "value": "permanent"}}}},
+            ["type:ventilation"],
         )
     ]
     response = client.get(f"{ROUTE_PREFIX_VENTILATION}/mode")
@@ -172,7 +169,7 @@ def test_ventilation_set_mode_permanent(dependency_mocker, level: int, expected:
             asVentilation=lambda: Mock(setPermanentLevel=setter_mock),
         )
     ]
-    response = client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/{level}")
+    response = client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/{level}", params={"wait": True})
 
     assert response.status_code == 204
     setter_mock.assert_called_once_with(expected)
@@ -193,7 +190,7 @@ def test_ventilation_set_mode_permanent_failure(dependency_mocker, level: int, e
             asVentilation=lambda: Mock(),
         )
     ]
-    response = client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/{level}")
+    response = client.put(f"{ROUTE_PREFIX_VENTILATION}/mode/permanent/{level}", params={"wait": True})
 
     assert response.status_code == expected
 
@@ -201,9 +198,13 @@ def test_ventilation_set_mode_permanent_failure(dependency_mocker, level: int, e
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
 def test_ventilation_program(dependency_mocker):
     dependency_mocker.vicare.devices = [
-        Mock(
-            service=Mock(roles=["type:ventilation"]),
-            asVentilation=lambda: Mock(getActiveProgram=lambda: "levelThree"),
+        features_device_config(
+            {
+                "ventilation.operating.programs.active": {
+                    "properties": {"value": {"type": "string", "value": "levelThree"}}
+                }
+            },
+            ["type:ventilation"],
         )
     ]
     response = client.get(f"{ROUTE_PREFIX_VENTILATION}/program")
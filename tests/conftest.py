@@ -9,11 +9,11 @@ from fastapi import FastAPI
 from pyatv.interface import AppleTV
 from PyViCare import PyViCare
 
-import app.dependencies as _appletv_globals
+from app.appletv import PORT_START, AppleTvState
 from app.dependencies import (
-    PORT_START,
-    AppleTvConnection,
-    get_appletv_connection,
+    get_appletv_manager,
+    get_appletv_state,
+    get_logged_in_vicare,
     get_request_tracker,
     get_settings,
     get_vicare,
@@ -41,17 +41,15 @@ def check_args(args) -> (FastAPI, dict):
 
 
 @pytest.fixture(autouse=True)
-def _reset_appletv_connection_globals() -> None:
-    """Reset AppleTV connection cache + scan-cooldown between tests for isolation."""
-    _appletv_globals._cached_appletv_connection = None
-    _appletv_globals._last_scan_failed_at = None
+def _reset_appletv_connections() -> None:
+    """Reset the cached Apple TV connections and scan cooldowns between tests for isolation."""
+    get_appletv_manager.cache_clear()
     yield
-    _appletv_globals._cached_appletv_connection = None
-    _appletv_globals._last_scan_failed_at = None
+    get_appletv_manager.cache_clear()
 
 
 class DependencyMocker(NamedTuple):
-    appletv_connection: AppleTvConnection
+    appletv_connection: AppleTV
     settings: Settings
     vicare: MagicMock
 
@@ -64,9 +62,51 @@ def dependency_mocker(request: SubRequest) -> DependencyMocker:
         "email": "test@example.com",
         "password": "password",
         "client_id": "test_client",
+        "appletv_enabled": True,
         "appletv_host": "192.168.1.100",
         "appletv_companion_identifier": "id42",
         "appletv_companion_credentials": "test-credentials",
+        # pairs of name and device instead of a dict, so the settings stay hashable
+        "appletv_devices": (),
+        "appletv_reconnect_backoff": 1.0,
+        "appletv_reconnect_max_backoff": 60.0,
+        "appletv_scan_cooldown": 60.0,
+        "health_error_rate_threshold": None,
+        "health_error_rate_window": "5m",
+        # not cached, so each test gets a fresh report
+        "health_cache_ttl": 0.0,
+        "change_log_size": 1000,
+        "heatpump_short_cycle_runtime": 600.0,
+        "heatpump_short_cycle_starts_per_hour": 3.0,
+        "command_debounce_window": 0.05,
+        "command_skip_max_age": 60.0,
+        "vicare_max_concurrency": 8,
+        "vicare_max_queue": 32,
+        "appletv_max_concurrency": 2,
+        "appletv_max_queue": 8,
+        "admission_retry_after": 5,
+        "reserved_threads": 4,
+        "threadpool_size": 40,
+        "loop_monitor_interval": 0.5,
+        "loop_block_threshold": 0.1,
+        "loop_block_stacks": False,
+        "vicare_breaker_window": 20,
+        "vicare_breaker_failure_rate": 0.5,
+        "vicare_breaker_slow_call_duration": 10.0,
+        "vicare_breaker_open_duration": 30.0,
+        "vicare_upstream_workers": 8,
+        "vicare_upstream_queue_size": 64,
+        "vicare_upstream_aging": 10.0,
+        "shutdown_timeout": 5.0,
+        "state_file": None,
+        # enabled by rate limiting tests only, as all other tests would share the budget of the test client
+        "rate_limit_enabled": False,
+        "rate_limit_rate": 5.0,
+        "rate_limit_burst": 30.0,
+        "rate_limit_upstream_rate": 0.1,
+        "rate_limit_upstream_burst": 20.0,
+        "rate_limit_max_clients": 1024,
+        "rate_limit_client_header": None,
         **setting_values,
     }
     settings: Settings = namedtuple("Settings", settings.keys())(*settings.values())
@@ -74,10 +114,11 @@ def dependency_mocker(request: SubRequest) -> DependencyMocker:
 
     vicare: PyViCare = MagicMock()
     app.dependency_overrides[get_vicare] = lambda: vicare
+    app.dependency_overrides[get_logged_in_vicare] = lambda: vicare
 
     appletv: AppleTV = MagicMock()
-    app.dependency_overrides[get_appletv_connection] = lambda: AppleTvConnection(
-        appletv, settings.appletv_host, PORT_START + 1
+    app.dependency_overrides[get_appletv_state] = lambda: AppleTvState(
+        settings.appletv_host, PORT_START + 1, "connected", appletv.power.power_state
     )
 
     return DependencyMocker(appletv, settings, vicare)
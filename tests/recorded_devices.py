@@ -0,0 +1,56 @@
+"""Devices serving recorded or given ViCare features, for tests and benchmarks."""
+
+import copy
+import json
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from PyViCare.PyViCareCachedService import ViCareCachedService
+from PyViCare.PyViCareDeviceConfig import PyViCareDeviceConfig
+from PyViCare.PyViCareService import ViCareDeviceAccessor
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def load_resource(name: str) -> dict:
+    """Load a recorded ViCare API response from `tests/resources`."""
+    with (RESOURCES / name).open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def recorded_device_config(resource: str, roles: list[str], model: str = "E3_Vitocal_16") -> PyViCareDeviceConfig:
+    """Create a real PyViCare device config whose (cached) service serves the recorded features of `resource`."""
+    return payload_device_config(load_resource(resource), roles, model)
+
+
+def features_device_config(
+    features: dict[str, dict],
+    roles: list[str],
+    model: str = "E3_Vitocal_16",
+    serial: str = "7633107093013212",
+    device_id: str = "0",
+    device_type: str = "heating",
+) -> PyViCareDeviceConfig:
+    """Create a real PyViCare device config whose (cached) service serves `features`, given as feature name to its
+    `properties` and `commands`, e.g. `{"heating.dhw": {"properties": {"status": {"value": "on"}}}}`.
+    """
+    payload = {"data": [{"feature": name, "isEnabled": True, **feature} for name, feature in features.items()]}
+    return payload_device_config(payload, roles, model, serial, device_id, device_type)
+
+
+def payload_device_config(
+    payload: dict,
+    roles: list[str],
+    model: str = "E3_Vitocal_16",
+    serial: str = "7633107093013212",
+    device_id: str = "0",
+    device_type: str = "heating",
+) -> PyViCareDeviceConfig:
+    """Create a real PyViCare device config whose (cached) service serves the features `payload`, as a new object per
+    fetch like the ViCare API.
+    """
+    oauth_manager = MagicMock(get=lambda _url: copy.deepcopy(payload))
+    accessor = ViCareDeviceAccessor(1234567, serial, device_id)
+    return PyViCareDeviceConfig(
+        accessor, ViCareCachedService(oauth_manager, roles, 60), model, "Online", device_type, roles
+    )
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, AdmissionRejectedError
+
+
+async def test_admit_limits_concurrency_and_queues_requests():
+    controller = AdmissionController("upstream", limit=1, queue_size=1, retry_after=5)
+    release = asyncio.Event()
+
+    async def request():
+        async with controller.admit():
+            await release.wait()
+
+    first = asyncio.create_task(request())
+    second = asyncio.create_task(request())
+    await asyncio.sleep(0)
+
+    assert controller.get_metrics() == {
+        "limit": 1,
+        "in_flight": 1,
+        "queue_size": 1,
+        "queued": 1,
+        "admitted": 1,
+        "shed": 0,
+    }
+
+    release.set()
+    await asyncio.gather(first, second)
+
+    assert controller.get_metrics()["in_flight"] == 0
+    assert controller.get_metrics()["queued"] == 0
+    assert controller.get_metrics()["admitted"] == 2
+
+
+async def test_admit_sheds_requests_if_queue_is_full():
+    controller = AdmissionController("upstream", limit=1, queue_size=1, retry_after=7)
+    release = asyncio.Event()
+
+    async def request():
+        async with controller.admit():
+            await release.wait()
+
+    tasks = [asyncio.create_task(request()) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejectedError) as e:
+        async with controller.admit():
+            pass
+
+    assert e.value.retry_after == 7
+    assert controller.get_metrics()["shed"] == 1
+    release.set()
+    await asyncio.gather(*tasks)
+
+
+async def test_admit_releases_slot_on_errors():
+    controller = AdmissionController("upstream", limit=1, queue_size=0, retry_after=5)
+
+    with pytest.raises(ValueError):
+        async with controller.admit():
+            raise ValueError()
+
+    async with controller.admit():
+        assert controller.get_metrics()["in_flight"] == 1
@@ -0,0 +1,272 @@
+import asyncio
+from ipaddress import IPv4Address
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
+
+import pytest
+from pyatv.const import PowerState, Protocol
+
+from app.appletv import (
+    PORT_END,
+    PORT_HISTORY_HALF_LIFE,
+    PORT_START,
+    AppleTvConnectionManager,
+    PortHistory,
+)
+from app.settings import AppleTvDevice
+
+PORT = 49153
+
+LIVING_ROOM = AppleTvDevice(host=IPv4Address("192.168.1.100"), companion_identifier="id42", companion_credentials="a")
+BEDROOM = AppleTvDevice(host=IPv4Address("192.168.1.101"), companion_identifier="id43", companion_credentials="b")
+
+
+def create_manager(scan_cooldown: float = 60.0) -> AppleTvConnectionManager:
+    return AppleTvConnectionManager(
+        {"living-room": LIVING_ROOM, "bedroom": BEDROOM}, scan_cooldown=scan_cooldown, backoff=0.001, max_backoff=0.01
+    )
+
+
+def connect_on(port: int, atv: MagicMock):
+    """Side effect of `connect`, connecting to `atv` only on `port`."""
+
+    def _connect(config, _loop):
+        service = next(s for s in config.services if s.protocol == Protocol.Companion)
+        return atv if service.port == port else None
+
+    return _connect
+
+
+def create_atv(power_state: PowerState = PowerState.On) -> MagicMock:
+    atv = MagicMock()
+    atv.power.power_state = power_state
+    return atv
+
+
+def kill(atv: MagicMock) -> None:
+    type(atv).power = PropertyMock(side_effect=Exception("Dead"))
+
+
+async def reconnected(manager: AppleTvConnectionManager, name: str) -> None:
+    await asyncio.wait_for(manager._devices[name].reconnect_task, timeout=2.0)
+
+
+async def test_connects_in_background_and_reads_state_of_live_connection():
+    manager = create_manager()
+    atv = create_atv()
+
+    with patch("app.appletv.connect", new_callable=AsyncMock, side_effect=connect_on(PORT, atv)) as patched:
+        connecting = manager.get_state("living-room")
+        await reconnected(manager, "living-room")
+        connected = manager.get_state("living-room")
+        again = manager.get_state("living-room")
+
+    assert (connecting.connection, connecting.port, connecting.power_state) == ("connecting", None, None)
+    assert (connected.connection, connected.port, connected.power_state) == ("connected", PORT, PowerState.On)
+    assert connected.host == LIVING_ROOM.host
+    assert again == connected
+    assert patched.call_count == PORT - PORT_START + 1
+
+
+async def test_dead_connection_responds_last_known_state_while_reconnecting_on_cached_port():
+    manager = create_manager()
+    dead_atv, alive_atv = create_atv(), create_atv(PowerState.Off)
+    with patch("app.appletv.connect", new_callable=AsyncMock, side_effect=connect_on(PORT, dead_atv)):
+        manager.get_state("living-room")
+        await reconnected(manager, "living-room")
+        manager.get_state("living-room")
+    kill(dead_atv)
+
+    with patch("app.appletv.connect", new_callable=AsyncMock, return_value=alive_atv) as patched:
+        reconnecting = manager.get_state("living-room")
+        await reconnected(manager, "living-room")
+        connected = manager.get_state("living-room")
+
+    assert (reconnecting.connection, reconnecting.port, reconnecting.power_state) == (
+        "reconnecting",
+        PORT,
+        PowerState.On,
+    )
+    assert (connected.connection, connected.port, connected.power_state) == ("connected", PORT, PowerState.Off)
+    # reconnect should only try the cached port, not scan the whole range
+    assert patched.call_count == 1
+    await manager.close()
+    dead_atv.close.assert_called_once()
+
+
+async def test_full_scan_finds_no_device():
+    manager = create_manager()
+
+    with patch(
+        "app.appletv.connect", new_callable=AsyncMock, side_effect=ConnectionError("connection refused")
+    ) as patched:
+        result = await manager.try_connect("living-room")
+
+    assert result is False
+    assert patched.call_count == PORT_END - PORT_START + 1
+
+
+async def test_dead_cached_port_falls_back_to_full_scan():
+    manager = create_manager()
+    with patch("app.appletv.connect", new_callable=AsyncMock, side_effect=connect_on(PORT, create_atv())):
+        await manager.try_connect("living-room")
+    target_port = PORT + 1
+
+    with patch(
+        "app.appletv.connect", new_callable=AsyncMock, side_effect=connect_on(target_port, create_atv())
+    ) as patched:
+        result = await manager.try_connect("living-room")
+
+    assert result is True
+    assert manager.get_state("living-room").port == target_port
+    # cached port tried once, then the scan from PORT_START to the target port skipping the cached one
+    assert patched.call_count == 1 + (target_port - PORT_START + 1) - 1
+
+
+async def test_connection_timeout_fails_attempt():
+    manager = create_manager()
+
+    with patch("app.appletv.connect", new_callable=AsyncMock, side_effect=TimeoutError()):
+        result = await manager.try_connect("living-room")
+
+    assert result is False
+
+
+async def test_failed_scan_is_cooldown_cached_per_device():
+    manager = create_manager()
+
+    with patch(
+        "app.appletv.connect", new_callable=AsyncMock, side_effect=ConnectionError("connection refused")
+    ) as patched:
+        first = await manager.try_connect("living-room")
+        second = await manager.try_connect("living-room")
+        # the cooldown of one device doesn't affect the others
+        other = await manager.try_connect("bedroom")
+
+    assert (first, second, other) == (False, False, False)
+    assert patched.call_count == 2 * (PORT_END - PORT_START + 1)
+
+
+async def test_reconnecting_retries_until_connected():
+    manager = create_manager(scan_cooldown=0.0)
+    attempts = 3 * (PORT_END - PORT_START + 1)
+    atv = create_atv()
+    connect = AsyncMock(side_effect=[None] * attempts + [atv])
+
+    with patch("app.appletv.connect", connect):
+        manager.get_state("living-room")
+        await reconnected(manager, "living-room")
+
+    assert connect.call_count == attempts + 1
+    assert manager.get_state("living-room").connection == "connected"
+
+
+async def test_reconnecting_survives_unexpected_errors():
+    manager = create_manager()
+
+    with patch.object(manager, "try_connect", AsyncMock(side_effect=[RuntimeError("unexpected"), True])) as patched:
+        manager.get_state("living-room")
+        await reconnected(manager, "living-room")
+
+    assert patched.call_count == 2
+
+
+async def test_reconnecting_backoff_is_capped_however_many_attempts_failed():
+    manager = create_manager()
+    attempts = 2000
+
+    with (
+        patch.object(manager, "try_connect", AsyncMock(side_effect=[False] * attempts + [True])),
+        patch("app.appletv.random.uniform", return_value=0.0) as uniform,
+    ):
+        manager.get_state("living-room")
+        await reconnected(manager, "living-room")
+
+    assert uniform.call_count == attempts
+    assert [call.args[1] for call in uniform.call_args_list[:5]] == pytest.approx([0.001, 0.002, 0.004, 0.008, 0.01])
+    assert uniform.call_args_list[-1].args[1] == 0.01
+
+
+async def test_connect_passes_settings_of_device():
+    manager = create_manager()
+
+    with patch("app.appletv.connect", new_callable=AsyncMock, return_value=None) as patched:
+        await manager.try_connect("bedroom")
+
+    for call in patched.call_args_list:
+        config = call.args[0]
+        service = next(s for s in config.services if s.protocol == Protocol.Companion)
+        assert config.address == BEDROOM.host
+        assert service.identifier == "id43"
+        assert service.credentials == "b"
+
+
+async def test_slow_device_does_not_block_the_others():
+    manager = create_manager()
+    atv = create_atv()
+    hanging = asyncio.Event()
+
+    async def _connect(config, _loop):
+        if config.address == LIVING_ROOM.host:
+            await hanging.wait()
+        return atv
+
+    with patch("app.appletv.connect", side_effect=_connect):
+        slow = manager.get_state("living-room")
+        manager.get_state("bedroom")
+        await reconnected(manager, "bedroom")
+        fast = manager.get_state("bedroom")
+
+    assert slow.connection == "connecting"
+    assert manager.get_state("living-room").connection == "connecting"
+    assert fast.connection == "connected"
+    assert fast.host == BEDROOM.host
+    await manager.close()
+
+
+async def test_close_stops_reconnecting_and_closes_all_connections():
+    manager = create_manager()
+    atv = create_atv()
+    with patch("app.appletv.connect", new_callable=AsyncMock, return_value=atv):
+        await manager.try_connect("living-room")
+    with patch("app.appletv.connect", new_callable=AsyncMock, side_effect=ConnectionError("connection refused")):
+        manager.get_state("bedroom")
+        await manager.close()
+
+    assert atv.close.call_count == 1
+    assert manager._devices["bedroom"].reconnect_task.cancelled()
+
+
+def test_port_history_ranks_by_frequency_and_recency():
+    history = PortHistory()
+    for _ in range(3):
+        history.record(PORT, now=0.0)
+    history.record(PORT + 1, now=0.0)
+    assert history.ranked(now=0.0) == [PORT, PORT + 1]
+
+    # halved twice, the frequent port is outweighed by one used recently
+    history.record(PORT + 2, now=2 * PORT_HISTORY_HALF_LIFE)
+    history.record(PORT + 2, now=2 * PORT_HISTORY_HALF_LIFE)
+    assert history.ranked(now=2 * PORT_HISTORY_HALF_LIFE) == [PORT + 2, PORT, PORT + 1]
+
+
+async def test_scan_tries_ports_of_restored_history_first():
+    previous = create_manager()
+    with patch("app.appletv.connect", new_callable=AsyncMock, side_effect=connect_on(PORT_END, create_atv())):
+        await previous.try_connect("living-room")
+    manager = create_manager()
+    manager.restore_port_histories({**previous.get_port_histories(), "kitchen": {PORT: (1.0, 0.0)}})
+
+    with patch(
+        "app.appletv.connect", new_callable=AsyncMock, side_effect=connect_on(PORT_END, create_atv())
+    ) as patched:
+        assert await manager.try_connect("living-room")
+
+    # stops at the port of the history, the last one of the range
+    assert patched.call_count == 1
+    assert manager.get_port_histories()["living-room"][PORT_END][0] == pytest.approx(2.0, abs=0.01)
+    assert manager.get_port_histories()["bedroom"] == {}
+
+
+def test_unknown_device_is_rejected():
+    with pytest.raises(KeyError):
+        create_manager().get_state("kitchen")
@@ -0,0 +1,88 @@
+import argparse
+import json
+import time
+
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from app import cli
+from app.bench import RouteStats, default_mix, parse_mix, run, run_step
+from app.fake_vicare import running
+
+target = FastAPI(title="Bench target")
+
+
+@target.get("/ok")
+def ok() -> dict:
+    return {}
+
+
+@target.get("/fail")
+def fail() -> dict:
+    raise HTTPException(500)
+
+
+@target.get("/slow")
+def slow() -> dict:
+    time.sleep(0.05)
+    return {}
+
+
+@pytest.fixture(scope="module")
+def base_url() -> str:
+    with running(target) as url:
+        yield url
+
+
+def test_percentiles_are_nearest_rank():
+    stats = RouteStats(latencies=[float(i) for i in range(100, 0, -1)])
+
+    assert (stats.percentile(50), stats.percentile(99), stats.percentile(100)) == (50, 99, 100)
+    assert RouteStats().percentile(99) == 0
+
+
+def test_parse_mix():
+    assert parse_mix("/heating/circuit=3, /health") == {"/heating/circuit": 3.0, "/health": 1.0}
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_mix("/health=0")
+
+
+def test_default_mix_drops_appletv_if_disabled():
+    assert "/appletv" in default_mix()
+    assert "/appletv" not in default_mix(appletv_enabled=False)
+    assert "/health" in default_mix(appletv_enabled=False)
+
+
+def test_run_step_reports_per_route(base_url):
+    result = run_step(base_url, {"/ok": 1, "/fail": 1}, concurrency=2, duration=0.3)
+
+    assert result.concurrency == 2
+    assert result.duration >= 0.3
+    assert result.routes["/ok"].requests > 0
+    assert result.routes["/ok"].error_rate == 0
+    assert result.routes["/fail"].error_rate == 1
+    assert result.routes["/fail"].status_codes.keys() == {"500"}
+    assert result.total.requests == result.routes["/ok"].requests + result.routes["/fail"].requests
+
+
+def test_run_stops_at_saturation(base_url):
+    results, saturation = run(base_url, {"/slow": 1}, [1, 2, 4], duration=0.2, p99_threshold=0.01)
+
+    assert saturation == 1
+    assert [result.concurrency for result in results] == [1]
+
+
+def test_run_without_saturation(base_url):
+    results, saturation = run(base_url, {"/ok": 1}, [1, 2], duration=0.2, p99_threshold=10)
+
+    assert saturation is None
+    assert [result.concurrency for result in results] == [1, 2]
+
+
+def test_cli_prints_json_report(base_url, capsys):
+    cli.main(["bench", "--url", base_url, "--mix", "/ok", "--concurrency", "1", "--duration", "0.2", "--json"])
+
+    report = json.loads(capsys.readouterr().out)
+    assert report["saturation"] is None
+    assert report["steps"][0]["routes"]["/ok"]["requests"] > 0
+    assert report["steps"][0]["total"]["errorRate"] == 0
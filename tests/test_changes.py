@@ -0,0 +1,79 @@
+import copy
+
+from app.changes import ChangeLog
+from app.features import DeviceSnapshot
+from tests.recorded_devices import load_resource
+
+COMPRESSOR = "heating.compressors.0"
+DHW_TEMPERATURE = "heating.dhw.temperature.main"
+
+
+def set_value(payload: dict, feature: str, prop: str, value) -> None:
+    next(f for f in payload["data"] if f["feature"] == feature)["properties"][prop]["value"] = value
+
+
+def test_first_payload_is_baseline_only():
+    change_log = ChangeLog(10)
+
+    assert change_log.record("device", DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))) == []
+    assert change_log.since() == []
+
+
+def test_same_snapshot_is_skipped():
+    change_log = ChangeLog(10)
+    snapshot = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+    change_log.record("device", snapshot)
+    snapshot.features[COMPRESSOR].properties["active"] = True
+
+    assert change_log.record("device", snapshot) == []
+
+
+def test_changed_values_are_recorded():
+    change_log = ChangeLog(10)
+    previous = load_resource("heatpump_features.json")
+    change_log.record("device", DeviceSnapshot.from_payload(previous))
+    payload = copy.deepcopy(previous)
+    set_value(payload, COMPRESSOR, "active", True)
+    set_value(payload, DHW_TEMPERATURE, "value", 50)
+
+    changes = change_log.record("device", DeviceSnapshot.from_payload(payload))
+
+    assert [(c.device, c.path, c.old, c.new) for c in changes] == [
+        ("device", f"{COMPRESSOR}.active", False, True),
+        ("device", f"{DHW_TEMPERATURE}.value", 48, 50),
+    ]
+    assert changes[0].feature_timestamp is not None
+    assert change_log.since() == changes
+
+
+def test_added_and_removed_features_are_recorded():
+    change_log = ChangeLog(10)
+    previous = load_resource("heatpump_features.json")
+    change_log.record("device", DeviceSnapshot.from_payload(previous))
+    payload = copy.deepcopy(previous)
+    removed = payload["data"].pop(0)
+    payload["data"].append({"feature": "heating.new", "properties": {"active": {"type": "boolean", "value": True}}})
+
+    changes = change_log.record("device", DeviceSnapshot.from_payload(payload))
+
+    assert {c.path: c.new for c in changes} == {removed["feature"]: None, "heating.new": {"active": True}}
+
+
+def test_since_filters_by_timestamp_and_device_and_is_bounded():
+    change_log = ChangeLog(3)
+    payloads = {device: load_resource("heatpump_features.json") for device in ("a", "b")}
+    for device, payload in payloads.items():
+        change_log.record(device, DeviceSnapshot.from_payload(payload))
+
+    for temperature in (49, 50):
+        for device in ("a", "b"):
+            payload = copy.deepcopy(payloads[device])
+            set_value(payload, DHW_TEMPERATURE, "value", temperature)
+            change_log.record(device, DeviceSnapshot.from_payload(payload))
+            payloads[device] = payload
+
+    changes = change_log.since()
+    assert [(c.device, c.new) for c in changes] == [("b", 49), ("a", 50), ("b", 50)]
+    assert [(c.device, c.new) for c in change_log.since(device="b")] == [("b", 49), ("b", 50)]
+    assert change_log.since(changes[-1].timestamp) == []
+    assert change_log.since(changes[0].timestamp - 1) == changes
@@ -0,0 +1,256 @@
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from app.commands import CommandQueue
+from app.upstream_executor import Priority, UpstreamExecutor
+
+
+def wait_until_executed(queue: CommandQueue, command_id: str, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while queue.get(command_id).executed_at is None:
+        assert time.monotonic() < deadline, "Command was not executed in time"
+        time.sleep(0.01)
+
+
+def test_submit_should_debounce_and_execute_latest_value():
+    queue = CommandQueue(0.05)
+    first, second = Mock(), Mock()
+
+    command = queue.submit("device", "mode", "heating", first)
+    coalesced = queue.submit("device", "mode", "standby", second)
+    wait_until_executed(queue, command.id)
+
+    assert coalesced is command
+    assert command.value == "standby"
+    assert command.coalesced == 1
+    assert command.status == "succeeded"
+    first.assert_not_called()
+    second.assert_called_once()
+
+
+def test_submit_should_not_coalesce_different_commands_or_devices():
+    queue = CommandQueue(0.05)
+
+    commands = [
+        queue.submit("device", "mode", 1, Mock()),
+        queue.submit("device", "program", 2, Mock()),
+        queue.submit("other", "mode", 3, Mock()),
+    ]
+
+    assert len({command.id for command in commands}) == 3
+
+
+def test_commands_of_a_device_should_be_executed_in_dispatch_order():
+    queue = CommandQueue(0.0)
+    executed = []
+    release = threading.Event()
+
+    def blocking():
+        release.wait(1.0)
+        executed.append("first")
+
+    first = queue.submit("device", "first", None, blocking)
+    time.sleep(0.05)
+    second = queue.submit("device", "second", None, lambda: executed.append("second"))
+    time.sleep(0.05)
+    assert executed == []
+
+    release.set()
+    wait_until_executed(queue, first.id)
+    wait_until_executed(queue, second.id)
+
+    assert executed == ["first", "second"]
+
+
+def test_waited_for_command_should_supersede_pending_one_and_raise_errors():
+    queue = CommandQueue(10.0)
+    pending_action = Mock()
+    pending = queue.submit("device", "mode", "heating", pending_action)
+
+    with pytest.raises(ValueError, match="boom"):
+        queue.submit("device", "mode", "standby", Mock(side_effect=ValueError("boom")), wait=True)
+
+    assert pending.status == "superseded"
+    assert queue.get(pending.id) is pending
+    pending_action.assert_not_called()
+
+
+def test_history_should_be_bounded():
+    queue = CommandQueue(0.0, history_size=2)
+
+    commands = [queue.submit("device", f"command{i}", i, Mock(), wait=True) for i in range(3)]
+
+    assert queue.get(commands[0].id) is None
+    assert queue.get(commands[2].id) is commands[2]
+
+
+def test_flush_should_execute_pending_commands_once_without_waiting_for_debounce_window():
+    queue = CommandQueue(0.1)
+    action = Mock()
+    command = queue.submit("device", "mode", "heating", action)
+
+    assert queue.flush(timeout=2.0) == (1, 0)
+    assert command.status == "succeeded"
+
+    # the debounce timer must not execute it again
+    time.sleep(0.2)
+    action.assert_called_once()
+
+
+def test_flush_should_report_unfinished_commands_after_timeout():
+    queue = CommandQueue(10.0)
+    release = threading.Event()
+    queue.submit("device", "mode", "heating", release.wait)
+
+    assert queue.flush(timeout=0.05) == (1, 1)
+    release.set()
+
+
+def test_commands_should_be_executed_by_upstream_executor_before_reads():
+    upstream = UpstreamExecutor(workers=1, queue_size=10, aging=60.0, retry_after=5)
+    queue = CommandQueue(10.0, upstream)
+    started, release = threading.Event(), threading.Event()
+    upstream.submit(Priority.INTERACTIVE, lambda: (started.set(), release.wait()))
+    assert started.wait(2)
+    executed = []
+    read = upstream.submit(Priority.INTERACTIVE, executed.append, "read")
+    waiting = threading.Thread(
+        target=queue.submit, args=("device", "mode", "heating", lambda: executed.append("command"), True)
+    )
+    waiting.start()
+    # the command is queued before releasing the worker
+    deadline = time.monotonic() + 2
+    while not upstream.get_metrics()["command"]["queued"]:
+        assert time.monotonic() < deadline, "Command was not queued in time"
+        time.sleep(0.01)
+
+    release.set()
+    waiting.join(2)
+    read.result(timeout=2)
+
+    assert executed == ["command", "read"]
+
+
+def test_skip_should_record_skipped_command_if_state_is_fresh():
+    queue = CommandQueue(0.0, skip_max_age=60.0)
+
+    command = queue.skip("device", "mode", "heating", unchanged_since=time.time())
+
+    assert command.status == "skipped"
+    assert command.executed_at is not None
+    assert queue.get(command.id) is command
+
+
+def test_skip_should_not_skip_if_state_is_too_old():
+    queue = CommandQueue(0.0, skip_max_age=60.0)
+
+    assert queue.skip("device", "mode", "heating", unchanged_since=time.time() - 61.0) is None
+
+
+def test_skip_should_not_skip_if_command_of_same_name_is_pending_or_executed_since():
+    queue = CommandQueue(10.0, skip_max_age=60.0)
+    since = time.time()
+    pending = queue.submit("device", "mode", "standby", Mock())
+
+    assert queue.skip("device", "mode", "heating", unchanged_since=since) is None
+    # other commands and devices are independent
+    assert queue.skip("device", "program", "eco", unchanged_since=since) is not None
+    assert queue.skip("other", "mode", "heating", unchanged_since=since) is not None
+
+    queue.flush(timeout=2.0)
+    assert pending.status == "succeeded"
+    assert queue.skip("device", "mode", "heating", unchanged_since=since) is None
+    assert queue.skip("device", "mode", "heating", unchanged_since=time.time()) is not None
+
+
+def test_skip_should_regard_commands_of_same_name_evicted_from_history():
+    queue = CommandQueue(10.0, history_size=1, skip_max_age=60.0)
+    since = time.time()
+    pending = queue.submit("device", "mode", "standby", Mock())
+    queue.submit("device", "program", "eco", Mock())
+
+    assert queue.get(pending.id) is None
+    assert queue.skip("device", "mode", "heating", unchanged_since=since) is None
+
+    queue.flush(timeout=2.0)
+    queue.submit("device", "program", "comfort", Mock())
+    assert queue.skip("device", "mode", "heating", unchanged_since=since) is None
+    assert queue.flush(timeout=2.0) == (1, 0)
+
+
+def test_actions_of_command_should_be_executed_concurrently_by_upstream_executor():
+    upstream = UpstreamExecutor(workers=2, queue_size=10, aging=60.0, retry_after=5)
+    queue = CommandQueue(0.0, upstream)
+    barrier = threading.Barrier(2, timeout=2)
+
+    command = queue.submit("device", "program", "normal", [barrier.wait, barrier.wait], wait=True)
+
+    assert command.status == "succeeded"
+
+
+def test_command_should_fail_after_all_of_its_actions_finished():
+    upstream = UpstreamExecutor(workers=2, queue_size=10, aging=60.0, retry_after=5)
+    queue = CommandQueue(0.0, upstream)
+    slow = Mock(side_effect=lambda: time.sleep(0.05))
+
+    with pytest.raises(ValueError, match="boom"):
+        queue.submit("device", "program", "normal", [Mock(side_effect=ValueError("boom")), slow], wait=True)
+
+    slow.assert_called_once()
+
+
+def test_is_unchanged_should_regard_commands_of_same_name_without_recording_one():
+    queue = CommandQueue(10.0, skip_max_age=60.0)
+    since = time.time()
+    queue.submit("device", "program.comfort", "activate", Mock())
+
+    assert not queue.is_unchanged("device", "program.comfort", since)
+    assert queue.is_unchanged("device", "program.eco", since)
+    assert not queue.is_unchanged("device", "program.eco", since - 61.0)
+    assert queue.flush(timeout=2.0) == (1, 0)
+
+
+def test_submit_should_restart_debounce_window_on_each_submission():
+    queue = CommandQueue(0.1)
+    action = Mock()
+
+    command = queue.submit("device", "mode", 0, action)
+    for value in range(1, 4):
+        time.sleep(0.05)
+        queue.submit("device", "mode", value, action)
+    # longer ago than the debounce window since the first submission, but not since the latest one
+    assert command.status == "pending"
+
+    wait_until_executed(queue, command.id)
+    assert command.value == 3
+    action.assert_called_once()
+
+
+def test_waited_for_command_should_be_executed_after_pending_commands_of_device():
+    queue = CommandQueue(10.0)
+    executed = []
+
+    first = queue.submit("device", "first", None, lambda: executed.append("first"))
+    other = queue.submit("other", "first", None, lambda: executed.append("other"))
+    second = queue.submit("device", "second", None, lambda: executed.append("second"))
+    queue.submit("device", "waited", None, lambda: executed.append("waited"), wait=True)
+
+    assert executed == ["first", "second", "waited"]
+    assert first.status == second.status == "succeeded"
+    assert other.status == "pending"
+
+
+def test_command_should_be_charged_once_sent_to_latest_submitter():
+    queue = CommandQueue(0.05)
+    first, latest = Mock(), Mock()
+
+    command = queue.submit("device", "programs", 1, [Mock(), Mock()], charge=first)
+    queue.submit("device", "programs", 2, [Mock(), Mock()], charge=latest)
+    first.assert_not_called()
+    wait_until_executed(queue, command.id)
+
+    first.assert_not_called()
+    latest.assert_called_once_with(2)
@@ -1,149 +1,91 @@
-from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
+import threading
+from unittest.mock import Mock, patch
 
 import pytest
-from pyatv.const import Protocol
+from anyio import to_thread
 
 import app.dependencies as deps
+from app.features import DeviceSnapshot, get_snapshot
 from app.main import app
+from app.upstream_executor import UpstreamExecutor
 
-PORT = 49153
 
+def create_executor() -> UpstreamExecutor:
+    return UpstreamExecutor(workers=8, queue_size=64, aging=10.0, retry_after=5)
 
-@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
-async def test_reuse_cached_connection(dependency_mocker):
-    alive_atv = MagicMock()
-    alive_connection = deps.AppleTvConnection(alive_atv, dependency_mocker.settings.appletv_host, PORT)
-    deps._cached_appletv_connection = alive_connection
-
-    with patch("app.dependencies.connect", new_callable=AsyncMock) as patched:
-        result = await deps.get_appletv_connection(dependency_mocker.settings)
-
-    assert result == alive_connection
-    assert deps._cached_appletv_connection == alive_connection
-    patched.assert_not_called()
-
-
-@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
-async def test_reconnects_using_cached_port_after_dead_connection(dependency_mocker):
-    dead_atv = MagicMock()
-    type(dead_atv).power = PropertyMock(side_effect=Exception("Dead"))
-    deps._cached_appletv_connection = deps.AppleTvConnection(dead_atv, dependency_mocker.settings.appletv_host, PORT)
-
-    alive_atv = MagicMock()
 
-    with patch("app.dependencies.connect", new_callable=AsyncMock, return_value=alive_atv) as patched:
-        result = await deps.get_appletv_connection(dependency_mocker.settings)
+def test_refresh_device_features_fetches_devices_concurrently():
+    devices = [Mock(device_id=str(i)) for i in range(3)]
+    # every fetch blocks until all of them are running, i.e. only succeeds if fetched concurrently
+    barrier = threading.Barrier(len(devices), timeout=5)
+    for device in devices:
+        device.service.fetch_all_features.side_effect = lambda _accessor: barrier.wait()
 
-    assert result is not None
-    assert result.atv == alive_atv
-    assert result.port == PORT
-    assert deps._cached_appletv_connection is result
-    # Reconnect should only try the cached port, not scan the whole range
-    assert patched.call_count == 1
+    deps.refresh_device_features(devices, create_executor())
 
+    for device in devices:
+        device.service.fetch_all_features.assert_called_once_with(device.accessor)
 
-@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
-async def test_full_scan_finds_no_device(dependency_mocker):
-    deps._cached_appletv_connection = None
-
-    with patch(
-        "app.dependencies.connect", new_callable=AsyncMock, side_effect=ConnectionError("connection refused")
-    ) as patched:
-        result = await deps.get_appletv_connection(dependency_mocker.settings)
 
-    assert result is None
-    assert deps._cached_appletv_connection is None
-    assert patched.call_count == deps.PORT_END - deps.PORT_START + 1
+def test_refresh_device_features_continues_on_failing_device():
+    failing, working = Mock(device_id="0"), Mock(device_id="1")
+    failing.service.fetch_all_features.side_effect = ConnectionError("connection refused")
 
+    deps.refresh_device_features([failing, working], create_executor())
 
-@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
-async def test_full_scan_connects_after_trying_ports(dependency_mocker):
-    deps._cached_appletv_connection = None
+    working.service.fetch_all_features.assert_called_once_with(working.accessor)
 
-    alive_atv = MagicMock()
-    target_port = PORT  # succeeds on the second port tried in the range (PORT_START, then PORT)
 
-    def _connect_side_effect(config, _loop):
-        # Succeed only on the target port, fail (return None) for all others
-        service = next(s for s in config.services if s.protocol == Protocol.Companion)
-        return alive_atv if service.port == target_port else None
+def test_refresh_device_features_passes_snapshot_to_recorders():
+    device = Mock(device_id="0", accessor=Mock(serial="serial"))
+    device.service.fetch_all_features.return_value = {"data": []}
+    recorders = [Mock(), Mock()]
 
-    with patch("app.dependencies.connect", new_callable=AsyncMock, side_effect=_connect_side_effect) as patched:
-        result = await deps.get_appletv_connection(dependency_mocker.settings)
+    deps.refresh_device_features([device], create_executor(), recorders)
 
-    assert result is not None
-    assert result.atv == alive_atv
-    assert result.port == target_port
-    assert deps._cached_appletv_connection is result
-    # Scan starts at PORT_START; target is PORT, so PORT - PORT_START + 1 attempts
-    assert patched.call_count == target_port - deps.PORT_START + 1
+    # built once per refresh, i.e. the same snapshot backs the endpoint builders
+    snapshot = get_snapshot(device)
+    assert isinstance(snapshot, DeviceSnapshot)
+    for recorder in recorders:
+        recorder.record.assert_called_once_with("serial.0", snapshot)
 
 
-@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
-async def test_dead_cached_port_falls_back_to_full_scan(dependency_mocker):
-    dead_atv = MagicMock()
-    type(dead_atv).power = PropertyMock(side_effect=Exception("Dead"))
-    deps._cached_appletv_connection = deps.AppleTvConnection(dead_atv, dependency_mocker.settings.appletv_host, PORT)
+@pytest.mark.parametrize("dependency_mocker", [(app, {"reserved_threads": 100})], indirect=True)
+async def test_reserve_threads_grows_threadpool_beyond_upstream_limits(dependency_mocker):
+    limiter = to_thread.current_default_thread_limiter()
+    total_tokens = limiter.total_tokens
 
-    alive_atv = MagicMock()
-    target_port = PORT + 1  # cached port fails, next port in the range succeeds
+    deps.reserve_threads(dependency_mocker.settings)
 
-    def _connect_side_effect(config, _loop):
-        service = next(s for s in config.services if s.protocol == Protocol.Companion)
-        return alive_atv if service.port == target_port else None
+    assert limiter.total_tokens == 8 + 2 + 100
+    limiter.total_tokens = total_tokens
 
-    with patch("app.dependencies.connect", new_callable=AsyncMock, side_effect=_connect_side_effect) as patched:
-        result = await deps.get_appletv_connection(dependency_mocker.settings)
 
-    assert result is not None
-    assert result.atv == alive_atv
-    assert result.port == target_port
-    assert deps._cached_appletv_connection is result
-    # Cached port tried once (fails, skipped during scan), then scan tries
-    # PORT_START..target_port excluding the cached port. target_port == PORT_START+1,
-    # so the scan tries PORT_START (fail) then target_port (success) = 2 calls + 1 = 3.
-    assert patched.call_count == 1 + (target_port - deps.PORT_START + 1) - 1
-
-
-@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
-async def test_connection_timeout_returns_none(dependency_mocker):
-    deps._cached_appletv_connection = None
+@pytest.mark.parametrize("dependency_mocker", [(app, {"threadpool_size": 64})], indirect=True)
+async def test_reserve_threads_sizes_threadpool_as_configured(dependency_mocker):
+    limiter = to_thread.current_default_thread_limiter()
+    total_tokens = limiter.total_tokens
 
-    with patch("app.dependencies.connect", new_callable=AsyncMock, side_effect=TimeoutError()):
-        result = await deps.get_appletv_connection(dependency_mocker.settings)
+    deps.reserve_threads(dependency_mocker.settings)
 
-    assert result is None
-    assert deps._cached_appletv_connection is None
+    assert limiter.total_tokens == 64
+    limiter.total_tokens = total_tokens
 
 
 @pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
-async def test_failed_scan_is_cooldown_cached(dependency_mocker):
-    deps._cached_appletv_connection = None
-    deps._last_scan_failed_at = None
-
-    with patch(
-        "app.dependencies.connect",
-        new_callable=AsyncMock,
-        side_effect=ConnectionError("connection refused"),
-    ) as patched:
-        first = await deps.get_appletv_connection(dependency_mocker.settings)
-        second = await deps.get_appletv_connection(dependency_mocker.settings)
-
-    assert first is None
-    assert second is None
-    # First call scans the whole range; second call is within cooldown and must not scan at all
-    assert patched.call_count == deps.PORT_END - deps.PORT_START + 1
-    assert deps._last_scan_failed_at is not None
-
-
-@pytest.mark.parametrize("dependency_mocker", [[app, {"appletv_companion_credentials": "my_secret"}]], indirect=True)
-async def test_connect_passes_credentials_from_settings(dependency_mocker):
-    deps._cached_appletv_connection = None
-
-    with patch("app.dependencies.connect", new_callable=AsyncMock, return_value=None) as patched:
-        await deps.get_appletv_connection(dependency_mocker.settings)
-
-    for call in patched.call_args_list:
-        config = call.args[0]
-        service = next(s for s in config.services if s.protocol == Protocol.Companion)
-        assert service.credentials == "my_secret"
+async def test_warm_up_logs_in_and_only_logs_failures(dependency_mocker):
+    settings = dependency_mocker.settings
+    vicare = Mock()
+
+    def _login(settings):
+        deps._logged_in[settings] = vicare
+        return vicare
+
+    with patch("app.dependencies.get_vicare", side_effect=RuntimeError("login failed")):
+        await deps.warm_up(settings)
+    assert deps.get_logged_in_vicare(settings) is None
+
+    with patch("app.dependencies.get_vicare", side_effect=_login):
+        await deps.warm_up(settings)
+    assert deps.get_logged_in_vicare(settings) is vicare
+    deps._logged_in.pop(settings)
@@ -0,0 +1,156 @@
+import pytest
+import PyViCare.PyViCareAbstractOAuthManager
+import PyViCare.PyViCareOAuthManager
+from fastapi.testclient import TestClient
+from PyViCare.PyViCareUtils import (
+    PyViCareInvalidCredentialsError,
+    PyViCareRateLimitError,
+)
+
+from app import dependencies
+from app.fake_vicare import (
+    FakeDevice,
+    FakeViCare,
+    FakeViCareConfig,
+    create_app,
+    running,
+)
+from app.main import app
+from app.settings import Settings
+from tests.recorded_devices import load_resource
+
+FEATURES_URL = "/iot/v2/features/installations/1234567/gateways/7633107093013212/devices/0/features/"
+MODE_COMMAND_URL = f"{FEATURES_URL}heating.circuits.0.operating.modes.active/commands/setMode"
+
+
+@pytest.fixture
+def fake() -> FakeViCare:
+    device = FakeDevice.from_features(load_resource("heatpump_features.json"))
+    return FakeViCare([device], email="fake@example.com", password="secret", seed=42)
+
+
+@pytest.fixture
+def fake_client(fake) -> TestClient:
+    client = TestClient(create_app(fake))
+    client.headers["Authorization"] = f"Bearer {fake.issue_token()['access_token']}"
+    return client
+
+
+@pytest.fixture
+def vicare_settings(monkeypatch, fake) -> Settings:
+    """Settings of a server using `fake` running on localhost, restoring PyViCare's URLs afterwards."""
+    for module, name in (
+        (PyViCare.PyViCareAbstractOAuthManager, "API_BASE_URL"),
+        (PyViCare.PyViCareOAuthManager, "AUTHORIZE_URL"),
+        (PyViCare.PyViCareOAuthManager, "TOKEN_URL"),
+    ):
+        monkeypatch.setattr(module, name, getattr(module, name))
+    with running(create_app(fake)) as base_url:
+        yield Settings(
+            client_id="client",
+            email="fake@example.com",
+            password="secret",
+            appletv_enabled=False,
+            vicare_base_url=base_url,
+        )
+
+
+def test_device_is_created_from_features():
+    device = FakeDevice.from_features(load_resource("heatpump_features.json"))
+
+    assert (device.installation_id, device.gateway_serial, device.device_id) == (1234567, "7633107093013212", "0")
+    assert "heating.compressors.0" in device.features
+
+
+def test_api_calls_require_valid_token(fake, fake_client):
+    response = fake_client.get(FEATURES_URL, headers={"Authorization": "Bearer unknown"})
+
+    assert response.status_code == 401
+    assert response.json() == {"error": "EXPIRED TOKEN"}
+    assert fake.stats["expiredTokens"] == 1
+
+
+def test_commands_update_features(fake_client):
+    response = fake_client.post(MODE_COMMAND_URL, json={"mode": "standby"})
+
+    assert response.status_code == 200
+    features = {f["feature"]: f for f in fake_client.get(FEATURES_URL).json()["data"]}
+    assert features["heating.circuits.0.operating.modes.active"]["properties"]["value"]["value"] == "standby"
+
+
+def test_unknown_commands_are_rejected(fake_client):
+    response = fake_client.post(f"{FEATURES_URL}heating.compressors.0/commands/explode", json={})
+
+    assert response.status_code == 400
+    assert response.json()["errorType"] == "INVALID_COMMAND"
+
+
+def test_quota_is_enforced(fake, fake_client):
+    fake_client.put("/fake/config", json={"quota": 2, "quotaWindow": 60})
+
+    status_codes = [fake_client.get(FEATURES_URL).status_code for _ in range(3)]
+
+    assert status_codes == [200, 200, 429]
+    assert fake_client.get(FEATURES_URL).json()["extendedPayload"]["requestCountLimit"] == 2
+    assert fake.stats["rateLimited"] == 2
+
+
+@pytest.mark.parametrize(
+    "config, status_code",
+    [
+        ({"rateLimitRate": 1}, 429),
+        ({"serverErrorRate": 1}, 500),
+        ({"timeoutRate": 1, "timeoutDelay": 0}, 504),
+    ],
+)
+def test_errors_are_injected(fake_client, config: dict, status_code: int):
+    fake_client.put("/fake/config", json=config)
+
+    assert fake_client.get(FEATURES_URL).status_code == status_code
+
+
+def test_config_is_validated(fake_client):
+    assert fake_client.put("/fake/config", json={"serverErrorRate": 2}).status_code == 422
+
+
+def test_server_runs_against_fake(fake, vicare_settings):
+    app.dependency_overrides[dependencies.get_settings] = lambda: vicare_settings
+    app.dependency_overrides[dependencies.get_vicare] = lambda: dependencies.get_vicare(settings=vicare_settings)
+    try:
+        client = TestClient(app)
+        circuit = client.get("/heating/circuit")
+        mode = client.put("/heating/circuit/mode/standby", params={"wait": True})
+    finally:
+        app.dependency_overrides.clear()
+        dependencies.get_vicare.cache_clear()
+
+    assert circuit.status_code == 200
+    assert circuit.json()["mode"] == "dhwAndHeating"
+    assert mode.status_code == 204
+    assert fake.stats["tokens"] == 1
+    assert fake.stats["commands"] == 1
+
+
+def test_pyvicare_logs_in_again_if_tokens_are_revoked(fake, vicare_settings):
+    vicare = dependencies.get_vicare.__wrapped__(vicare_settings)
+    fake.revoke_tokens()
+
+    vicare.devices[0].service.clear_cache()
+    vicare.devices[0].service.fetch_all_features(vicare.devices[0].accessor)
+
+    assert fake.stats["tokens"] == 2
+    assert fake.stats["expiredTokens"] == 1
+
+
+def test_pyvicare_raises_rate_limit_errors(fake, vicare_settings):
+    vicare = dependencies.get_vicare.__wrapped__(vicare_settings)
+    fake.config = FakeViCareConfig(quota=0)
+
+    vicare.devices[0].service.clear_cache()
+    with pytest.raises(PyViCareRateLimitError):
+        vicare.devices[0].service.fetch_all_features(vicare.devices[0].accessor)
+
+
+def test_pyvicare_login_fails_for_wrong_credentials(vicare_settings):
+    with pytest.raises(PyViCareInvalidCredentialsError):
+        dependencies.get_vicare.__wrapped__(vicare_settings.model_copy(update={"password": "wrong"}))
@@ -0,0 +1,163 @@
+from datetime import timedelta
+from unittest.mock import Mock
+
+import pytest
+from PyViCare.PyViCareUtils import (
+    PyViCareCommandError,
+    PyViCareInternalServerError,
+    PyViCareNotSupportedFeatureError,
+)
+
+from app.features import (
+    DeviceSnapshot,
+    constraint,
+    get_cached_snapshot,
+    get_snapshot,
+    properties,
+    unit,
+    validate_command,
+    value,
+)
+from tests.recorded_devices import load_resource, recorded_device_config
+
+
+def test_snapshot_reduces_properties_to_values():
+    snapshot = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+
+    assert value(snapshot.features, "heating.dhw.temperature.main") == 48
+    assert properties(snapshot.features, "heating.circuits")["enabled"] == ("0",)
+    assert snapshot.features["heating.dhw.temperature.main"].timestamp is not None
+    with pytest.raises(PyViCareNotSupportedFeatureError):
+        value(snapshot.features, "heating.dhw.temperature.main", "missing")
+    with pytest.raises(PyViCareNotSupportedFeatureError):
+        properties(snapshot.features, "missing")
+
+
+def test_snapshots_share_interned_strings():
+    first = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+    second = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+
+    [first_key] = first.features["heating.dhw.temperature.main"].properties
+    [second_key] = second.features["heating.dhw.temperature.main"].properties
+    assert first_key is second_key
+    assert value(first.features, "heating.circuits.0.operating.modes.active") is value(
+        second.features, "heating.circuits.0.operating.modes.active"
+    )
+
+
+def test_below_finds_features_by_prefix():
+    snapshot = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+
+    features = snapshot.below("heating.circuits.0.")
+
+    assert "heating.curve" in features
+    assert all(feature.name.startswith("heating.circuits.0.") for feature in features.values())
+    assert len(snapshot.below("")) == len(snapshot)
+
+
+def test_snapshot_keeps_units_and_constraints():
+    snapshot = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+
+    assert unit(snapshot.features, "heating.dhw.temperature.main") == "celsius"
+    assert constraint(snapshot, DHW, "setTargetTemperature", "temperature", "max") == 60
+    with pytest.raises(PyViCareNotSupportedFeatureError):
+        unit(snapshot.features, "heating.circuits")
+    with pytest.raises(PyViCareNotSupportedFeatureError):
+        constraint(snapshot, DHW, "setTargetTemperature", "temperature", "missing")
+
+
+def test_snapshot_is_rebuilt_for_new_payloads_only():
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"]).asGeneric()
+
+    snapshot = get_snapshot(device)
+    assert get_snapshot(device) is snapshot
+
+    # the next fetch caches a new payload
+    device.service.clear_cache()
+    assert get_snapshot(device) is not snapshot
+    assert get_cached_snapshot(device) is not snapshot
+
+
+def test_snapshot_is_kept_if_stale_payload_is_served_again():
+    device = recorded_device_config("heatpump_features.json", ["type:heatpump"]).asGeneric()
+    snapshot = get_snapshot(device)
+    assert snapshot.created_at == device.service._cacheTime.timestamp()
+
+    # expired, and the next fetch fails, so PyViCare serves the stale payload again under a new cache time
+    device.service._cacheTime -= timedelta(minutes=5)
+    device.service.oauth_manager = Mock(
+        get=Mock(side_effect=PyViCareInternalServerError({"statusCode": 500, "message": "error", "viErrorId": "n/a"}))
+    )
+
+    assert get_snapshot(device) is snapshot
+    assert device.service.oauth_manager.get.call_count == 1
+    assert snapshot.created_at < device.service._cacheTime.timestamp()
+
+
+def test_snapshot_keeps_command_metadata():
+    snapshot = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+
+    command = snapshot.commands["heating.dhw.temperature.main"]["setTargetTemperature"]
+    assert command.executable
+    assert command.params["temperature"] == {
+        "type": "number",
+        "required": True,
+        "efficientLowerBorder": 10,
+        "efficientUpperBorder": 60,
+        "max": 60,
+        "min": 10,
+        "stepping": 1,
+    }
+    # of features without properties, too
+    assert "heating.circuits.0.operating.programs.normal" in snapshot.commands
+
+
+MODE = "heating.circuits.0.operating.modes.active"
+DHW = "heating.dhw.temperature.main"
+
+
+@pytest.mark.parametrize(
+    "feature, command, params",
+    [
+        (MODE, "setMode", {"mode": "standby"}),
+        (DHW, "setTargetTemperature", {"temperature": 60}),
+        ("heating.circuits.0.operating.programs.comfort", "activate", {}),
+        ("heating.dhw.oneTimeCharge", "deactivate", {}),
+    ],
+)
+def test_valid_commands_pass(feature: str, command: str, params: dict):
+    snapshot = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+
+    validate_command(snapshot, feature, command, params)
+
+
+@pytest.mark.parametrize(
+    "feature, command, params, error, message",
+    [
+        ("heating.missing", "activate", {}, PyViCareNotSupportedFeatureError, ""),
+        (MODE, "activate", {}, PyViCareNotSupportedFeatureError, ""),
+        (MODE, "setMode", {"mode": "heating"}, PyViCareCommandError, "is not one of"),
+        (MODE, "setMode", {}, PyViCareCommandError, "Missing parameter mode"),
+        (MODE, "setMode", {"mode": "standby", "level": 1}, PyViCareCommandError, "Unknown parameters"),
+        (DHW, "setTargetTemperature", {"temperature": 61}, PyViCareCommandError, "is above 60"),
+        (DHW, "setTargetTemperature", {"temperature": 9}, PyViCareCommandError, "is below 10"),
+        (DHW, "setTargetTemperature", {"temperature": 48.5}, PyViCareCommandError, "is not a multiple of 1"),
+        (DHW, "setTargetTemperature", {"temperature": "48"}, PyViCareCommandError, "is not a number"),
+    ],
+)
+def test_invalid_commands_are_rejected(feature: str, command: str, params: dict, error: type, message: str):
+    snapshot = DeviceSnapshot.from_payload(load_resource("heatpump_features.json"))
+
+    with pytest.raises(error) as e:
+        validate_command(snapshot, feature, command, params)
+    assert message in str(e.value)
+
+
+def test_commands_not_executable_are_rejected():
+    payload = load_resource("heatpump_features.json")
+    charge = next(f for f in payload["data"] if f["feature"] == "heating.dhw.oneTimeCharge")
+    charge["commands"]["activate"]["isExecutable"] = False
+    snapshot = DeviceSnapshot.from_payload(payload)
+
+    with pytest.raises(PyViCareCommandError, match="not executable"):
+        validate_command(snapshot, "heating.dhw.oneTimeCharge", "activate", {})
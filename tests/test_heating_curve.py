@@ -0,0 +1,31 @@
+import pytest
+from PyViCare.PyViCareHeatCurveCalculation import (
+    heat_curve_formular_variant1,
+    heat_curve_formular_variant2,
+)
+
+from app.heating_curve import evaluate, outside_temperatures
+
+
+def test_outside_temperatures_include_end():
+    assert outside_temperatures(-1, 1, 0.5) == (-1, -0.5, 0, 0.5, 1)
+    assert outside_temperatures(0, 1, 0.3) == (0, 0.3, 0.6, 0.9)
+
+
+@pytest.mark.parametrize("formular", [heat_curve_formular_variant1, heat_curve_formular_variant2])
+@pytest.mark.parametrize("shift, slope", [(0, 1.4), (-5, 0.6), (10, 2.2)])
+def test_evaluate_matches_formular(formular, shift: float, slope: float):
+    outside = outside_temperatures(-20, 20, 0.5)
+
+    supply = evaluate(formular, 20, -20, 20, 0.5, shift, slope, 10, 60)
+
+    assert supply == tuple(
+        float(round(max(10, min(formular(temperature - 20, 20, shift, slope), 60)), 1)) for temperature in outside
+    )
+
+
+def test_evaluate_is_cached_per_curve():
+    first = evaluate(heat_curve_formular_variant1, 20, -20, 20, 1, 0, 1.4, 10, 60)
+
+    assert evaluate(heat_curve_formular_variant1, 20, -20, 20, 1, 0, 1.4, 10, 60) is first
+    assert evaluate(heat_curve_formular_variant1, 20, -20, 20, 1, 1, 1.4, 10, 60) is not first
@@ -0,0 +1,130 @@
+import copy
+
+import pytest
+
+from app.features import DeviceSnapshot
+from app.heatpump_stats import MAX_SAMPLE_GAP, HeatPumpStats, SlidingWindow
+from tests.recorded_devices import load_resource
+
+COMPRESSOR = "heating.compressors.0"
+STATISTICS = "heating.compressors.0.statistics"
+SUPPLY = "heating.secondaryCircuit.sensors.temperature.supply"
+RETURN = "heating.sensors.temperature.return"
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def sample(active: bool, starts: int, hours: float = 8254.3, supply: float = 35.0, ret: float = 30.0) -> DeviceSnapshot:
+    payload = copy.deepcopy(load_resource("heatpump_features.json"))
+    features = {feature["feature"]: feature for feature in payload["data"]}
+    features[COMPRESSOR]["properties"]["active"]["value"] = active
+    features[STATISTICS]["properties"]["starts"]["value"] = starts
+    features[STATISTICS]["properties"]["hours"]["value"] = hours
+    features[SUPPLY]["properties"]["value"]["value"] = supply
+    features[RETURN]["properties"]["value"]["value"] = ret
+    return DeviceSnapshot.from_payload(payload)
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def stats(clock) -> HeatPumpStats:
+    return HeatPumpStats(short_cycle_runtime=600, short_cycle_starts_per_hour=3, clock=clock)
+
+
+def test_sliding_window_expires_old_buckets():
+    window = SlidingWindow(60, buckets=6)
+    window.add(0, [1.0, 0, 0, 0, 0])
+    window.add(30, [2.0, 0, 0, 0, 0])
+
+    assert window.totals(59)[0] == 3.0
+    assert window.totals(65)[0] == 2.0
+    assert window.totals(1000)[0] == 0.0
+
+
+def test_stats_are_empty_without_samples(stats):
+    windows = stats.get_stats("device", "0")
+
+    assert list(windows) == ["1h", "24h", "7d"]
+    assert windows["1h"] == {
+        "observed": 0.0,
+        "duty_cycle": None,
+        "starts": 0,
+        "starts_per_hour": None,
+        "average_runtime": None,
+        "supply_return_spread": None,
+        "short_cycling": False,
+    }
+
+
+def test_stats_are_derived_from_samples(stats, clock):
+    # 20 minutes running with a spread of 5 K, then 40 minutes off
+    stats.record("device", sample(active=True, starts=100))
+    clock.now += 600
+    stats.record("device", sample(active=True, starts=100))
+    clock.now += 600
+    stats.record("device", sample(active=False, starts=100, supply=30))
+    for _ in range(4):
+        clock.now += 600
+        stats.record("device", sample(active=False, starts=101, supply=30))
+
+    windows = stats.get_stats("device", "0")
+
+    assert windows["1h"]["observed"] == 3600
+    assert windows["1h"]["duty_cycle"] == pytest.approx(1 / 3, abs=1e-3)
+    assert windows["1h"]["starts"] == 1
+    assert windows["1h"]["starts_per_hour"] == 1
+    assert windows["1h"]["average_runtime"] == 1200
+    assert windows["1h"]["supply_return_spread"] == 5
+    assert windows["1h"]["short_cycling"] is False
+    assert windows["24h"] == windows["1h"]
+
+
+def test_runtime_is_taken_from_hours_counter_across_gaps(stats, clock):
+    stats.record("device", sample(active=False, starts=100, hours=8000))
+    clock.now += 2 * MAX_SAMPLE_GAP
+    stats.record("device", sample(active=False, starts=102, hours=8000.25))
+
+    windows = stats.get_stats("device", "0")
+
+    assert windows["1h"]["duty_cycle"] == pytest.approx(900 / (2 * MAX_SAMPLE_GAP))
+    assert windows["1h"]["average_runtime"] == 450
+
+
+def test_short_cycling_is_detected(stats, clock):
+    stats.record("device", sample(active=False, starts=100))
+    for starts in range(101, 107):
+        clock.now += 300
+        stats.record("device", sample(active=starts % 2 == 0, starts=starts))
+
+    assert stats.get_stats("device", "0")["1h"]["short_cycling"] is True
+
+
+def test_windows_slide(stats, clock):
+    stats.record("device", sample(active=True, starts=100))
+    clock.now += 600
+    stats.record("device", sample(active=True, starts=101))
+    clock.now += 2 * 3600
+
+    windows = stats.get_stats("device", "0")
+
+    assert windows["1h"]["observed"] == 0
+    assert windows["24h"]["starts"] == 1
+
+
+def test_same_snapshot_is_sampled_once(stats, clock):
+    snapshot = sample(active=True, starts=100)
+    stats.record("device", snapshot)
+    clock.now += 600
+    stats.record("device", snapshot)
+
+    assert stats.get_stats("device", "0")["1h"]["observed"] == 0
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import threading
+import time
+
+from anyio import to_thread
+
+from app.loop_monitor import LoopMonitor
+
+
+def block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+async def test_blocked_loop_is_measured_and_logged(caplog):
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.05, sample_stacks=False)
+    monitor.start()
+
+    await asyncio.sleep(0.03)
+    with caplog.at_level(logging.WARNING, logger="app.loop_monitor"):
+        block_the_loop(0.1)
+        await asyncio.sleep(0.03)
+    await monitor.stop()
+
+    metrics = monitor.get_metrics()
+    assert metrics["blocked"] == 1
+    assert metrics["lag_max_ms"] >= 50
+    assert metrics["lag_avg_ms"] < metrics["lag_max_ms"]
+    assert metrics["tasks"] >= 2
+    assert "Event loop was blocked for" in caplog.text
+    # no stack sampled unless enabled
+    assert "block_the_loop" not in caplog.text
+
+
+async def test_stack_of_blocking_code_is_sampled(caplog):
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.02, sample_stacks=True)
+    monitor.start()
+
+    await asyncio.sleep(0.03)
+    with caplog.at_level(logging.WARNING, logger="app.loop_monitor"):
+        block_the_loop(0.2)
+        await asyncio.sleep(0.03)
+    await monitor.stop()
+
+    stacks = [record.getMessage() for record in caplog.records if "more than" in record.getMessage()]
+    # once per block
+    assert len(stacks) == 1
+    assert "in block_the_loop" in stacks[0]
+
+
+async def test_threadpool_saturation_is_sampled():
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.1, sample_stacks=False)
+    release = threading.Event()
+    limiter = to_thread.current_default_thread_limiter()
+    busy = [asyncio.create_task(to_thread.run_sync(release.wait)) for _ in range(2)]
+    monitor.start()
+
+    await asyncio.sleep(0.05)
+    metrics = monitor.get_metrics()
+    release.set()
+    await asyncio.gather(*busy)
+    await monitor.stop()
+
+    assert metrics["threadpool_size"] == limiter.total_tokens
+    assert metrics["threadpool_active"] == 2
+    assert metrics["threadpool_waiting"] == 0
@@ -1,12 +1,26 @@
+from unittest.mock import Mock
+
+import pytest
 from fastapi.testclient import TestClient
+from PyViCare.PyViCareUtils import PyViCareInternalServerError
+from starlette import status
 
+from app.admission import AdmissionController
 from app.api.appletv import ROUTE_PREFIX_APPLETV
 from app.api.circuit import ROUTE_PREFIX_HEATING_CIRCUIT
 from app.api.dhw import ROUTE_PREFIX_HEATING_DHW
 from app.api.health import ROUTE_PREFIX_HEALTH
 from app.api.heatpump import ROUTE_PREFIX_HEATING_HEATPUMP
 from app.api.ventilation import ROUTE_PREFIX_VENTILATION
+from app.dependencies import (
+    get_rate_limiter,
+    get_upstream_circuit_breaker,
+    get_vicare_admission,
+)
 from app.main import app
+from app.rate_limiting import RateLimiter
+from app.upstream import UpstreamUnavailableError
+from tests.recorded_devices import payload_device_config
 
 client = TestClient(app)
 
@@ -39,3 +53,76 @@ def test_app_should_have_ventilation_route():
 def test_app_should_have_appletv_route():
     routes = [r for r in app.openapi()["paths"] if r.startswith(ROUTE_PREFIX_APPLETV)]
     assert len(routes) > 0
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_app_should_respond_503_with_retry_after_while_circuit_breaker_is_open(dependency_mocker):
+    error = PyViCareInternalServerError({"statusCode": 0, "message": "unavailable", "viErrorId": "n/a"})
+    error.__cause__ = UpstreamUnavailableError(12.3)
+    dependency_mocker.vicare.devices = [
+        Mock(service=Mock(roles=["type:ventilation"]), asVentilation=Mock(side_effect=error))
+    ]
+
+    response = client.get(ROUTE_PREFIX_VENTILATION)
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "13"
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_app_should_respond_503_with_retry_after_while_circuit_breaker_is_open_for_replayed_errors(dependency_mocker):
+    breaker = get_upstream_circuit_breaker(settings=dependency_mocker.settings)
+    for _ in range(5):
+        breaker.record_failure()
+
+    def rejected(_url):
+        raise PyViCareInternalServerError(
+            {"statusCode": 0, "message": "unavailable", "viErrorId": "n/a"}
+        ) from UpstreamUnavailableError(30)
+
+    device = payload_device_config({}, ["type:ventilation"], device_type="ventilation")
+    device.service.oauth_manager = Mock(get=Mock(side_effect=rejected))
+    dependency_mocker.vicare.devices = [device]
+
+    try:
+        # the first read fetches and fails, the second replays PyViCare's cached error without cause
+        responses = [client.get(ROUTE_PREFIX_VENTILATION) for _ in range(2)]
+    finally:
+        breaker.reset()
+
+    assert device.service.oauth_manager.get.call_count == 1
+    for response in responses:
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == "30"
+
+
+@pytest.mark.parametrize("dependency_mocker", [app], indirect=True)
+def test_app_should_respond_503_with_retry_after_if_request_is_shed(dependency_mocker):
+    controller = AdmissionController("ViCare API", limit=0, queue_size=0, retry_after=5)
+    app.dependency_overrides[get_vicare_admission] = lambda: controller
+
+    try:
+        response = client.get(ROUTE_PREFIX_VENTILATION)
+    finally:
+        del app.dependency_overrides[get_vicare_admission]
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "5"
+    assert controller.get_metrics()["shed"] == 1
+
+
+@pytest.mark.parametrize("dependency_mocker", [(app, {"rate_limit_enabled": True})], indirect=True)
+def test_app_should_respond_429_with_retry_after_if_client_exceeds_its_budget(dependency_mocker):
+    limiter = RateLimiter(rate=0.5, burst=1, upstream_rate=0.1, upstream_burst=1, max_clients=10)
+    app.dependency_overrides[get_rate_limiter] = lambda: limiter
+
+    try:
+        first = client.get(ROUTE_PREFIX_HEALTH)
+        second = client.get(ROUTE_PREFIX_HEALTH)
+    finally:
+        del app.dependency_overrides[get_rate_limiter]
+
+    assert first.status_code == status.HTTP_200_OK
+    assert first.json()["rate_limits"]["top_clients"][0]["client"] == "ip:testclient"
+    assert second.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert second.headers["Retry-After"] == "2"
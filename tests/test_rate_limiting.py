@@ -0,0 +1,88 @@
+import pytest
+
+from app.rate_limiting import RateLimitedError, RateLimiter, get_client_key
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def create_limiter(clock: FakeClock, max_clients: int = 10) -> RateLimiter:
+    return RateLimiter(rate=1.0, burst=2, upstream_rate=0.1, upstream_burst=1, max_clients=max_clients, clock=clock)
+
+
+def test_requests_are_limited_per_client_until_refilled(clock):
+    limiter = create_limiter(clock)
+    limiter.acquire("a")
+    limiter.acquire("a")
+
+    with pytest.raises(RateLimitedError) as error:
+        limiter.acquire("a")
+    assert error.value.retry_after == 1
+    limiter.acquire("b")
+
+    clock.now += 1
+    limiter.acquire("a")
+
+
+def test_requests_are_limited_once_upstream_budget_is_in_debt(clock):
+    limiter = create_limiter(clock)
+    limiter.acquire("a")
+    limiter.charge("a", upstream_calls=2)
+
+    with pytest.raises(RateLimitedError) as error:
+        limiter.acquire("a")
+    assert error.value.budget == "upstream calls"
+    assert error.value.retry_after == 10
+
+    clock.now += 10
+    limiter.acquire("a")
+
+
+def test_least_recently_seen_clients_are_evicted(clock):
+    limiter = create_limiter(clock, max_clients=2)
+    for client in ("a", "b", "a", "c"):
+        limiter.acquire(client)
+
+    metrics = limiter.get_metrics()
+
+    assert metrics["clients"] == 2
+    assert metrics["evicted"] == 1
+    assert {usage["client"] for usage in metrics["top_clients"]} == {"a", "c"}
+
+
+def test_metrics_report_usage_per_client(clock):
+    limiter = create_limiter(clock)
+    limiter.acquire("a")
+    limiter.charge("a", upstream_calls=2)
+    with pytest.raises(RateLimitedError):
+        limiter.acquire("a")
+    limiter.acquire("b")
+
+    metrics = limiter.get_metrics()
+
+    assert metrics["limited"] == 1
+    assert metrics["top_clients"][0] == {
+        "client": "a",
+        "requests": 1,
+        "upstream_calls": 2,
+        "limited": 1,
+        "tokens": 1.0,
+        "upstream_tokens": -1.0,
+    }
+
+
+def test_client_key_prefers_hashed_header_over_ip():
+    assert get_client_key("10.0.0.1", None) == "ip:10.0.0.1"
+    assert get_client_key("10.0.0.1", "secret").startswith("key:")
+    assert "secret" not in get_client_key("10.0.0.1", "secret")
+    assert get_client_key("10.0.0.2", "secret") == get_client_key("10.0.0.1", "secret")
@@ -1,9 +1,17 @@
+from unittest.mock import patch
+
 import pytest
 from fastapi import FastAPI, HTTPException
 from fastapi.testclient import TestClient
 from starlette import status
 
-from app.request_tracking import RequestTracker, RequestTrackingMiddleware
+from app.request_tracking import (
+    MAX_ROLLING_ROUTES,
+    OTHER_ROUTES,
+    UNMATCHED_ROUTE,
+    RequestTracker,
+    RequestTrackingMiddleware,
+)
 
 
 @pytest.fixture
@@ -22,6 +30,10 @@ def tracker_app():
     def fail_http():
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Bad credentials")
 
+    @test_app.get("/commands/{command_id}")
+    def get_command(command_id: str):
+        return {"commandId": command_id}
+
     @test_app.get("/health")
     def health():
         return {"status": "UP"}
@@ -103,3 +115,71 @@ def test_middleware_multiple_requests_accumulate(tracker_app):
     assert stats["overall"]["success"] == 3
     assert stats["overall"]["failure"] == 0
     assert stats["by_endpoint"]["/ok"][status.HTTP_200_OK] == 3
+
+
+def test_rolling_statistics_expire_with_their_window():
+    tracker = RequestTracker()
+    now = 1_000_000.0
+    with patch("app.request_tracking.time.time", return_value=now - 30 * 60):
+        tracker.record_request("/ok", status.HTTP_200_OK, "n/a")
+    with patch("app.request_tracking.time.time", return_value=now - 2 * 60):
+        tracker.record_request("/ok", status.HTTP_500_INTERNAL_SERVER_ERROR, "Server error")
+    with patch("app.request_tracking.time.time", return_value=now):
+        tracker.record_request("/ok", status.HTTP_200_OK, "n/a")
+        tracker.record_request("/other", status.HTTP_200_OK, "n/a")
+        stats = tracker.get_rolling_statistics()
+
+    assert stats["1m"]["overall"] == {"requests": 2, "failures": 0, "error_rate": 0.0}
+    assert stats["5m"]["by_endpoint"]["/ok"] == {"requests": 2, "failures": 1, "error_rate": 0.5}
+    assert stats["1h"]["by_endpoint"]["/ok"]["requests"] == 3
+    assert stats["24h"]["overall"]["requests"] == 4
+
+    with patch("app.request_tracking.time.time", return_value=now + 25 * 3600):
+        assert tracker.get_rolling_statistics()["24h"] == {
+            "overall": {"requests": 0, "failures": 0, "error_rate": 0.0},
+            "by_endpoint": {},
+        }
+
+
+def test_rolling_statistics_reuse_buckets_of_expired_time_slots():
+    tracker = RequestTracker()
+    now = 1_000_000.0
+    for minute in range(3 * 60):
+        with patch("app.request_tracking.time.time", return_value=now + minute * 60):
+            tracker.record_request("/ok", status.HTTP_200_OK, "n/a")
+    # older than the hour window, i.e. its bucket counts a later time slot already, but within the day window
+    with patch("app.request_tracking.time.time", return_value=now):
+        tracker.record_request("/ok", status.HTTP_500_INTERNAL_SERVER_ERROR, "Server error")
+
+    with patch("app.request_tracking.time.time", return_value=now + (3 * 60 - 1) * 60):
+        stats = tracker.get_rolling_statistics()
+
+    assert stats["1h"]["overall"] == {"requests": 60, "failures": 0, "error_rate": 0.0}
+    assert stats["24h"]["overall"]["requests"] == 3 * 60 + 1
+    assert stats["24h"]["overall"]["failures"] == 1
+
+
+def test_middleware_keeps_rolling_statistics_by_route(tracker_app):
+    test_app, tracker = tracker_app
+    client = TestClient(test_app)
+
+    client.get("/commands/1")
+    client.get("/commands/2")
+    client.get("/unknown")
+
+    by_route = tracker.get_rolling_statistics()["1m"]["by_endpoint"]
+    assert by_route["/commands/{command_id}"]["requests"] == 2
+    assert by_route[UNMATCHED_ROUTE] == {"requests": 1, "failures": 1, "error_rate": 1.0}
+    # requests not matching any route don't count towards the overall error rate
+    assert tracker.get_rolling_statistics()["1m"]["overall"] == {"requests": 2, "failures": 0, "error_rate": 0.0}
+
+
+def test_rolling_statistics_of_routes_beyond_limit_are_counted_together():
+    tracker = RequestTracker()
+
+    for i in range(MAX_ROLLING_ROUTES + 2):
+        tracker.record_request(f"/route{i}", status.HTTP_200_OK, "n/a")
+
+    by_route = tracker.get_rolling_statistics()["1m"]["by_endpoint"]
+    assert len(by_route) == MAX_ROLLING_ROUTES + 1
+    assert by_route[OTHER_ROUTES]["requests"] == 2
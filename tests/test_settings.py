@@ -4,8 +4,9 @@ from ipaddress import IPv4Address
 from pathlib import Path
 
 import pytest
+from pydantic import ValidationError
 
-from app.settings import Settings
+from app.settings import Settings, get_appletv_devices
 
 
 @pytest.fixture
@@ -166,3 +167,50 @@ def prepare_env_variables(
     os.environ["APPLETV_HOST"] = appletv_host
     os.environ["APPLETV_COMPANION_IDENTIFIER"] = appletv_companion_identifier
     os.environ["APPLETV_COMPANION_CREDENTIALS"] = appletv_companion_credentials
+
+
+def test_appletv_settings_are_required_if_enabled(change_test_dir, monkeypatch) -> None:
+    prepare_env_variables("client", "test@example.com", "123456", "192.168.1.100", "id", "creds")
+    monkeypatch.delenv("APPLETV_HOST")
+
+    with pytest.raises(ValidationError, match="Apple TV host"):
+        Settings()
+
+
+def test_appletv_settings_are_optional_if_disabled(change_test_dir, monkeypatch) -> None:
+    prepare_env_variables("client", "test@example.com", "123456", "192.168.1.100", "id", "creds")
+    for name in ("APPLETV_HOST", "APPLETV_COMPANION_IDENTIFIER", "APPLETV_COMPANION_CREDENTIALS"):
+        monkeypatch.delenv(name)
+    monkeypatch.setenv("APPLETV_ENABLED", "false")
+
+    settings = Settings()
+
+    assert not settings.appletv_enabled
+    assert settings.appletv_host is None
+    assert hash(settings) == hash(Settings())
+
+
+def test_appletv_devices_are_configured_by_name(change_test_dir, monkeypatch) -> None:
+    prepare_env_variables("client", "test@example.com", "123456", "192.168.1.100", "id", "creds")
+    monkeypatch.setenv(
+        "APPLETV_DEVICES",
+        '{"bedroom": {"host": "192.168.1.101", "companion_identifier": "id2", "companion_credentials": "creds2"}}',
+    )
+
+    devices = get_appletv_devices(Settings())
+
+    assert devices.keys() == {"default", "bedroom"}
+    assert devices["default"].host == IPv4Address("192.168.1.100")
+    assert devices["bedroom"].companion_identifier == "id2"
+
+
+def test_appletv_devices_replace_default_one(change_test_dir, monkeypatch) -> None:
+    prepare_env_variables("client", "test@example.com", "123456", "192.168.1.100", "id", "creds")
+    for name in ("APPLETV_HOST", "APPLETV_COMPANION_IDENTIFIER", "APPLETV_COMPANION_CREDENTIALS"):
+        monkeypatch.delenv(name)
+    monkeypatch.setenv(
+        "APPLETV_DEVICES",
+        '{"bedroom": {"host": "192.168.1.101", "companion_identifier": "id2", "companion_credentials": "creds2"}}',
+    )
+
+    assert get_appletv_devices(Settings()).keys() == {"bedroom"}
@@ -0,0 +1,44 @@
+import copy
+from unittest.mock import Mock
+
+import app.dependencies as deps
+from app.features import DeviceSnapshot
+from app.settings import Settings
+from app.shutdown import load_state
+from tests.recorded_devices import load_resource
+from tests.test_changes import DHW_TEMPERATURE, set_value
+
+
+def test_load_state_ignores_missing_and_corrupt_files(tmp_path):
+    state_file = tmp_path / "vicare.state"
+    assert load_state(str(state_file)) is None
+
+    state_file.write_bytes(b"corrupt")
+    assert load_state(str(state_file)) is None
+
+
+async def test_shutdown_flushes_commands_and_persists_state_to_be_restored(tmp_path):
+    settings = Settings(
+        client_id="shutdown",
+        email="mail@example.com",
+        password="password",
+        appletv_enabled=False,
+        shutdown_timeout=2.0,
+        state_file=str(tmp_path / "vicare.state"),
+    )
+    payload = load_resource("heatpump_features.json")
+    deps.get_change_log(settings=settings).record("device", DeviceSnapshot.from_payload(payload))
+    action = Mock()
+    command = deps.get_command_queue(settings=settings).submit("device", "mode", "heating", action)
+
+    await deps.shutdown(settings)
+
+    assert command.status == "succeeded"
+    action.assert_called_once()
+    deps.get_change_log.cache_clear()
+    deps.restore_state(settings)
+    # changes made while the server was down are recorded on the first refresh after the restart
+    changed = copy.deepcopy(payload)
+    set_value(changed, DHW_TEMPERATURE, "value", 50)
+    changes = deps.get_change_log(settings=settings).record("device", DeviceSnapshot.from_payload(changed))
+    assert [(c.path, c.old, c.new) for c in changes] == [(f"{DHW_TEMPERATURE}.value", 48, 50)]
@@ -0,0 +1,20 @@
+import pytest
+
+from benchmarks.startup import measure_startup
+
+# generous, to catch regressions like eagerly importing a heavy integration rather than to benchmark
+FIRST_REQUEST_BUDGET_MS = 5000
+
+
+@pytest.mark.parametrize("appletv_enabled", [True, False])
+def test_startup_report(appletv_enabled: bool):
+    report = measure_startup(appletv_enabled)
+
+    assert report.status_code == 200
+    assert report.first_request_ms < FIRST_REQUEST_BUDGET_MS
+    assert 0 < report.import_ms < report.first_request_ms
+    # pyatv is only imported on first use of the Apple TV
+    assert not report.pyatv_imported
+    assert "app.main" in report.modules
+    assert "app.dependencies" in report.modules
+    assert not any(name.startswith("pyatv") for name in report.modules)
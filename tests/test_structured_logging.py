@@ -0,0 +1,107 @@
+import json
+import logging
+import logging.config
+import sys
+from pathlib import Path
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.structured_logging import (
+    REQUEST_ID_HEADER,
+    JsonFormatter,
+    RequestContextFilter,
+    RequestContextMiddleware,
+    get_request_context,
+    start_queue_listeners,
+    stop_queue_listeners,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint(_request):
+    context = get_request_context()
+    context.record_upstream_call(12.5)
+    record = logging.makeLogRecord({"name": __name__, "msg": "handling"})
+    RequestContextFilter().filter(record)
+    return PlainTextResponse(f"{record.request_id} {record.endpoint}")
+
+
+client = TestClient(RequestContextMiddleware(Starlette(routes=[Route("/endpoint", endpoint)])))
+
+
+def test_middleware_provides_request_context_with_given_request_id():
+    response = client.get("/endpoint", headers={REQUEST_ID_HEADER: "abc"})
+
+    assert response.text == "abc /endpoint"
+    assert response.headers[REQUEST_ID_HEADER] == "abc"
+
+
+def test_middleware_generates_request_id():
+    response = client.get("/endpoint")
+
+    request_id = response.headers[REQUEST_ID_HEADER]
+    assert len(request_id) == 32
+    assert response.text == f"{request_id} /endpoint"
+
+
+def test_middleware_logs_completed_request_with_upstream_timings(caplog):
+    with caplog.at_level(logging.INFO, logger="app.structured_logging"):
+        client.get("/endpoint")
+
+    record = caplog.records[-1]
+    assert record.getMessage().startswith("GET /endpoint responded 200 in ")
+    assert record.status_code == 200
+    assert record.upstream_calls == 1
+    assert record.upstream_ms == 12.5
+
+
+def test_filter_without_request_context():
+    record = logging.makeLogRecord({"msg": "outside of requests"})
+
+    assert RequestContextFilter().filter(record)
+    assert record.request_id is None
+    assert record.endpoint is None
+
+
+def test_json_formatter_includes_extra_fields_and_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logger.makeRecord(
+            __name__, logging.WARNING, __file__, 1, "port %d failed", (49152,), sys.exc_info(), extra={"port": 49152}
+        )
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "WARNING"
+    assert entry["logger"] == __name__
+    assert entry["message"] == "port 49152 failed"
+    assert entry["port"] == 49152
+    assert entry["timestamp"].endswith("Z")
+    assert "ValueError: boom" in entry["exception"]
+
+
+@pytest.mark.skipif(sys.version_info < (3, 12), reason="configuring queue handlers requires Python 3.12")
+def test_json_log_config_logs_asynchronously_via_queue(capsys):
+    with (Path(__file__).parent.parent / "log-config-json.json").open(encoding="utf-8") as f:
+        config = json.load(f)
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+
+    try:
+        logging.config.dictConfig(config)
+        logging.getLogger("app.test").info("queued %s", "message")
+        start_queue_listeners()
+        stop_queue_listeners()
+    finally:
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+    entry = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert entry["message"] == "queued message"
+    assert entry["request_id"] is None
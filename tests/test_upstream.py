@@ -0,0 +1,256 @@
+import pickle
+import socket
+from unittest.mock import Mock, patch
+
+import pytest
+from requests import ConnectionError as RequestsConnectionError
+from requests import Request, Session
+from urllib3.connectionpool import HTTPSConnectionPool
+
+from app.upstream import (
+    CircuitBreaker,
+    PooledHTTPAdapter,
+    PooledViCareOAuthManager,
+    UpstreamPoolMetrics,
+    UpstreamUnavailableError,
+)
+
+
+def create_adapter(
+    metrics: UpstreamPoolMetrics,
+    pool_size: int = 2,
+    breaker: CircuitBreaker | None = None,
+    retries: int = 0,
+) -> PooledHTTPAdapter:
+    return PooledHTTPAdapter(
+        metrics,
+        breaker or CircuitBreaker(),
+        pool_size=pool_size,
+        connect_timeout=1.5,
+        read_timeout=7.0,
+        keep_alive_idle=30,
+        retries=retries,
+        retry_backoff=0.0,
+    )
+
+
+def test_adapter_uses_configured_timeouts():
+    metrics = UpstreamPoolMetrics()
+    adapter = create_adapter(metrics)
+    request = Request("GET", "https://api.example.com/features").prepare()
+
+    with patch("requests.adapters.HTTPAdapter.send", return_value=Mock()) as send:
+        adapter.send(request, timeout=31)
+
+    assert send.call_args.kwargs["timeout"] == (1.5, 7.0)
+    assert metrics.get_metrics()["requests"] == 1
+    assert metrics.get_metrics()["in_use"] == 0
+
+
+def test_adapter_blocks_on_pool_with_keep_alive_connections():
+    adapter = create_adapter(UpstreamPoolMetrics(), pool_size=3)
+
+    pool = adapter.poolmanager.connection_from_url("https://api.example.com")
+
+    assert pool.block
+    assert pool.pool.maxsize == 3
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in adapter.poolmanager.connection_pool_kw["socket_options"]
+
+
+def test_adapter_counts_new_connections():
+    metrics = UpstreamPoolMetrics()
+    adapter = create_adapter(metrics)
+
+    pool = adapter.poolmanager.connection_from_url("https://api.example.com")
+    pool._new_conn()
+    pool._new_conn()
+
+    assert isinstance(pool, HTTPSConnectionPool)
+    assert metrics.get_metrics()["new_connections"] == 2
+
+
+def test_metrics_report_requests_waiting_for_pool():
+    metrics = UpstreamPoolMetrics()
+    metrics.set_size(2)
+
+    for _ in range(3):
+        metrics.record_request_started()
+
+    assert metrics.get_metrics() == {"size": 2, "in_use": 2, "waiting": 1, "new_connections": 0, "requests": 3}
+
+
+def test_oauth_manager_mounts_adapter_on_restored_and_renewed_session(tmp_path):
+    token_file = tmp_path / "vicare.token"
+    with token_file.open("wb") as f:
+        pickle.dump({"access_token": "token", "token_type": "Bearer", "expires_at": 4102444800}, f)
+    adapter = create_adapter(UpstreamPoolMetrics())
+
+    manager = PooledViCareOAuthManager("mail", "password", "client", str(token_file), adapter)
+    renewed = Session()
+    manager.replace_session(renewed)
+
+    assert manager.oauth_session is renewed
+    assert renewed.get_adapter("https://api.example.com") is adapter
+
+
+def test_oauth_manager_saves_token_of_current_session(tmp_path):
+    token_file = tmp_path / "vicare.token"
+    with token_file.open("wb") as f:
+        pickle.dump({"access_token": "token", "token_type": "Bearer", "expires_at": 4102444800}, f)
+    manager = PooledViCareOAuthManager(
+        "mail", "password", "client", str(token_file), create_adapter(UpstreamPoolMetrics())
+    )
+    manager.oauth_session.token = {"access_token": "renewed", "token_type": "Bearer", "expires_at": 4102444800}
+
+    assert manager.save_token() is True
+    with token_file.open("rb") as f:
+        assert pickle.load(f)["access_token"] == "renewed"
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_opens_on_failure_rate_and_rejects_calls():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window_size=10, min_calls=4, failure_rate_threshold=0.5, open_duration=30.0, clock=clock)
+
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    assert breaker.get_metrics()["state"] == "closed"
+    breaker.record_failure()
+
+    assert breaker.get_metrics()["state"] == "open"
+    clock.now = 10.0
+    with pytest.raises(UpstreamUnavailableError) as e:
+        breaker.before_call()
+    assert e.value.retry_after == 20.0
+    assert breaker.get_metrics()["rejected"] == 1
+
+
+def test_breaker_counts_slow_calls_as_failures():
+    breaker = CircuitBreaker(window_size=4, min_calls=4, failure_rate_threshold=0.5, slow_call_duration=2.0)
+
+    for duration in (0.1, 0.1, 2.5, 3.0):
+        breaker.record_success(duration)
+
+    assert breaker.get_metrics()["state"] == "open"
+    assert breaker.get_metrics()["slow_call_rate"] == 0.5
+
+
+def test_breaker_lets_single_trial_call_pass_when_half_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=1, open_duration=30.0, clock=clock)
+    breaker.record_failure()
+
+    clock.now = 30.0
+    breaker.before_call()
+    assert breaker.get_metrics()["state"] == "half_open"
+    with pytest.raises(UpstreamUnavailableError):
+        breaker.before_call()
+
+    breaker.record_success(0.1)
+    assert breaker.get_metrics()["state"] == "closed"
+    breaker.before_call()
+
+
+def test_breaker_reopens_if_trial_call_fails():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=1, open_duration=30.0, clock=clock)
+    breaker.record_failure()
+
+    clock.now = 30.0
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.get_metrics()["state"] == "open"
+    assert breaker.get_metrics()["retry_after"] == 30.0
+
+
+def test_breaker_is_no_longer_open_once_due_for_trial_call():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=1, open_duration=30.0, clock=clock)
+    assert not breaker.is_open()
+    breaker.record_failure()
+
+    assert breaker.is_open()
+    # not ready to be probed anymore even without any call, as the next one is let pass
+    clock.now = 30.0
+    assert not breaker.is_open()
+
+
+def test_adapter_retries_idempotent_requests_on_connection_errors():
+    breaker = CircuitBreaker()
+    adapter = create_adapter(UpstreamPoolMetrics(), breaker=breaker, retries=2)
+    request = Request("GET", "https://api.example.com/features").prepare()
+    response = Mock(status_code=200)
+
+    with patch("requests.adapters.HTTPAdapter.send", side_effect=[RequestsConnectionError(), response]) as send:
+        assert adapter.send(request) is response
+
+    assert send.call_count == 2
+    assert breaker.get_metrics()["calls"] == 2
+    assert breaker.get_metrics()["error_rate"] == 0.5
+
+
+def test_adapter_retries_server_errors_and_returns_last_response():
+    adapter = create_adapter(UpstreamPoolMetrics(), retries=2)
+    request = Request("GET", "https://api.example.com/features").prepare()
+    responses = [Mock(status_code=502), Mock(status_code=503), Mock(status_code=503)]
+
+    with patch("requests.adapters.HTTPAdapter.send", side_effect=responses) as send:
+        assert adapter.send(request) is responses[-1]
+
+    assert send.call_count == 3
+    responses[0].close.assert_called_once()
+
+
+def test_adapter_does_not_retry_commands():
+    adapter = create_adapter(UpstreamPoolMetrics(), retries=2)
+    request = Request("POST", "https://api.example.com/commands", json={}).prepare()
+
+    with (
+        patch("requests.adapters.HTTPAdapter.send", side_effect=RequestsConnectionError()) as send,
+        pytest.raises(RequestsConnectionError),
+    ):
+        adapter.send(request)
+
+    assert send.call_count == 1
+
+
+def test_adapter_fails_fast_while_breaker_is_open():
+    breaker = CircuitBreaker(min_calls=1)
+    breaker.record_failure()
+    adapter = create_adapter(UpstreamPoolMetrics(), breaker=breaker, retries=2)
+    request = Request("GET", "https://api.example.com/features").prepare()
+
+    with patch("requests.adapters.HTTPAdapter.send") as send, pytest.raises(UpstreamUnavailableError):
+        adapter.send(request)
+
+    send.assert_not_called()
+
+
+@pytest.mark.parametrize("error", [ValueError("invalid URL"), KeyboardInterrupt()])
+def test_adapter_does_not_leave_trial_call_in_flight_on_other_errors(error: BaseException):
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=1, open_duration=30.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 30.0
+    adapter = create_adapter(UpstreamPoolMetrics(), breaker=breaker)
+    request = Request("GET", "https://api.example.com/features").prepare()
+
+    with patch("requests.adapters.HTTPAdapter.send", side_effect=error), pytest.raises(type(error)):
+        adapter.send(request)
+
+    # the failed trial call reopened the breaker, so the next one is let pass once due again
+    assert breaker.get_metrics()["state"] == "open"
+    clock.now = 60.0
+    response = Mock(status_code=200)
+    with patch("requests.adapters.HTTPAdapter.send", return_value=response):
+        assert adapter.send(request) is response
+    assert breaker.get_metrics()["state"] == "closed"
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from app.admission import AdmissionRejectedError
+from app.upstream_executor import Priority, UpstreamExecutor
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def block(executor: UpstreamExecutor) -> threading.Event:
+    """Occupy the single worker of `executor` until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+    executor.submit(Priority.COMMAND, lambda: (started.set(), release.wait()))
+    assert started.wait(2)
+    return release
+
+
+def test_work_is_executed_by_priority_then_in_order():
+    executor = UpstreamExecutor(workers=1, queue_size=10, aging=60.0, retry_after=5)
+    release = block(executor)
+    executed = []
+    futures = [
+        executor.submit(priority, executed.append, name)
+        for priority, name in [
+            (Priority.PREFETCH, "prefetch"),
+            (Priority.INTERACTIVE, "read 1"),
+            (Priority.BACKGROUND, "refresh"),
+            (Priority.INTERACTIVE, "read 2"),
+            (Priority.COMMAND, "command"),
+        ]
+    ]
+
+    release.set()
+    for future in futures:
+        future.result(timeout=2)
+
+    assert executed == ["command", "read 1", "read 2", "refresh", "prefetch"]
+
+
+def test_waiting_work_ages_into_higher_priority():
+    clock = FakeClock()
+    executor = UpstreamExecutor(workers=1, queue_size=10, aging=10.0, retry_after=5, clock=clock)
+    release = block(executor)
+    executed = []
+    prefetch = executor.submit(Priority.PREFETCH, executed.append, "prefetch")
+    clock.now += 25
+    read = executor.submit(Priority.INTERACTIVE, executed.append, "read")
+
+    release.set()
+    prefetch.result(timeout=2)
+    read.result(timeout=2)
+
+    assert executed == ["prefetch", "read"]
+    assert executor.get_metrics()["prefetch"]["wait_max_ms"] == 25000
+
+
+def test_full_queue_rejects_work_of_its_class_only():
+    executor = UpstreamExecutor(workers=1, queue_size=1, aging=10.0, retry_after=5)
+    release = block(executor)
+    executor.submit(Priority.PREFETCH, lambda: None)
+
+    with pytest.raises(AdmissionRejectedError) as error:
+        executor.submit(Priority.PREFETCH, lambda: None)
+    assert error.value.retry_after == 5
+    executor.submit(Priority.COMMAND, lambda: None)
+    release.set()
+
+    assert executor.get_metrics()["prefetch"]["rejected"] == 1
+
+
+def test_cancel_cancels_queued_work_of_given_classes():
+    executor = UpstreamExecutor(workers=1, queue_size=10, aging=10.0, retry_after=5)
+    release = block(executor)
+    read = executor.submit(Priority.INTERACTIVE, lambda: "read")
+    command = executor.submit(Priority.COMMAND, lambda: "command")
+
+    assert executor.cancel([Priority.INTERACTIVE, Priority.PREFETCH]) == 1
+    release.set()
+
+    assert read.cancelled()
+    assert command.result(timeout=2) == "command"
+    assert executor.get_metrics()["interactive"]["cancelled"] == 1
+
+
+def test_exceptions_are_passed_to_the_future():
+    executor = UpstreamExecutor(workers=1, queue_size=10, aging=10.0, retry_after=5)
+
+    future = executor.submit(Priority.INTERACTIVE, lambda: 1 / 0)
+
+    with pytest.raises(ZeroDivisionError):
+        future.result(timeout=2)